@@ -2,7 +2,9 @@
 
 import logging
 import logging.config
+import logging.handlers
 import traceback
+import atexit
 import threading
 import time
 import argparse
@@ -10,18 +12,29 @@ import sys
 import datetime
 import re
 import urllib3
-import io
 import os
 import signal
 import socket
 import platform
 import json
 import gzip
+import hashlib
+import queue
+import bisect
+import math
+import asyncio
+import heapq
+import tracemalloc
+import importlib.util
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from collections import deque
 from pathlib import Path
 from urllib.parse import urljoin
 from urllib.parse import urlparse
 
+import packarchive
+import logcheck
+
 
 # Exceptions handling
 def handle_threading_exception(args):
@@ -38,12 +51,18 @@ def handle_sys_exception(exc_type, exc_value, tb):
 # Http requests
 def request3(logger, headers:dict, url:str, method:str, dsttype:str, metricstopublish:dict):
   headers.update({'User-Agent': 'CanaryMonitor (v2.0)'})
+  if userargs['replay']:
+    return replayrequest(logger, url, dsttype)
   start = time.perf_counter()
   try:
     response = http.request(method, url, headers = headers, retries = False, decode_content = False)
+    if dsttype == 'segment':
+      addnestedphasetime('segments', start)
+    if userargs['flightrecorder'] == True:
+      recordflightresponse(logger, dsttype, method, url, response, int((time.perf_counter() - start) * 1000))
     if response.status >= 400:
-      logger.warning('HTTP request response ' + str(response.status) + ', reason: ' + str(response.reason) + ', url: ' + url + ', response headers: ' + str(response.headers.items()))
-      if userargs['cwmetrics']:
+      logger.warning('HTTP request response %s, reason: %s, url: %s, response headers: %s', response.status, response.reason, url, response.headers.items())
+      if userargs['metrics']:
         if response.status >= 400 and response.status < 500:
           if dsttype == 'manifest':
             metricstopublish['manifest4xx'] = 1
@@ -62,25 +81,29 @@ def request3(logger, headers:dict, url:str, method:str, dsttype:str, metricstopu
     else:
       return response, int((time.perf_counter() - start) * 1000)
   except urllib3.exceptions.NewConnectionError as e:
-    logger.warning('HTTP request connection error, url: ' + url + ', exception: ' + str(e))
+    logger.warning('HTTP request connection error, url: %s, exception: %s', url, e)
   except urllib3.exceptions.ConnectTimeoutError as e:
-    logger.warning('HTTP request connection timeout, url: ' + url + ', exception: ' + str(e))
+    logger.warning('HTTP request connection timeout, url: %s, exception: %s', url, e)
   except urllib3.exceptions.ReadTimeoutError as e:
-    logger.warning('HTTP request read timeout, url: ' + url + ', exception: ' + str(e))
+    logger.warning('HTTP request read timeout, url: %s, exception: %s', url, e)
   except urllib3.exceptions.SSLError as e:
-    logger.warning('HTTP request SSL error, url: ' + url + ', exception: ' + str(e))
+    logger.warning('HTTP request SSL error, url: %s, exception: %s', url, e)
   except urllib3.exceptions.HTTPError as e:
-    logger.warning('HTTP request error, url: ' + url + ', exception: ' + str(e))
+    logger.warning('HTTP request error, url: %s, exception: %s', url, e)
   except socket.timeout:
-    logger.warning('HTTP request socket timeout, url: ' + url)
+    logger.warning('HTTP request socket timeout, url: %s', url)
   except socket.gaierror:
-    logger.warning('HTTP request name or service not known error, url: ' + url)
+    logger.warning('HTTP request name or service not known error, url: %s', url)
   except OSError:
-    logger.warning('HTTP request OS error, url: ' + url)
+    logger.warning('HTTP request OS error, url: %s', url)
   except Exception as e:
     logger.exception(e)
+  if dsttype == 'segment':
+    addnestedphasetime('segments', start)
+  if userargs['flightrecorder'] == True:
+    recordflightresponse(logger, dsttype, method, url, None, int((time.perf_counter() - start) * 1000))
   # Collect info for metrics
-  if userargs['cwmetrics']:
+  if userargs['metrics']:
     if dsttype == 'manifest':
       metricstopublish['manifesttimeouterror'] = 1
     elif dsttype == 'tracking':
@@ -90,6 +113,198 @@ def request3(logger, headers:dict, url:str, method:str, dsttype:str, metricstopu
   return None, int((time.perf_counter() - start) * 1000)
 
 
+# Clock of monitoring threads [seconds], time of the replayed manifest with --replay
+def monotonicclock():
+  if userargs['replay']:
+    return replayclock.time
+  return time.perf_counter()
+
+
+# UTC time of monitoring threads, time of the replayed manifest with --replay
+def utcnow():
+  if userargs['replay']:
+    return datetime.datetime.utcfromtimestamp(replayclock.time)
+  return datetime.datetime.utcnow()
+
+
+# Wait between manifest requests, with --replay the clock moves to the next archived manifest without waiting
+def monitorsleep(seconds:float):
+  if userargs['replay']:
+    advancereplayclock()
+  else:
+    time.sleep(seconds)
+
+
+# Archived manifest replayed in place of HTTP response
+class replayresponse:
+  def __init__(self, data:bytes, gzipped:bool):
+    self.status = 200
+    self.reason = 'OK'
+    self.headers = urllib3._collections.HTTPHeaderDict({'Content-Encoding': 'gzip'} if gzipped else {})
+    self.data = data
+
+
+# Archived manifest files and pack files of a rendition folder including day folders, in time order
+def findreplayfiles(folder):
+  files = []
+  for path in [folder] + [i for i in folder.iterdir() if i.is_dir() and re.fullmatch(r'\d{4}-\d{2}-\d{2}', i.name)]:
+    for i in path.iterdir():
+      name = i.name[:-3] if i.name.endswith('.gz') else i.name
+      if i.is_file() and (name.endswith('.pack') or (name.endswith(('.m3u8', '.mpd', '.Manifest')) and '_primary' not in name)):
+        files.append(i)
+  return sorted(files, key = lambda i: i.name)
+
+
+# Archived manifests of a rendition folder as (time [seconds], content, gzipped), the time is taken from file names or pack records
+def iterreplayresponses(logger, folder):
+  for path in findreplayfiles(folder):
+    if path.name.endswith('.pack'):
+      try:
+        for record in packarchive.iterpackcontents(path):
+          if '_primary' not in record['filename']:
+            yield record['timestamp'] / 1000000, record['content'], False
+      except Exception:
+        logger.exception('Error reading pack file %s', path)
+      continue
+    try:
+      filetime = datetime.datetime.strptime(path.name[0:26], '%Y_%m_%d_%H_%M_%S_%f').replace(tzinfo = datetime.timezone.utc).timestamp()
+    except ValueError:
+      logger.warning('Skipping file without time in file name: %s', path)
+      continue
+    try:
+      with path.open('rb') as f:
+        yield filetime, f.read(), path.name.endswith('.gz')
+    except Exception:
+      logger.exception('Error reading file %s', path)
+
+
+# Move the clock of the replaying thread to the next archived manifest, stop monitoring after the last one
+def advancereplayclock():
+  replayclock.pending = next(replayclock.responses, None)
+  if replayclock.pending:
+    replayclock.time = replayclock.pending[0]
+  else:
+    replayclock.stoprunning.set()
+
+
+# Return the archived manifest at the clock of the replaying thread, segment and tracking requests are not replayed
+def replayrequest(logger, url:str, dsttype:str):
+  if dsttype != 'manifest':
+    return None, 0
+  if replayclock.pending == None:
+    advancereplayclock()
+  entry = replayclock.pending ; replayclock.pending = None
+  if entry == None:
+    return None, 0
+  response = replayresponse(entry[1], entry[2])
+  replayclock.count = replayclock.count + 1 ; replayclock.size = replayclock.size + len(entry[1])
+  if userargs['flightrecorder'] == True:
+    recordflightresponse(logger, dsttype, 'GET', url, response, 0)
+  return response, 0
+
+
+# Record response in the flight recorder ring buffer of the rendition, segment bodies are not kept
+def recordflightresponse(logger, dsttype:str, method:str, url:str, response, responsetime:int):
+  renditionname = logger.extra['renditionname'] if hasattr(logger, 'extra') else threading.current_thread().name
+  entry = {'time': time.time(), 'type': dsttype, 'method': method, 'url': url, 'responsetime': responsetime,
+           'status': response.status if response else None, 'headers': dict(response.headers) if response else {},
+           'body': response.data if response and dsttype != 'segment' else None, 'dropped': False}
+  entry['size'] = (len(entry['body']) if entry['body'] else 0) + len(url) + 500
+  with flightrecorderlock:
+    capture = flightrecordercaptures.get(renditionname)
+    if capture:
+      # Responses after a flush go directly to disk
+      capture['remaining'] = capture['remaining'] - 1
+      if capture['remaining'] <= 0:
+        del flightrecordercaptures[renditionname]
+    else:
+      buffer = flightrecorder.setdefault(renditionname, deque())
+      if len(buffer) >= userargs['flightrecordersize']:
+        dropped = buffer.popleft()
+        dropped['dropped'] = True
+        flightrecorderstats['memory'] = flightrecorderstats['memory'] - dropped['size']
+      buffer.append(entry)
+      flightrecorderorder.append((renditionname, entry))
+      flightrecorderstats['memory'] = flightrecorderstats['memory'] + entry['size']
+      # Evict oldest responses of all renditions above memory cap
+      while flightrecorderstats['memory'] > userargs['flightrecordermemory'] * 1048576 and flightrecorderorder:
+        oldestrenditionname, oldest = flightrecorderorder.popleft()
+        if not oldest['dropped']:
+          oldest['dropped'] = True
+          flightrecorder[oldestrenditionname].popleft()
+          flightrecorderstats['memory'] = flightrecorderstats['memory'] - oldest['size']
+      # Compact order queue when it holds mostly dropped responses
+      if len(flightrecorderorder) > 4 * userargs['flightrecordersize'] * max(1, len(flightrecorder)):
+        buffered = sorted(((name, j) for name, i in flightrecorder.items() for j in i), key = lambda i: i[1]['time'])
+        flightrecorderorder.clear()
+        flightrecorderorder.extend(buffered)
+      return
+  writeflightrecording(logger, capture['folder'], None, [entry])
+
+
+# Flush flight recorder of a rendition after a warning, the next --flightrecorderafter responses are saved too
+def flushflightrecorder(logger, renditionname:str, warning:str):
+  with flightrecorderlock:
+    capture = flightrecordercaptures.get(renditionname)
+    if capture:
+      capture['remaining'] = userargs['flightrecorderafter']
+      entries = []
+    else:
+      capture = {'folder': Path(userargs['flightrecorderfolder'], renditionname, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f')), 'remaining': userargs['flightrecorderafter']}
+      if capture['remaining'] > 0:
+        flightrecordercaptures[renditionname] = capture
+      entries = list(flightrecorder.get(renditionname, []))
+      for i in entries:
+        i['dropped'] = True
+        flightrecorderstats['memory'] = flightrecorderstats['memory'] - i['size']
+      flightrecorder.get(renditionname, deque()).clear()
+    flightrecorderstats['flushes'] = flightrecorderstats['flushes'] + 1
+  writeflightrecording(logger, capture['folder'], warning, entries)
+
+
+# Write flight recorder responses on archive writer threads, response metadata goes to responses.jsonl
+def writeflightrecording(logger, folderpath, warning, entries:list):
+  if userargs['archivewriters'] > 0:
+    enqueuearchivetask(logger, str(folderpath), writeflightresponses, (folderpath, warning, entries))
+  else:
+    writeflightresponses(logger, folderpath, warning, entries)
+
+
+def writeflightresponses(logger, folderpath, warning, entries:list):
+  if not createfolder(logger, folderpath):
+    return
+  lines = []
+  if warning:
+    lines.append(json.dumps({'time': datetime.datetime.utcnow().isoformat() + 'Z', 'warning': warning}))
+  try:
+    for i in entries:
+      metadata = {k: v for k, v in i.items() if k not in ('body', 'dropped', 'size')}
+      metadata['time'] = datetime.datetime.utcfromtimestamp(i['time']).isoformat() + 'Z'
+      if i['body'] != None:
+        metadata['file'] = datetime.datetime.utcfromtimestamp(i['time']).strftime('%Y_%m_%d_%H_%M_%S_%f') + '_' + i['type'] + '_' + urlparse(i['url']).path.split('/')[-1][-60:]
+        with Path(folderpath, metadata['file']).open('w+b') as f:
+          f.write(i['body'])
+        addbatchfile(Path(folderpath, metadata['file']))
+      lines.append(json.dumps(metadata))
+    with Path(folderpath, 'responses.jsonl').open('a') as f:
+      f.write('\n'.join(lines) + '\n')
+    addbatchfile(Path(folderpath, 'responses.jsonl'))
+  except Exception:
+    logger.exception('Error saving flight recorder responses')
+
+
+# Logging handler triggering flight recorder flush on configured warnings of monitoring threads
+class flightrecorderhandler(logging.Handler):
+  def emit(self, record):
+    if not hasattr(record, 'renditionname'):
+      return
+    message = record.getMessage()
+    for i in userargs['flightrecordertriggers']:
+      if message.startswith(i):
+        flushflightrecorder(logging.LoggerAdapter(logging.getLogger(record.name), {'endpointtype': record.endpointtype, 'renditionname': record.renditionname}), record.renditionname, message[0:1000])
+        break
+
+
 # Get response text
 def getresponsetext(response, utf:bool):
   foundcontentencodinggzip = False
@@ -108,61 +323,396 @@ def getresponsetext(response, utf:bool):
     return text
 
 
-# Save response
+# Save response, the file is written by archive writer threads when enabled
 def saveresponse(logger, content, folder, filename:str, binary:bool, compress:bool):
+  start = time.perf_counter()
   if userargs['dayfolder'] == True:
     folderpath = Path(folder, datetime.datetime.utcnow().strftime('%Y-%m-%d'))
   else:
     folderpath = Path(folder)
+  if binary and userargs['segmentstore'] == True:
+    filepath = None
+    function = storesegment ; args = (folderpath, filename, content)
+  elif not binary and userargs['archiveformat'] in ('pack', 'delta'):
+    timestamp = int(time.time() * 1000000)
+    filepath = Path(folderpath, packarchive.packname(timestamp) + '.pack')
+    function = writepackrecord ; args = (folderpath, filename, timestamp, content, compress)
+  else:
+    if not binary and userargs['gzip'] == True:
+      filepath = Path(folderpath, filename + '.gz')
+    else:
+      filepath = Path(folderpath, filename)
+    function = writeresponse ; args = (folderpath, filepath, content, binary, compress)
+  if userargs['archivewriters'] > 0:
+    if not enqueuearchivetask(logger, str(folderpath), function, args):
+      filepath = None
+  else:
+    filepath = function(logger, *args)
+  addnestedphasetime('archive', start)
+  return filepath
+
+
+# Create folder unless it was already created by this process
+def createfolder(logger, folderpath):
+  if str(folderpath) in createdfolders:
+    return True
   try:
     folderpath.mkdir(parents = True, exist_ok = True)
   except Exception:
     logger.exception('Error creating directory')
+    return False
+  createdfolders.add(str(folderpath))
+  return True
+
+
+# Write response to file
+def writeresponse(logger, folderpath, filepath, content, binary:bool, compress:bool):
+  if not createfolder(logger, folderpath):
     return
   now = time.perf_counter()
-  if binary:
-    filepath = Path(folderpath, filename)
+  try:
+    if not binary:
+      if userargs['gzip'] == True and compress:
+        content = compressarchived(packarchive.compressgzip, content.encode('utf-8'))[1]
+      elif type(content) == str:
+        content = content.encode('utf-8')
+    with filepath.open('w+b') as f:
+      f.write(content)
+      if userargs['archivefsync'] == 'file':
+        f.flush()
+        os.fsync(f.fileno())
+    addbatchfile(filepath)
+  except Exception:
+    logger.exception('Error saving file')
+    return
+  timeittook = time.perf_counter() - now
+  if timeittook > 2:
+    logger.error('It took %.3f seconds to save file %s', timeittook, filepath)
+  return filepath
+
+
+# Append response to the hourly pack file of the folder, as delta to the previous response with --archiveformat delta, see packarchive.py for the format
+def writepackrecord(logger, folderpath, filename:str, timestamp:int, content, compress:bool):
+  if not createfolder(logger, folderpath):
+    return
+  now = time.perf_counter()
+  if userargs['archiveformat'] == 'delta' or userargs['zstd'] == True:
+    # Deltas and zstd dictionaries work on uncompressed content
+    if type(content) == str:
+      content = content.encode('utf-8')
+    elif userargs['gzip'] == True and not compress:
+      content = gzip.decompress(content)
+  else:
+    codec = packarchive.codecnone
+    if userargs['gzip'] == True:
+      codec = packarchive.codecgzip
+      if compress:
+        codec, content = compressarchived(packarchive.compressgzip, content.encode('utf-8'))
+    elif type(content) == str:
+      content = content.encode('utf-8')
+  name = packarchive.packname(timestamp)
+  with packwriterslock:
+    if str(folderpath) not in packwriters:
+      packwriters[str(folderpath)] = {'writer': None, 'zstd': None, 'lock': threading.Lock()}
+    pack = packwriters[str(folderpath)]
+  with pack['lock']:
     try:
-      with filepath.open('w+b') as f:
-        f.write(content)
+      if pack['writer'] == None or pack['writer']['name'] != name:
+        if pack['writer'] != None:
+          packarchive.closepackwriter(pack['writer'])
+          pack['writer'] = None
+        pack['writer'] = packarchive.openpackwriter(folderpath, name)
+      if userargs['zstd'] == True and pack['zstd'] == None:
+        pack['zstd'] = packarchive.createzstdstate(userargs['zstdsamples'], userargs['zstdrotate'])
+      if userargs['archiveformat'] == 'delta':
+        # Keyframes compressed only for comparison with a smaller delta are not counted in compression metrics
+        compresstime = [0.0] ; compressfunction = None
+        if userargs['zstd'] == True:
+          packarchive.samplezstd(folderpath, pack['zstd'], content)
+          compressfunction = lambda data: timecompression(lambda i: packarchive.compresszstd(folderpath, pack['zstd'], i, False), data, compresstime)
+        elif userargs['gzip'] == True:
+          compressfunction = lambda data: timecompression(packarchive.compressgzip, data, compresstime)
+        codec, payload = packarchive.encodecontent(pack['writer'], content, compressfunction, userargs['keyframeinterval'])
+        if compressfunction != None and codec != packarchive.codecdelta:
+          recordcompression(len(content), len(payload), compresstime[0])
+        content = payload
+      elif userargs['zstd'] == True:
+        codec, content = compressarchived(lambda i: packarchive.compresszstd(folderpath, pack['zstd'], i), content)
+      packarchive.appendpackrecord(pack['writer'], timestamp, filename, codec, content)
+      if userargs['archivefsync'] == 'file':
+        os.fsync(pack['writer']['pack'].fileno())
+        os.fsync(pack['writer']['index'].fileno())
+      addbatchfile(Path(folderpath, name + '.pack')) ; addbatchfile(Path(folderpath, name + '.idx'))
     except Exception:
-      logger.exception('Error saving file')
+      logger.exception('Error saving record to pack file')
+      # Next record starts with a keyframe in a reopened pack file
+      if pack['writer'] != None:
+        packarchive.closepackwriter(pack['writer'])
+        pack['writer'] = None
       return
-  else:
-    if userargs['gzip'] == True:
-      filepath = Path(folderpath, filename + '.gz')
-      try:
-        if compress:
-          with gzip.open(str(filepath), 'w+b') as f:
-            with io.TextIOWrapper(f, encoding='utf-8') as tiow:
-              tiow.write(content)
-        else:
-          with filepath.open('w+b') as f:
-            f.write(content)
-      except Exception:
-        logger.exception('Error saving file')
-        return
+    filepath = Path(folderpath, name + '.pack')
+  timeittook = time.perf_counter() - now
+  if timeittook > 2:
+    logger.error('It took %.3f seconds to save record %s to %s', timeittook, filename, filepath)
+  return filepath
+
+
+# Store segment once under its SHA-256 hash in the blobs folder and add a reference to the index of the rendition
+# The first writer of a blob writes it, later writers of the same segment wait until it is written
+def storesegment(logger, folderpath, filename:str, content:bytes):
+  if not createfolder(logger, folderpath):
+    return
+  now = time.perf_counter()
+  digest = hashlib.sha256(content).hexdigest()
+  with segmentstorelock:
+    blob = segmentstore['blobs'].get(digest)
+    newblob = blob == None
+    if newblob:
+      blob = {'path': Path(userargs['segmentsfolder'], 'blobs', digest[0:2], digest + Path(filename).suffix), 'size': len(content), 'referenced': time.time(), 'pending': threading.Event()}
+      segmentstore['blobs'][digest] = blob
+      segmentstore['storedbytes'] = segmentstore['storedbytes'] + len(content)
+      segmentstore['totalsize'] = segmentstore['totalsize'] + len(content)
     else:
-      filepath = Path(folderpath, filename)
+      blob['referenced'] = time.time()
+    pending = blob.get('pending')
+  if newblob:
+    temporarypath = Path(str(blob['path']) + '.' + threading.current_thread().name + '.tmp')
+    try:
+      if not createfolder(logger, blob['path'].parent):
+        raise OSError('Unable to create blobs folder')
+      with temporarypath.open('w+b') as f:
+        f.write(content)
+        if userargs['archivefsync'] == 'file':
+          f.flush()
+          os.fsync(f.fileno())
+      os.replace(temporarypath, blob['path'])
+      addbatchfile(blob['path'])
+    except Exception:
+      logger.exception('Error storing segment ' + filename)
       try:
-        with filepath.open('w+t') as f:
-          f.write(content)
-      except Exception:
-        logger.exception('Error saving file')
-        return
+        temporarypath.unlink()
+      except OSError:
+        pass
+      with segmentstorelock:
+        segmentstore['blobs'].pop(digest, None)
+        segmentstore['storedbytes'] = segmentstore['storedbytes'] - len(content)
+        segmentstore['totalsize'] = segmentstore['totalsize'] - len(content)
+      return
+    finally:
+      with segmentstorelock:
+        blob.pop('pending', None)
+      pending.set()
+  elif pending != None:
+    pending.wait()
+    with segmentstorelock:
+      stored = segmentstore['blobs'].get(digest) is blob
+    # Blob was not written by its first writer, the segment is stored again
+    if not stored:
+      return storesegment(logger, folderpath, filename, content)
+  try:
+    # Modification time of blob is the time of its last reference, used by retention after restart
+    if not newblob:
+      os.utime(blob['path'])
+    with Path(folderpath, 'references.tsv').open('a') as f:
+      f.write(filename + '\t' + digest + '\t' + str(len(content)) + '\n')
+    addbatchfile(Path(folderpath, 'references.tsv'))
+  except Exception:
+    logger.exception('Error storing segment ' + filename)
+    return
+  with segmentstorelock:
+    segmentstore['referencedbytes'] = segmentstore['referencedbytes'] + len(content)
   timeittook = time.perf_counter() - now
   if timeittook > 2:
-    logger.error('It took ' + '{:.3f}'.format(timeittook) + ' seconds to save file ' + str(filepath))
-  return filepath
+    logger.error('It took %.3f seconds to store segment %s as %s', timeittook, filename, blob['path'])
+  return blob['path']
+
+
+# Load blobs stored by previous runs
+def loadsegmentstore(logger):
+  for blobpath in Path(userargs['segmentsfolder'], 'blobs').glob('*/*'):
+    if blobpath.suffix == '.tmp':
+      continue
+    try:
+      stat = blobpath.stat()
+    except OSError:
+      continue
+    segmentstore['blobs'][blobpath.name.split('.')[0]] = {'path': blobpath, 'size': stat.st_size, 'referenced': stat.st_mtime}
+    segmentstore['totalsize'] = segmentstore['totalsize'] + stat.st_size
+  logger.info('Segment store has %s blobs, %.1f MB', len(segmentstore['blobs']), segmentstore['totalsize'] / 1048576)
+
+
+# Remove least recently referenced blobs older than --segmentstoreage or above --segmentstoresize
+def evictsegmentblobs(logger):
+  now = time.time()
+  maxage = userargs['segmentstoreage'] * 3600
+  maxsize = userargs['segmentstoresize'] * 1048576
+  with segmentstorelock:
+    blobs = sorted(segmentstore['blobs'].items(), key = lambda i: i[1]['referenced'])
+    totalsize = segmentstore['totalsize']
+  evicted = 0 ; evictedsize = 0
+  for digest, blob in blobs:
+    if not ((maxage > 0 and now - blob['referenced'] > maxage) or (maxsize > 0 and totalsize > maxsize)):
+      break
+    with segmentstorelock:
+      # Skip blob referenced again in the meantime or still written by its first writer
+      if segmentstore['blobs'].get(digest) is not blob or blob['referenced'] > now or 'pending' in blob:
+        continue
+      segmentstore['blobs'].pop(digest)
+      segmentstore['totalsize'] = segmentstore['totalsize'] - blob['size']
+    totalsize = totalsize - blob['size']
+    try:
+      blob['path'].unlink()
+    except FileNotFoundError:
+      pass
+    except Exception:
+      logger.exception('Error removing blob ' + str(blob['path']))
+    evicted = evicted + 1 ; evictedsize = evictedsize + blob['size']
+  if evicted > 0:
+    logger.info('Removed %s blobs (%.1f MB) from segment store', evicted, evictedsize / 1048576)
+
+
+# Compress archived content and record compression ratio and CPU time, returns (codec, payload)
+def compressarchived(compress, content:bytes):
+  start = time.thread_time()
+  codec, payload = compress(content)
+  recordcompression(len(content), len(payload), (time.thread_time() - start) * 1000)
+  return codec, payload
 
 
-# Publish metrics to CloudWatch
+# Compress without recording metrics, adds CPU time [milliseconds] to cputime[0]
+def timecompression(compress, content:bytes, cputime:list):
+  start = time.thread_time()
+  result = compress(content)
+  cputime[0] = cputime[0] + (time.thread_time() - start) * 1000
+  return result
+
+
+# Helper
+def recordcompression(rawsize:int, compressedsize:int, cputime:float):
+  with archivestatslock:
+    archivestats['rawbytes'] = archivestats['rawbytes'] + rawsize
+    archivestats['compressedbytes'] = archivestats['compressedbytes'] + compressedsize
+    recordhistogramvalue(archivestats['compresstime'], round(cputime, 3))
+
+
+# Queue archive task, tasks with the same key (folder) go to the same writer to keep their order
+def enqueuearchivetask(logger, key:str, function, args:tuple):
+  archivequeue = archivequeues[hash(key) % len(archivequeues)]
+  try:
+    if userargs['archivedrop'] == True:
+      archivequeue.put_nowait((function, args, time.perf_counter()))
+    else:
+      # Backpressure, the monitoring thread waits for a free slot
+      archivequeue.put((function, args, time.perf_counter()))
+  except queue.Full:
+    with archivestatslock:
+      archivestats['dropped'] = archivestats['dropped'] + 1
+    return False
+  return True
+
+
+# Keep a file written on an archive writer thread for the fsync at the end of its batch with --archivefsync batch
+def addbatchfile(filepath):
+  files = getattr(archivebatch, 'files', None)
+  if files != None:
+    files.add(str(filepath))
+
+
+# Fsync the files written in a batch of an archive writer thread and then their folders, so that new files and renamed blobs are durable
+# Folders cannot be opened on Windows and are not synced there
+def syncbatchfiles(logger):
+  folders = set()
+  for filepath in archivebatch.files:
+    try:
+      fd = os.open(filepath, os.O_RDWR)
+      try:
+        os.fsync(fd)
+      finally:
+        os.close(fd)
+    except FileNotFoundError:
+      continue
+    except OSError:
+      logger.exception('Error syncing file ' + filepath)
+    folders.add(os.path.dirname(filepath))
+  archivebatch.files.clear()
+  if platform.system() == 'Windows':
+    return
+  for folder in folders:
+    try:
+      fd = os.open(folder, os.O_RDONLY)
+      try:
+        os.fsync(fd)
+      finally:
+        os.close(fd)
+    except OSError:
+      logger.exception('Error syncing folder ' + folder)
+
+
+# Archive writer thread, takes tasks in batches and runs them in order
+def archivewriter(logger, archivequeue):
+  batch = []
+  if userargs['archivefsync'] == 'batch':
+    archivebatch.files = set()
+  while not terminatethreads or not archivequeue.empty():
+    try:
+      batch.append(archivequeue.get(timeout = 1))
+    except queue.Empty:
+      continue
+    while len(batch) < userargs['archivebatchsize']:
+      try:
+        batch.append(archivequeue.get_nowait())
+      except queue.Empty:
+        break
+    writetimes = []
+    for function, args, queuedtime in batch:
+      start = time.perf_counter()
+      try:
+        function(logger, *args)
+      except Exception:
+        logger.exception('Error in archive writer')
+      writetimes.append((time.perf_counter() - start) * 1000)
+    if userargs['archivefsync'] == 'batch':
+      syncbatchfiles(logger)
+    with archivestatslock:
+      archivestats['written'] = archivestats['written'] + len(batch)
+      for i in writetimes:
+        recordhistogramvalue(archivestats['writetime'], round(i, 1))
+    batch.clear()
+
+
+# Get archive writers metrics since last call
+def getarchivemetrics():
+  with archivestatslock:
+    metricstopublish = {'archivequeuedepth': sum(i.qsize() for i in archivequeues), 'archivewritten': archivestats['written'], 'archivedropped': archivestats['dropped']}
+    if archivestats['writetime']['count'] > 0:
+      metricstopublish['archivewritetime'] = archivestats['writetime']
+    if archivestats['compressedbytes'] > 0:
+      metricstopublish['archivecompressionratio'] = round(archivestats['rawbytes'] / archivestats['compressedbytes'], 2)
+      metricstopublish['archivecompresstime'] = archivestats['compresstime']
+    archivestats['written'] = 0 ; archivestats['dropped'] = 0 ; archivestats['writetime'] = createhistogram()
+    archivestats['rawbytes'] = 0 ; archivestats['compressedbytes'] = 0 ; archivestats['compresstime'] = createhistogram()
+  if userargs['segmentstore'] == True:
+    with segmentstorelock:
+      if segmentstore['storedbytes'] > 0:
+        metricstopublish['segmentdedupratio'] = round(segmentstore['referencedbytes'] / segmentstore['storedbytes'], 2)
+      metricstopublish['segmentstoresize'] = round(segmentstore['totalsize'] / 1048576, 1)
+  return metricstopublish
+
+
+# Publish metrics to CloudWatch and / or EMF log file
 def publishmetrics(logger, endpoint:dict, renditionname:str, metricstopublish:dict):
+  if userargs['emf'] == True and metricstopublish:
+    emfqueue.put(({'Endpoint': renditionname, 'Type': endpoint['type']}, metricstopublish.copy()))
+  if userargs['prometheus'] == True:
+    accumulateprometheusmetrics(renditionname, endpoint['type'], metricstopublish)
+  if userargs['cwmetrics'] == False:
+    return
   publishlist = []
   for k in metricstopublish.keys():
     if type(metricstopublish[k]) == dict:
       try:
-        publishlist.append({'MetricName': k, 'Dimensions': [{'Name': 'Endpoint', 'Value': renditionname}, {'Name': 'Type', 'Value': endpoint['type']}], 'Values': metricstopublish[k]['values'], 'Counts': metricstopublish[k]['counts']})
+        for values, counts in histogramtocloudwatch(metricstopublish[k]):
+          publishlist.append({'MetricName': k, 'Dimensions': [{'Name': 'Endpoint', 'Value': renditionname}, {'Name': 'Type', 'Value': endpoint['type']}], 'Values': values, 'Counts': counts})
       except KeyError:
         logger.exception('Bad key')
     else:
@@ -179,7 +729,210 @@ def publishmetrics(logger, endpoint:dict, renditionname:str, metricstopublish:di
       logger.exception('Error sending metrics to Cloudwatch')
     timeittook = time.perf_counter() - now
     if timeittook > 7:
-      logger.error('It took ' + '{:.3f}'.format(timeittook) + ' seconds to publish metrics')
+      logger.error('It took %.3f seconds to publish metrics', timeittook)
+
+
+# Publish main thread metrics to CloudWatch and / or EMF log file
+def publishmainmetrics(logger, metricstopublish:dict):
+  if userargs['emf'] == True:
+    emfqueue.put(({'Property': userargs['label']}, metricstopublish.copy()))
+  if userargs['prometheus'] == True:
+    for k in metricstopublish.keys():
+      if type(metricstopublish[k]) == dict:
+        for percentile, value in histogrampercentiles(metricstopublish[k]).items():
+          prometheusmainmetrics[k + '_' + percentile] = value
+      else:
+        prometheusmainmetrics[k] = metricstopublish[k]
+  if userargs['cwmetrics'] == True:
+    publishlist = []
+    for k in metricstopublish.keys():
+      if type(metricstopublish[k]) == dict:
+        for values, counts in histogramtocloudwatch(metricstopublish[k]):
+          publishlist.append({'MetricName': k, 'Dimensions': [{'Name': 'Property', 'Value': userargs['label']}], 'Values': values, 'Counts': counts})
+      else:
+        publishlist.append({'MetricName': k, 'Dimensions': [{'Name': 'Property', 'Value': userargs['label']}], 'Value': metricstopublish[k]})
+    try:
+      cloudwatch.put_metric_data(Namespace = 'CanaryMonitor', MetricData = publishlist)
+    except Exception:
+      logger.exception('Error sending main thread metrics to Cloudwatch')
+
+
+# Values of a collected EMF metric in chunks of at most 100 values, EMF has no counts so histogram buckets are repeated only here
+def emfvaluechunks(collected):
+  if type(collected) == list:
+    for i in range(0, len(collected), 100):
+      yield collected[i:i + 100]
+    return
+  chunk = []
+  for value, count in zip(*histogramvaluescounts(collected)):
+    while count > 0:
+      n = min(count, 100 - len(chunk))
+      chunk.extend([value] * n) ; count = count - n
+      if len(chunk) == 100:
+        yield chunk
+        chunk = []
+  if chunk:
+    yield chunk
+
+
+# Create EMF documents, one per dimension set, from metrics collected since last flush
+def createemfdocuments(collected:dict, timestamp:int):
+  documents = []
+  for dimensions in collected.keys():
+    metrics = collected[dimensions]
+    metricnames = list(metrics.keys())
+    # EMF allows at most 100 metrics per document and 100 values per metric, more values go into further documents
+    for i in range(0, len(metricnames), 100):
+      chunks = {k: emfvaluechunks(metrics[k]) for k in metricnames[i:i + 100]}
+      while chunks:
+        document = {'_aws': {'Timestamp': timestamp, 'CloudWatchMetrics': [{'Namespace': 'CanaryMonitor', 'Dimensions': [[k for k, v in dimensions]], 'Metrics': []}]}}
+        for k, v in dimensions:
+          document[k] = v
+        for metricname in list(chunks.keys()):
+          values = next(chunks[metricname], None)
+          if values == None:
+            del chunks[metricname]
+            continue
+          document['_aws']['CloudWatchMetrics'][0]['Metrics'].append({'Name': metricname})
+          document[metricname] = values[0] if len(values) == 1 else values
+        if document['_aws']['CloudWatchMetrics'][0]['Metrics']:
+          documents.append(json.dumps(document, separators = (',', ':')))
+  return documents
+
+
+# Write metrics in CloudWatch Embedded Metric Format, to be shipped by the CloudWatch agent
+def emfwriter(logger, filename:str):
+  collected = {} ; nextflushtime = time.perf_counter() + userargs['emfinterval']
+  try:
+    # Buffered writer, the monitoring threads only put metrics into the queue
+    f = open(filename, 'a', buffering = 1024 * 1024, encoding = 'utf-8')
+  except Exception:
+    logger.exception('Error opening EMF file ' + filename)
+    return
+  logger.info('Writing EMF metrics to %s', filename)
+  while True:
+    try:
+      dimensions, metricstopublish = emfqueue.get(timeout = min(1.0, max(0.0, nextflushtime - time.perf_counter())))
+      dimensions = tuple(dimensions.items())
+      if dimensions not in collected.keys():
+        collected[dimensions] = {}
+      # Histograms are merged, not expanded into values
+      for k, value in metricstopublish.items():
+        current = collected[dimensions].get(k)
+        if type(value) == dict:
+          if current == None:
+            collected[dimensions][k] = mergehistograms(createhistogram(), value)
+          elif type(current) == list:
+            collected[dimensions][k] = mergehistograms(createhistogram(), value)
+            for i in current:
+              recordhistogramvalue(collected[dimensions][k], i)
+          else:
+            mergehistograms(current, value)
+        elif current == None:
+          collected[dimensions][k] = [value]
+        elif type(current) == list:
+          current.append(value)
+        else:
+          recordhistogramvalue(current, value)
+    except queue.Empty:
+      pass
+    if time.perf_counter() >= nextflushtime or terminatethreads:
+      nextflushtime = time.perf_counter() + userargs['emfinterval']
+      if collected:
+        documents = createemfdocuments(collected, int(time.time() * 1000))
+        collected.clear()
+        try:
+          f.write('\n'.join(documents) + '\n')
+          f.flush()
+        except Exception:
+          logger.exception('Error writing EMF file ' + filename)
+      if terminatethreads:
+        break
+  f.close()
+
+
+# Prometheus metric types, metrics not listed are exported as gauges with the last value
+prometheuscounters = {'manifest4xx', 'manifest5xx', 'tracking4xx', 'tracking5xx', 'segment4xx', 'segment5xx', 'manifesttimeouterror', 'trackingtimeouterror', 'segmenttimeouterror', 'discontinuity', 'stale', 'contentshortage', 'adbreak'}
+prometheushistograms = {'manifestresponsetime', 'segmentresponsetime', 'trackingresponsetime'}
+prometheusbuckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+# Accumulate metrics of one manifest request, called only by the monitoring thread owning the rendition
+def accumulateprometheusmetrics(renditionname:str, endpointtype:str, metricstopublish:dict):
+  accumulator = prometheusregistry.get((renditionname, endpointtype))
+  if accumulator == None:
+    accumulator = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    prometheusregistry[(renditionname, endpointtype)] = accumulator
+  for k in metricstopublish.keys():
+    if type(metricstopublish[k]) == dict:
+      values, counts = histogramvaluescounts(metricstopublish[k])
+    else:
+      values = [metricstopublish[k]] ; counts = [1]
+    if k in prometheushistograms:
+      if k not in accumulator['histograms'].keys():
+        # Bucket counts (last one is +Inf), sum and count, response times are in milliseconds
+        accumulator['histograms'][k] = [[0] * (len(prometheusbuckets) + 1), 0.0, 0]
+      histogram = accumulator['histograms'][k]
+      for value, count in zip(values, counts):
+        histogram[0][bisect.bisect_left(prometheusbuckets, value / 1000)] += count
+        histogram[1] = histogram[1] + value / 1000 * count
+        histogram[2] = histogram[2] + count
+    elif k in prometheuscounters:
+      accumulator['counters'][k] = accumulator['counters'].get(k, 0) + sum(v * c for v, c in zip(values, counts))
+    else:
+      accumulator['gauges'][k] = values[-1]
+
+
+# Helper
+def escapeprometheuslabel(value:str):
+  return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Render all accumulated metrics in Prometheus text format without locking the monitoring threads
+def renderprometheusmetrics():
+  families = {}
+  for endpointtype in list(renditionnames.keys()):
+    for renditionname in list(renditionnames[endpointtype]):
+      accumulator = prometheusregistry.get((renditionname, endpointtype))
+      if accumulator == None:
+        continue
+      labels = 'endpoint="' + escapeprometheuslabel(renditionname) + '",type="' + endpointtype + '"'
+      # Copies are atomic, the monitoring thread may keep updating the accumulator meanwhile
+      for k, v in list(accumulator['counters'].items()):
+        families.setdefault(('canarymonitor_' + k + '_total', 'counter'), []).append('canarymonitor_' + k + '_total{' + labels + '} ' + str(v))
+      for k, v in list(accumulator['gauges'].items()):
+        families.setdefault(('canarymonitor_' + k, 'gauge'), []).append('canarymonitor_' + k + '{' + labels + '} ' + str(v))
+      for k, v in list(accumulator['histograms'].items()):
+        buckets = list(v[0]) ; lines = families.setdefault(('canarymonitor_' + k + '_seconds', 'histogram'), []) ; cumulative = 0
+        for le, count in zip(prometheusbuckets + ['+Inf'], buckets):
+          cumulative = cumulative + count
+          lines.append('canarymonitor_' + k + '_seconds_bucket{' + labels + ',le="' + str(le) + '"} ' + str(cumulative))
+        lines.append('canarymonitor_' + k + '_seconds_sum{' + labels + '} ' + str(round(v[1], 6)))
+        lines.append('canarymonitor_' + k + '_seconds_count{' + labels + '} ' + str(cumulative))
+  for k, v in list(prometheusmainmetrics.items()):
+    families.setdefault(('canarymonitor_' + k, 'gauge'), []).append('canarymonitor_' + k + '{property="' + escapeprometheuslabel(userargs['label']) + '"} ' + str(v))
+  output = []
+  for (name, metrictype), lines in families.items():
+    output.append('# TYPE ' + name + ' ' + metrictype)
+    output.extend(lines)
+  return '\n'.join(output) + '\n'
+
+
+# Prometheus /metrics endpoint
+class prometheusrequesthandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path.split('?')[0] != '/metrics':
+      self.send_error(404)
+      return
+    body = renderprometheusmetrics().encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
 
 
 # Check if this is multivariant HLS manifest
@@ -347,7 +1100,7 @@ def findrenditions(logger, responsetext, endpoint:dict):
               if 'NUM' in rendition.keys():
                 renditions.append(rendition.copy())
             rendition.clear()
-  logger.info('Found these renditions (total: ' + str(len(renditions)) + ' ; video: ' + str(vcount) + ', audio: ' + str(acount) + ', subtitles: ' + str(scount) + '): ' + str(renditions))
+  logger.info('Found these renditions (total: %s ; video: %s, audio: %s, subtitles: %s): %s', len(renditions), vcount, acount, scount, renditions)
   return renditions
   
   
@@ -364,9 +1117,9 @@ def checkadaptationsets(logger, adaptationsets:list, periodid:str):
       elif mimetype == 'application/mp4':
         foundsubtitles = True
   if not foundvideo:
-    logger.warning('Missing video adaptation set in period ' + periodid)
+    logger.warning('Missing video adaptation set in period %s', periodid)
   if not foundaudio:
-    logger.warning('Missing audio adaptation set in period ' + periodid)
+    logger.warning('Missing audio adaptation set in period %s', periodid)
 
 
 # Check for DASH pto offset misalignment between renditions
@@ -390,7 +1143,7 @@ def checkpresentationtimeoffsets(logger, presentationtimeoffsets:list, periodid:
       if abs(helpcompare['video'][-1] - i) > 0.1:
         videosubtitlesptomisalignment = True
   if videoptomisalignment or videoaudioptomisalignment or videosubtitlesptomisalignment:
-    logger.warning('Presentation time offset misalignment in period ' + periodid + ', videoptomisalignment: ' + str(videoptomisalignment) + ', videoaudioptomisalignment: ' + str(videoaudioptomisalignment) + ', videosubtitlesptomisalignment: ' + str(videosubtitlesptomisalignment) + ', presentationTimeOffset / timescale: ' + str(helpcompare))
+    logger.warning('Presentation time offset misalignment in period %s, videoptomisalignment: %s, videoaudioptomisalignment: %s, videosubtitlesptomisalignment: %s, presentationTimeOffset / timescale: %s', periodid, videoptomisalignment, videoaudioptomisalignment, videosubtitlesptomisalignment, helpcompare)
 
 
 # Find last segment information from provided URL
@@ -398,7 +1151,7 @@ def proberendition(logger, endpoint, rendition, responsetext = None):
   segmentinfo = {} ; adaptationsets = [] ; presentationtimeoffsets = [] ; manifestduration = 0.0
   if not responsetext:
     responsetext = ''
-    response, responsetime = request3(logger, {'Accept-Encoding': 'gzip'}, rendition['URL'], 'GET', 'manifest', {})
+    response, responsetime = takeprefetched(endpoint, rendition['URL'], True) or request3(logger, {'Accept-Encoding': 'gzip'}, rendition['URL'], 'GET', 'manifest', {})
     if response:
       if endpoint['type'] == 'hls':
         responsetext = getresponsetext(response, True)
@@ -422,7 +1175,7 @@ def proberendition(logger, endpoint, rendition, responsetext = None):
           segmentcount = segmentcount + 1
       if manifestmediasequence >= 0:
         lastmediasequence = manifestmediasequence + segmentcount - 1
-        logger.debug('Probed rendition and identified last media sequence: ' + str(lastmediasequence))
+        logger.debug('Probed rendition and identified last media sequence: %s', lastmediasequence)
         return {'lastmediasequence': lastmediasequence, 'manifestduration': manifestduration}
     # DASH - get last segment info
     elif endpoint['type'] == 'dash':
@@ -487,7 +1240,7 @@ def proberendition(logger, endpoint, rendition, responsetext = None):
                       presentationtimeoffsets.append({'mimeType': xmladaptationsetmimetype, 'presentationTimeOffset': xmlpresentationtimeoffset, 'timescale': xmltimescale})
             checkpresentationtimeoffsets(logger, presentationtimeoffsets, segmentinfo['period'])
       if all(i in segmentinfo.keys() for i in ['period', 'n']):
-        logger.debug('Probed rendition and identified last segment: ' + str(segmentinfo))
+        logger.debug('Probed rendition and identified last segment: %s', segmentinfo)
         return segmentinfo
     # Smooth - get last segment info from first representation
     elif endpoint['type'] == 'smooth':
@@ -546,7 +1299,7 @@ def findrenditiontype(logger, endpoint, renditions):
             foundrenditiontype = True
             break
     if foundrenditiontype:
-      logger.debug('Found rendition type ' + userargs['renditiontype'] + ' in primary manifest: ' + str(rendition))
+      logger.debug('Found rendition type %s in primary manifest: %s', userargs['renditiontype'], rendition)
       return rendition
   else:
     logger.error('Unsupported rendition type attribute. Usage: 1v (stands for 1st video rendition)')
@@ -591,7 +1344,7 @@ def comparerenditionssegments(logger, lock, sharedlist:list, threadcount:int):
         logger.exception('Bad key')
 
       if len(setofdifferences) > 0:
-        logger.warning('Found differences in mediasequence ' + str(i['mediasequence']) + ' between renditions, differences: ' + str(setofdifferences) + ', segmentinfo: ' + str(i['segments']))
+        logger.warning('Found differences in mediasequence %s between renditions, differences: %s, segmentinfo: %s', i['mediasequence'], setofdifferences, i['segments'])
       sharedlist.remove(i)
   lock.release()
 
@@ -600,15 +1353,307 @@ def comparerenditionssegments(logger, lock, sharedlist:list, threadcount:int):
 def addrenditionname(lockm, endpoint:dict, renditionname:str):
   lockm.acquire()
   renditionnames[endpoint['type']].append(renditionname)
+  if userargs['dashboardrenditions'] > 0:
+    adddashboardrendition(endpoint, renditionname)
   lockm.release()
 
 
+# CloudWatch dashboard limits
+cloudwatchwidgetmetrics = 500
+cloudwatchdashboardmetrics = 2500
+dashboardtemplates = ['cw_all.json']
+
+
+# Maximum number of renditions in a dashboard of a template, from the metrics of a dashboard rendered with one rendition
+def getdashboardcapacity(template):
+  render = template.render(region = '', metrics = ['"Type", "hls", "Endpoint", "rendition"'], accountid = '', propertyname = '', rendersegments = True, rendertracking = True)
+  widgetmetrics = [len(i['properties']['metrics']) for i in json.loads(render)['widgets'] if 'metrics' in i.get('properties', {}).keys()]
+  if not widgetmetrics or max(widgetmetrics) == 0:
+    return cloudwatchwidgetmetrics
+  return max(1, min(cloudwatchwidgetmetrics // max(widgetmetrics), cloudwatchdashboardmetrics // sum(widgetmetrics)))
+
+
+# Assign a rendition to a dashboard shard of its endpoint type and mark the shard changed, renditions of an endpoint stay in the same shard while it has room
+def adddashboardrendition(endpoint:dict, renditionname:str):
+  shards = dashboardshards.setdefault(endpoint['type'], [])
+  shard = None
+  for i in shards:
+    if endpoint['name'] in i['endpoints'] and len(i['renditions']) < userargs['dashboardrenditions']:
+      shard = i
+      break
+  if shard == None:
+    if shards and len(shards[-1]['renditions']) < userargs['dashboardrenditions']:
+      shard = shards[-1]
+    else:
+      shard = {'number': len(shards) + 1, 'renditions': [], 'endpoints': set()}
+      shards.append(shard)
+  shard['renditions'].append(renditionname) ; shard['endpoints'].add(endpoint['name'])
+  changeddashboards.add((endpoint['type'], shard['number']))
+  dashboardevent.set()
+
+
+# Dashboard file name of a shard, e.g. cw_all-myproperty-hls-2.json
+def getdashboardname(templatename:str, endpointtype:str, number:int):
+  return '-'.join([Path(templatename).stem] + ([userargs['property']] if userargs['property'] else []) + [endpointtype, str(number)]) + Path(templatename).suffix
+
+
+# Render dashboards of changed shards in the background, renditions registered within a few seconds are rendered together
+def dashboardwriter(logger, templates:dict):
+  while not terminatethreads:
+    if not dashboardevent.wait(5):
+      continue
+    time.sleep(2)
+    dashboardevent.clear()
+    with lockm:
+      changed = [(k, n, list(dashboardshards[k][n - 1]['renditions'])) for k, n in sorted(changeddashboards)]
+      changeddashboards.clear()
+    for endpointtype, number, renditions in changed:
+      metrics = ['"Type", "' + endpointtype + '", "Endpoint", "' + i + '"' for i in renditions]
+      for templatename, template in templates.items():
+        render = template.render(region = userargs['cwregion'], metrics = metrics, accountid = userargs['cwaccountid'], propertyname = userargs['property'], rendersegments = True if (userargs['segments'] == True or userargs['segmentrequests'] == True) else False, rendertracking = True if userargs['trackingrequests'] == True else False)
+        # Save dashboard
+        filepath = Path(userargs['dashboardsfolder'], getdashboardname(templatename, endpointtype, number))
+        try:
+          with open(str(filepath) + '.tmp', 'w') as f:
+            f.write(render)
+          os.replace(str(filepath) + '.tmp', filepath)
+          logger.info('Created dashboard file: ' + str(filepath) + ' with ' + str(len(renditions)) + ' renditions')
+        except Exception:
+          logger.exception('Error saving dashboard')
+
+
+# Manifest info of a rendition that is not kept in checkpoints, because it is about the last manifest request only
+checkpointexcluded = ('url', 'latency', 'size', 'foundlastsegment', 'foundnewsegment', 'foundnewperiod', 'foundlastperiod', 'lastmanifestheaders', 'lastmanifestcontent', 'lastmanifestlength', 'newsegmentspts')
+
+# Ad break state of a rendition, kept in checkpoints and dropped on resume when the ad break is no longer in the manifest
+checkpointadbreak = ('adbreak', 'adbreakage', 'advertisedadbreakduration', 'actualadbreakduration', 'emtadbreakduration', 'trackingconfirmed', 'datarangeid')
+
+
+# Keep monitor state of a rendition for the next checkpoint, times of the monotonic clock are kept as ages
+def savecheckpointstate(endpoint:dict, rendition:dict, renditionname:str, fromprimary:bool, manifestinfo:dict, sessionage:float, sessioncontentduration:float):
+  state = {}
+  for k, v in manifestinfo.items():
+    if k in checkpointexcluded:
+      continue
+    if k == 'adbreakstart':
+      state['adbreakage'] = monotonicclock() - v
+      continue
+    # Values that do not survive JSON unchanged (e.g. datetime) are found again in the next manifests
+    try:
+      if json.loads(json.dumps(v)) == v:
+        state[k] = v
+    except (TypeError, ValueError):
+      pass
+  if endpoint['type'] == 'hls':
+    proberesponse = {'lastmediasequence': manifestinfo['lastmediasequence'], 'manifestduration': manifestinfo['initialmanifestduration']}
+  else:
+    proberesponse = manifestinfo['lastsegmentinfo']
+  with checkpointlock:
+    checkpointstates[renditionname] = {'time': time.time(), 'endpoint': endpoint['name'], 'url': endpoint['url'], 'rendition': rendition, 'fromprimary': fromprimary, 'proberesponse': proberesponse,
+                                       'manifestinfo': state, 'sessionage': sessionage, 'sessioncontentduration': sessioncontentduration}
+
+
+# Restore monitor state of a rendition from a checkpoint, returns session start time and session content duration
+def restorecheckpointstate(manifestinfo:dict, resume:dict):
+  now = monotonicclock() ; age = time.time() - resume['time']
+  manifestinfo.update(resume['manifestinfo'])
+  if 'adbreakage' in manifestinfo.keys():
+    manifestinfo['adbreakstart'] = now - manifestinfo.pop('adbreakage') - age
+  return now - resume['sessionage'] - age, resume['sessioncontentduration']
+
+
+# Write checkpoint of all renditions atomically, the previous checkpoint stays complete if writing fails
+def writecheckpoint(logger):
+  with checkpointlock:
+    checkpoint = json.dumps({'version': 2, 'time': time.time(), 'renditions': checkpointstates}, separators = (',', ':'))
+  try:
+    with open(userargs['checkpointfile'] + '.tmp', 'w') as f:
+      f.write(checkpoint)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(userargs['checkpointfile'] + '.tmp', userargs['checkpointfile'])
+  except OSError as e:
+    logger.error('Error writing checkpoint %s: %s', userargs['checkpointfile'], e)
+
+
+def checkpointwriter(logger):
+  while not terminatethreads:
+    time.sleep(userargs['checkpointinterval'])
+    writecheckpoint(logger)
+
+
+# Load checkpoint of the previous run, states of renditions older than --checkpointttl seconds are discarded
+def loadcheckpoint(logger):
+  try:
+    with open(userargs['checkpointfile'], 'r') as f:
+      checkpoint = json.load(f)
+  except FileNotFoundError:
+    return {}
+  except (OSError, ValueError) as e:
+    logger.error('Error loading checkpoint %s: %s', userargs['checkpointfile'], e)
+    return {}
+  if checkpoint.get('version') != 2:
+    return {}
+  now = time.time()
+  states = {k: v for k, v in checkpoint['renditions'].items() if now - v['time'] <= userargs['checkpointttl']}
+  logger.info('Loaded checkpoint with %s renditions, discarded %s renditions older than %s seconds', len(states), len(checkpoint['renditions']) - len(states), userargs['checkpointttl'])
+  return states
+
+
+# Checkpoint state of the rendition of an endpoint to resume monitoring without probing, only when a single rendition is monitored
+def takecheckpointstate(endpoint:dict):
+  if userargs['checkpoint'] == False:
+    return None
+  with checkpointlock:
+    names = [k for k, v in resumestates.items() if v['endpoint'] == endpoint['name']]
+    states = [resumestates.pop(k) for k in names]
+  if len(names) != 1 or states[0]['url'] != endpoint['url']:
+    return None
+  return dict(states[0], renditionname = names[0])
+
+
+# First and last segment number of a DASH rendition in a period of the manifest, None if the period or rendition is not in the manifest
+def getdashsegmentnumbers(responsetext, rendition:dict, periodid:str):
+  ns = {'default': 'urn:mpeg:dash:schema:mpd:2011'}
+  xmlroot = ET.fromstring(responsetext)
+  for xmlperiod in xmlroot.findall('default:Period', ns):
+    if xmlperiod.get('id') != periodid:
+      continue
+    for xmladaptationset in xmlperiod.findall('default:AdaptationSet', ns):
+      if xmladaptationset.get('mimeType') != rendition['TYPE']:
+        continue
+      for xmlrepresentation in xmladaptationset.findall('default:Representation', ns):
+        if xmlrepresentation.get('id') != rendition['ID']:
+          continue
+        xmlsegmenttemplate = xmlrepresentation.find('default:SegmentTemplate', ns)
+        if xmlsegmenttemplate == None:
+          xmlsegmenttemplate = xmladaptationset.find('default:SegmentTemplate', ns)
+        if xmlsegmenttemplate == None or not xmlsegmenttemplate.get('startNumber') or xmlsegmenttemplate.find('default:SegmentTimeline', ns) == None:
+          return None
+        count = 0
+        for element in xmlsegmenttemplate.find('default:SegmentTimeline', ns):
+          if element.tag == '{' + ns['default'] + '}' + 'S':
+            count = count + int(element.get('r', '0')) + 1
+          elif element.tag == '{' + ns['default'] + '}' + 'Pattern':
+            count = count + (int(element.get('r', '0')) + 1) * sum(int(i.get('r', '0')) + 1 for i in element.findall('default:S', ns))
+        return int(xmlsegmenttemplate.get('startNumber')), int(xmlsegmenttemplate.get('startNumber')) + count - 1
+  return None
+
+
+# Check if an ad break of a checkpoint is still in an HLS media playlist, i.e. its end can still be found by the monitor
+def hlsadbreakinmanifest(responsetext, manifestinfo:dict):
+  for line in responsetext.split('\n'):
+    line = line.strip()
+    if userargs['emt'] == True:
+      if line and not line.startswith('#') and userargs['emtadsegmentstring'] in line:
+        return True
+    elif line.startswith('#EXT-X-CUE-OUT-CONT') or line.startswith('#EXT-X-CUE-IN'):
+      return True
+    elif line.startswith('#EXT-X-DATERANGE:') and manifestinfo.get('datarangeid') and re.search(r'ID=([\'\"])' + re.escape(manifestinfo['datarangeid']) + r'([\'\"])', line):
+      return True
+  return False
+
+
+# Check that monitoring can resume from checkpoint state, i.e. the last segment of the state is still in the manifest
+# The fetched manifest is used for the first manifest request of the monitor
+def checkresumestate(logger, endpoint:dict, resume:dict):
+  age = time.time() - resume['time']
+  if endpoint['type'] == 'hls':
+    url = resume['rendition']['URL']
+    if age > resume['proberesponse']['manifestduration']:
+      logger.info('Checkpoint of %s is %s seconds old, longer than the manifest window of %s seconds, probing rendition', resume['renditionname'], round(age), round(resume['proberesponse']['manifestduration']))
+      return False
+  else:
+    url = endpoint['url']
+  response, responsetime = request3(logger, {'Accept-Encoding': 'gzip'}, url, 'GET', 'manifest', {})
+  if not response:
+    return False
+  responsetext = getresponsetext(response, endpoint['type'] == 'hls')
+  if endpoint['type'] == 'hls':
+    match = re.search(r'#EXT-X-MEDIA-SEQUENCE:(\d+)', responsetext)
+    first = int(match.group(1)) if match else 0
+    count = sum(1 for line in responsetext.split('\n') if line.strip() and not line.strip().startswith('#'))
+    inwindow = first <= resume['proberesponse']['lastmediasequence'] <= first + count - 1
+  else:
+    try:
+      numbers = getdashsegmentnumbers(responsetext, resume['rendition'], resume['proberesponse']['period'])
+    except ET.ParseError:
+      numbers = None
+    inwindow = numbers != None and numbers[0] <= resume['proberesponse']['n'] <= numbers[1]
+  if not inwindow:
+    logger.info('Last segment of checkpoint of %s from %s seconds ago is not in the manifest, probing rendition', resume['renditionname'], round(age))
+    return False
+  # The ad break of a DASH rendition is the period of the last segment, which is in the manifest
+  if endpoint['type'] == 'hls' and resume['manifestinfo'].get('adbreak') == True and not hlsadbreakinmanifest(responsetext, resume['manifestinfo']):
+    logger.info('Ad break of checkpoint of %s from %s seconds ago is not in the manifest, resuming without ad break', resume['renditionname'], round(age))
+    for k in checkpointadbreak:
+      resume['manifestinfo'].pop(k, None)
+  endpoint['bootstrap'] = {'time': time.perf_counter(), 'renditions': {url: (response, responsetime)}}
+  return True
+
+
+# Renditions monitored with --allrenditions, or the first rendition of each type with --playerrenditions
+def pickrenditions(renditions:list):
+  if userargs['playerrenditions'] == False:
+    return renditions
+  picked = [] ; types = set()
+  for rendition in renditions:
+    if rendition['TYPE'] in ('VIDEO', 'AUDIO', 'SUBTITLES') and rendition['TYPE'] not in types:
+      types.add(rendition['TYPE'])
+      picked.append(rendition)
+  return picked
+
+
+# Manifest response fetched by the bootstrap, the primary manifest without url, a rendition manifest is taken by the first request of its monitoring thread
+# Responses are not used when the bootstrap of the endpoint finished more than the monitoring frequency ago
+def takeprefetched(endpoint:dict, url:str = None, keep:bool = False):
+  prefetched = endpoint.get('bootstrap')
+  if not prefetched:
+    return None
+  if url == None:
+    entry = prefetched.pop('primary', None)
+  elif keep:
+    entry = prefetched['renditions'].get(url)
+  else:
+    entry = prefetched['renditions'].pop(url, None)
+  if entry == None or time.perf_counter() - prefetched['time'] > userargs['frequency']:
+    return None
+  return entry
+
+
+# Count endpoints with a monitoring thread, log and keep the time until all endpoints are monitored for main thread metrics
+def recordmonitoredendpoint(endpoint:dict):
+  with startupstatslock:
+    if endpoint['name'] not in startupstats['pending']:
+      return
+    startupstats['pending'].discard(endpoint['name'])
+    if not startupstats['pending']:
+      startupstats['timetoallmonitored'] = round(time.perf_counter() - startupstats['start'], 1)
+      logger.info('All ' + str(startupstats['endpoints']) + ' endpoints monitored ' + str(startupstats['timetoallmonitored']) + ' seconds after start')
+
+
 # Collect URL info before monitoring start
 def premonitor(tlogger, endpoint:dict, lockm):
   logger = logging.LoggerAdapter(tlogger, {'endpointtype': endpoint['type'], 'renditionname': endpoint['name']})
   failure = False ; lock = threading.Lock() ; sharedlist = [] ; stoprunning = threading.Event() ; renditionnamesadded = False
+  # Warm restart from checkpoint without requesting the primary manifest and probing the rendition
+  resume = takecheckpointstate(endpoint)
+  if resume != None and not checkresumestate(logger, endpoint, resume):
+    resume = None
+  if resume != None:
+    logger.info('Resuming monitoring of %s from checkpoint of %s seconds ago', resume['renditionname'], round(time.time() - resume['time']))
+    addrenditionname(lockm, endpoint, resume['renditionname'])
+    renditionnamesadded = True
+    dotracking = endpoint['type'] == 'hls' and endpoint['tracking'] != '' and userargs['trackingrequests'] == True
+    monitor(tlogger, endpoint, resume['rendition'], resume['renditionname'], resume['proberesponse'], resume['fromprimary'], stoprunning, lock, sharedlist, dotracking, resume)
+    logger.info('Stopped monitoring')
+    # Media playlists are not monitored again after they stop
+    if not resume['fromprimary']:
+      return
   while not terminatethreads:
-    response, responsetime = request3(logger, {'Accept-Encoding': 'gzip'}, endpoint['url'], 'GET', 'manifest', {})
+    # Manifests fetched by the bootstrap are probed and monitored without waiting
+    prefetched = takeprefetched(endpoint)
+    response, responsetime = prefetched or request3(logger, {'Accept-Encoding': 'gzip'}, endpoint['url'], 'GET', 'manifest', {})
     if not response:
       time.sleep(5)
       continue
@@ -625,20 +1670,11 @@ def premonitor(tlogger, endpoint:dict, lockm):
           if userargs['allrenditions'] == True or userargs['playerrenditions'] == True:
             if len(renditions) > 0:
               proberesponse = proberendition(logger, endpoint, renditions[0])
-              time.sleep(2)
+              if not prefetched:
+                time.sleep(2)
               if proberesponse:
-                threads = [] ; sharedlist.clear() ; stoprunning.clear() ; pickedvideo = False ; pickedaudio = False ; pickedsubtitles = False ; alreadytracking = False
-                for rendition in renditions:
-                  # Player rendition picks 1 rendition from each type
-                  if userargs['playerrenditions'] == True:
-                    if not pickedvideo and rendition['TYPE'] == 'VIDEO':
-                      pickedvideo = True
-                    elif not pickedaudio and rendition['TYPE'] == 'AUDIO':
-                      pickedaudio = True
-                    elif not pickedsubtitles and rendition['TYPE'] == 'SUBTITLES':
-                      pickedsubtitles = True
-                    else:
-                      continue
+                threads = [] ; sharedlist.clear() ; stoprunning.clear() ; alreadytracking = False
+                for rendition in pickrenditions(renditions):
                   dotracking = False
                   if alreadytracking == False and endpoint['tracking'] != '':
                     if userargs['trackingrequests'] == True:
@@ -650,10 +1686,10 @@ def premonitor(tlogger, endpoint:dict, lockm):
                     else:
                       filepath = saveresponse(logger, responsetext, Path(userargs['manifestsfolder'], renditionname), datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '_primary.m3u8', False, False)
                     if filepath:
-                      logger.debug('Saved file ' + str(filepath))
+                      logger.debug('Saved file %s', filepath)
                   if not renditionnamesadded:
                     addrenditionname(lockm, endpoint, renditionname)
-                  x = threading.Thread(target = monitor, args = (tlogger, endpoint, rendition, renditionname, proberesponse, True, stoprunning, lock, sharedlist, dotracking))
+                  x = threading.Thread(target = monitor, name = endpoint['type'] + '-' + renditionname, args = (tlogger, endpoint, rendition, renditionname, proberesponse, True, stoprunning, lock, sharedlist, dotracking))
                   threads.append(x)
                   x.start()
                 renditionnamesadded = True
@@ -674,7 +1710,7 @@ def premonitor(tlogger, endpoint:dict, lockm):
                   # Compare segments across renditions
                   comparerenditionssegments(logger, lock, sharedlist, len(threads))
                   if len(sharedlist) > userargs['frequency'] * 5:
-                    logger.error('Unexpectedely long list of segments not discovered across all renditions with same media sequence. Length: ' + str(len(sharedlist)))
+                    logger.error('Unexpectedely long list of segments not discovered across all renditions with same media sequence. Length: %s', len(sharedlist))
                     stoprunning.set()
                   time.sleep(5)
                 logger.info('Stopped monitoring')
@@ -686,7 +1722,8 @@ def premonitor(tlogger, endpoint:dict, lockm):
               rendition = findrenditiontype(logger, endpoint, renditions)
               if rendition:
                 proberesponse = proberendition(logger, endpoint, rendition)
-                time.sleep(2)
+                if not prefetched:
+                  time.sleep(2)
                 if proberesponse:
                   renditionname = endpoint['name'] + '-' + userargs['renditiontype']
                   if userargs['manifests'] == True:
@@ -696,7 +1733,7 @@ def premonitor(tlogger, endpoint:dict, lockm):
                     else:
                       filepath = saveresponse(logger, responsetext, Path(userargs['manifestsfolder'], renditionname), datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '_primary.m3u8', False, False)
                     if filepath:
-                      logger.debug('Saved file ' + str(filepath))
+                      logger.debug('Saved file %s', filepath)
                   if not renditionnamesadded:
                     addrenditionname(lockm, endpoint, renditionname)
                     renditionnamesadded = True
@@ -709,11 +1746,12 @@ def premonitor(tlogger, endpoint:dict, lockm):
                 else:
                   logger.error('Failed probing rendition to find out latest segment')
               else:
-                logger.error('Did not find rendition type ' + userargs['renditiontype'] + ' in primary manifest')
+                logger.error('Did not find rendition type %s in primary manifest', userargs['renditiontype'])
         # Media playlist
         else:
           proberesponse = proberendition(logger, endpoint, {'URL': endpoint['url']}, responsetext)
-          time.sleep(2)
+          if not prefetched:
+            time.sleep(2)
           if proberesponse:
             renditionname = endpoint['name'] + '-' + '??'
             if not renditionnamesadded:
@@ -731,31 +1769,25 @@ def premonitor(tlogger, endpoint:dict, lockm):
         failure = True
       # DASH
       elif endpoint['type'] == 'dash':
-        if userargs['loadtest'] == False:
-          responsetext = getresponsetext(response, False)
-          renditions = findrenditions(logger, responsetext, endpoint)
-          if len(renditions) > 0:
-            rendition = findrenditiontype(logger, endpoint, renditions)
-            if rendition:
-              #lastsegmentinfo = {'period': '1841924', 'n': 1842100, 't': 1}
-              lastsegmentinfo = proberendition(logger, endpoint, rendition, responsetext)
+        responsetext = getresponsetext(response, False)
+        renditions = findrenditions(logger, responsetext, endpoint)
+        if len(renditions) > 0:
+          rendition = findrenditiontype(logger, endpoint, renditions)
+          if rendition:
+            #lastsegmentinfo = {'period': '1841924', 'n': 1842100, 't': 1}
+            lastsegmentinfo = proberendition(logger, endpoint, rendition, responsetext)
+            if not prefetched:
               time.sleep(2)
-              if lastsegmentinfo:
-                # renditionname = endpoint['name'] + '-' + userargs['renditiontype']
-                renditionname = endpoint['name']
-                if not renditionnamesadded:
-                  addrenditionname(lockm, endpoint, renditionname)
-                  renditionnamesadded = True
-                monitor(tlogger, endpoint, rendition, renditionname, lastsegmentinfo, True, stoprunning, lock, sharedlist)
-                logger.info('Stopped monitoring')
-              else:
-                logger.error('Failed probing rendition to find out latest segment')
-        else:
-          dotracking = False
-          if endpoint['tracking'] != '' and userargs['trackingrequests'] == True:
-            dotracking = True
-          monitor(tlogger, endpoint, {}, endpoint['name'], {}, True, stoprunning, lock, sharedlist, dotracking)
-          logger.info('Stopped monitoring')
+            if lastsegmentinfo:
+              # renditionname = endpoint['name'] + '-' + userargs['renditiontype']
+              renditionname = endpoint['name']
+              if not renditionnamesadded:
+                addrenditionname(lockm, endpoint, renditionname)
+                renditionnamesadded = True
+              monitor(tlogger, endpoint, rendition, renditionname, lastsegmentinfo, True, stoprunning, lock, sharedlist)
+              logger.info('Stopped monitoring')
+            else:
+              logger.error('Failed probing rendition to find out latest segment')
       # Smooth
       elif endpoint['type'] == 'smooth':
         responsetext = getresponsetext(response, False)
@@ -764,7 +1796,8 @@ def premonitor(tlogger, endpoint:dict, lockm):
           rendition = findrenditiontype(logger, endpoint, renditions)
           if rendition:
             lastsegmentinfo = proberendition(logger, endpoint, rendition, responsetext)
-            time.sleep(2)
+            if not prefetched:
+              time.sleep(2)
             if lastsegmentinfo:
               renditionname = endpoint['name']
               # if not renditionnamesadded:
@@ -775,11 +1808,914 @@ def premonitor(tlogger, endpoint:dict, lockm):
               logger.error('Failed probing rendition to find out latest segment')
 
 
+# Start the monitoring thread of an endpoint
+def startmonitorthread(tlogger, endpoint:dict, lockm):
+  if userargs['replay']:
+    x = threading.Thread(target = replaymonitor, name = endpoint['type'] + '-' + endpoint['name'], args = (tlogger, endpoint, lockm))
+  else:
+    x = threading.Thread(target = premonitor, name = endpoint['type'] + '-' + endpoint['name'], args = (tlogger, endpoint, lockm))
+  endpoint['thread'] = x
+  x.start()
+
+
+# Replay archived manifests of a rendition through the monitor as fast as possible, monitoring restarts like in premonitor()
+def replaymonitor(tlogger, endpoint:dict, lockm):
+  logger = logging.LoggerAdapter(tlogger, {'endpointtype': endpoint['type'], 'renditionname': endpoint['name']})
+  lock = threading.Lock() ; sharedlist = [] ; stoprunning = threading.Event() ; renditionnamesadded = False
+  replayclock.responses = iter(endpoint['replay']) if isinstance(endpoint['replay'], list) else iterreplayresponses(logger, endpoint['replay']) ; replayclock.pending = None ; replayclock.time = 0.0 ; replayclock.stoprunning = stoprunning ; replayclock.count = 0 ; replayclock.size = 0
+  # Renditions of HLS media playlist endpoints are named <endpoint>-?? and do not stop when stale
+  fromprimary = endpoint['type'] != 'hls' or not endpoint['name'].endswith('-??')
+  start = time.perf_counter()
+  while not terminatethreads and not stoprunning.is_set():
+    response, responsetime = request3(logger, {}, endpoint['url'], 'GET', 'manifest', {})
+    if not response:
+      if not renditionnamesadded:
+        logger.error('No archived manifests found in %s', endpoint['replay'])
+      break
+    if endpoint['type'] == 'hls':
+      rendition = {'URL': endpoint['url']}
+      proberesponse = proberendition(logger, endpoint, rendition, getresponsetext(response, True))
+    else:
+      responsetext = getresponsetext(response, False)
+      rendition = findrenditiontype(logger, endpoint, findrenditions(logger, responsetext, endpoint))
+      proberesponse = proberendition(logger, endpoint, rendition, responsetext) if rendition else None
+    if not proberesponse:
+      logger.error('Failed probing rendition to find out latest segment')
+      continue
+    if not renditionnamesadded:
+      addrenditionname(lockm, endpoint, endpoint['name'])
+      renditionnamesadded = True
+    advancereplayclock()
+    monitor(tlogger, endpoint, rendition, endpoint['name'], proberesponse, fromprimary, stoprunning, lock, sharedlist)
+    logger.info('Stopped monitoring')
+  elapsed = time.perf_counter() - start
+  logger.info('Replayed %s manifests in %.3f seconds, %.1f manifests per second', replayclock.count, elapsed, replayclock.count / elapsed if elapsed > 0 else 0)
+  with replaystatslock:
+    replaystats['manifests'] = replaystats['manifests'] + replayclock.count
+    replaystats['bytes'] = replaystats['bytes'] + replayclock.size
+
+
+# Log records of replaying threads carry the time of the replayed manifest
+class replaytimefilter(logging.Filter):
+  def filter(self, record):
+    replaytime = getattr(replayclock, 'time', 0.0)
+    if replaytime:
+      record.created = replaytime
+      record.msecs = int(replaytime * 1000) % 1000
+    return True
+
+
+# Benchmark fixtures generated by originsimulator.py as lists of (time [seconds], content, gzipped) like archived manifests
+def getbenchmarkfixtures():
+  import originsimulator
+  fixtures = {} ; starttime = 1760000000.0
+  settings = {'segmentduration': 2, 'variants': 3, 'adinterval': 120, 'adduration': 30, 'adsperavail': 2, 'host': 'localhost'}
+  for name, window, adbreaks, count in [('short', 10, 'scte', 100), ('long', 1800, 'scte', 10), ('longemt', 1800, 'emt', 10)]:
+    originsimulator.configure(dict(settings, window = window, adbreaks = adbreaks))
+    fixtures['hls' + name] = [(starttime + i * 2, originsimulator.hlsmediaplaylist([], 'v1', starttime + i * 2).encode('utf-8'), False) for i in range(count)]
+    fixtures['dash' + name] = [(starttime + i * 2, originsimulator.dashmanifest([], starttime + i * 2).encode('utf-8'), False) for i in range(count)]
+  originsimulator.configure(dict(settings, window = 10, adbreaks = 'scte', variants = 300))
+  fixtures['hlsmultivariant'] = originsimulator.hlsmultivariantplaylist()
+  return fixtures
+
+
+# Best calls per second of five rounds and peak memory allocated by a call [KB]
+def measurebenchmark(function, duration:float):
+  function()
+  best = 0.0
+  for i in range(5):
+    count = 0 ; start = time.perf_counter() ; elapsed = 0.0
+    while elapsed < duration / 5:
+      function()
+      count = count + 1
+      elapsed = time.perf_counter() - start
+    best = max(best, count / elapsed)
+  # Tracing slows down calls, so memory is measured on one call
+  tracemalloc.start()
+  current = tracemalloc.get_traced_memory()[0]
+  function()
+  peak = tracemalloc.get_traced_memory()[1] - current
+  tracemalloc.stop()
+  return best, peak / 1024
+
+
+# Micro-benchmarks of manifest parsing and checks, compared with stored baselines, returns True if any regression exceeds the threshold
+def runbenchmarks(logger, tlogger):
+  # Monitoring runs on generated manifests through the replay clock, without segment and tracking requests
+  userargs['replay'] = 'benchmark' ; userargs['segments'] = False ; userargs['segmentrequests'] = False ; userargs['tracking'] = False ; userargs['trackingrequests'] = False
+  fixtures = getbenchmarkfixtures()
+  hlsendpoint = {'type': 'hls', 'name': 'benchmark-hls', 'url': 'http://localhost/benchmark/master.m3u8', 'tracking': ''}
+  dashendpoint = {'type': 'dash', 'name': 'benchmark-dash', 'url': 'http://localhost/benchmark/index.mpd', 'tracking': ''}
+  dashrendition = findrenditiontype(logger, dashendpoint, findrenditions(logger, fixtures['dashlong'][0][1], dashendpoint))
+  gzipped = gzip.compress(fixtures['hlslong'][0][1])
+  metricstopublish = {}
+  segments = [{'type': 'VIDEO', 'discontinuitysequence': 0, 'discontinuity': False, 'duration': 2.0, 'explicitpdt': True, 'pdt': '2026-10-19T00:00:00.000Z'} for i in range(3)]
+  sharedlist = [] ; lock = threading.Lock()
+
+  def replay(endpoint, manifests):
+    replaymonitor(tlogger, dict(endpoint, replay = manifests), threading.Lock())
+
+  def compare():
+    sharedlist[:] = [{'mediasequence': i, 'segments': segments} for i in range(100)]
+    comparerenditionssegments(logger, lock, sharedlist, 3)
+
+  # Name, function, units per call
+  cases = [
+    ('findrenditions hls 300 variants', lambda: findrenditions(logger, fixtures['hlsmultivariant'], hlsendpoint), 1),
+    ('findrenditions dash 1h emt', lambda: findrenditions(logger, fixtures['dashlongemt'][0][1], dashendpoint), 1),
+    ('proberendition hls 20s', lambda: proberendition(logger, hlsendpoint, {'URL': hlsendpoint['url']}, fixtures['hlsshort'][0][1].decode('utf-8')), 1),
+    ('proberendition hls 1h', lambda: proberendition(logger, hlsendpoint, {'URL': hlsendpoint['url']}, fixtures['hlslong'][0][1].decode('utf-8')), 1),
+    ('proberendition dash 20s', lambda: proberendition(logger, dashendpoint, dashrendition, fixtures['dashshort'][0][1]), 1),
+    ('proberendition dash 1h emt', lambda: proberendition(logger, dashendpoint, dashrendition, fixtures['dashlongemt'][0][1]), 1),
+    ('monitor hls 20s', lambda: replay(hlsendpoint, fixtures['hlsshort']), len(fixtures['hlsshort'])),
+    ('monitor hls 1h', lambda: replay(hlsendpoint, fixtures['hlslong']), len(fixtures['hlslong'])),
+    ('monitor hls 1h emt', lambda: replay(hlsendpoint, fixtures['hlslongemt']), len(fixtures['hlslongemt'])),
+    ('monitor dash 20s', lambda: replay(dashendpoint, fixtures['dashshort']), len(fixtures['dashshort'])),
+    ('monitor dash 1h', lambda: replay(dashendpoint, fixtures['dashlong']), len(fixtures['dashlong'])),
+    ('monitor dash 1h emt', lambda: replay(dashendpoint, fixtures['dashlongemt']), len(fixtures['dashlongemt'])),
+    ('getresponsetext hls 1h', lambda: getresponsetext(replayresponse(fixtures['hlslong'][0][1], False), True), 1),
+    ('getresponsetext hls 1h gzip', lambda: getresponsetext(replayresponse(gzipped, True), True), 1),
+    ('addmetricvalue', lambda: addmetricvalue(metricstopublish, 'manifestresponsetime', 123), 1),
+    ('comparerenditionssegments 100x3', compare, 1),
+  ]
+
+  # Baselines depend on the machine and are not kept in the repository, the first run saves the baseline
+  baseline = {}
+  baselinepath = Path(userargs['benchmarkbaseline'])
+  savebaseline = userargs['benchmarksave'] == True or not baselinepath.exists()
+  if baselinepath.is_file():
+    try:
+      with baselinepath.open() as f:
+        baseline = json.load(f).get('cases', {})
+    except Exception:
+      logger.exception('Error loading benchmark baseline %s', baselinepath)
+  results = {} ; regressions = []
+  print('%-34s %14s %12s %14s %8s' % ('Benchmark', 'ops/sec', 'KB/op', 'baseline', 'change'))
+  for name, function, units in cases:
+    callspersecond, peak = measurebenchmark(function, userargs['benchmarktime'])
+    results[name] = {'opspersec': round(callspersecond * units, 1), 'kbperop': round(peak / units, 1)}
+    line = '%-34s %14.1f %12.1f' % (name, results[name]['opspersec'], results[name]['kbperop'])
+    if name in baseline.keys():
+      change = (results[name]['opspersec'] / baseline[name]['opspersec'] - 1) * 100
+      line = line + ' %14.1f %+7.1f%%' % (baseline[name]['opspersec'], change)
+      # Slower or allocating more than the threshold
+      if change < -userargs['benchmarkthreshold'] or results[name]['kbperop'] > baseline[name]['kbperop'] * (1 + userargs['benchmarkthreshold'] / 100) + 1:
+        regressions.append(name)
+        line = line + ' REGRESSION'
+    print(line)
+    logger.info('Benchmark ' + line.strip())
+  if savebaseline:
+    try:
+      with baselinepath.open('w') as f:
+        json.dump({'python': platform.python_version(), 'platform': platform.platform(), 'cases': results}, f, indent = 2)
+      print('Saved benchmark baseline ' + str(baselinepath))
+    except Exception:
+      logger.exception('Error saving benchmark baseline %s', baselinepath)
+  if regressions:
+    print('Regressions over ' + str(userargs['benchmarkthreshold']) + '%: ' + ', '.join(regressions))
+    logger.error('Benchmark regressions over %s%%: %s', userargs['benchmarkthreshold'], regressions)
+  return len(regressions) > 0
+
+
+# Response of asynchronous HTTP requests with the attributes of urllib3 responses, size counts body bytes also when the body is discarded
+class asyncresponse:
+  def __init__(self, status:int, reason:str, headers, data:bytes, size:int):
+    self.status = status
+    self.reason = reason
+    self.headers = headers
+    self.data = data
+    self.size = size
+
+
+# Keep-alive HTTP/1.1 connections shared by asyncio tasks, at most maxconnections per origin, requests wait for a free connection
+class asynchttppool:
+  def __init__(self, maxconnections:int, timeout:float):
+    self.maxconnections = maxconnections
+    self.timeout = timeout
+    self.idle = {}
+    self.semaphores = {}
+
+  async def request(self, method:str, url:str, headers:dict, body:bytes = None, keepbody:bool = True):
+    parsed = urlparse(url)
+    origin = (parsed.scheme, parsed.hostname, parsed.port if parsed.port else (443 if parsed.scheme == 'https' else 80))
+    semaphore = self.semaphores.get(origin)
+    if semaphore == None:
+      semaphore = self.semaphores.setdefault(origin, asyncio.Semaphore(self.maxconnections))
+    async with semaphore:
+      return await asyncio.wait_for(self.send(origin, parsed, method, headers, body, keepbody), self.timeout)
+
+  async def send(self, origin:tuple, parsed, method:str, headers:dict, body:bytes, keepbody:bool):
+    lines = [method + ' ' + (parsed.path if parsed.path else '/') + ('?' + parsed.query if parsed.query else '') + ' HTTP/1.1', 'Host: ' + parsed.netloc]
+    lines.extend(k + ': ' + v for k, v in headers.items())
+    if body != None:
+      lines.append('Content-Length: ' + str(len(body)))
+    message = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body if body else b'')
+    idle = self.idle.setdefault(origin, [])
+    # Idle connections may have been closed by the server, then the request is sent again on a new connection
+    while True:
+      reused = len(idle) > 0
+      reader, writer = idle.pop() if reused else await asyncio.open_connection(origin[1], origin[2], ssl = origin[0] == 'https')
+      try:
+        writer.write(message)
+        statusline = await reader.readline()
+        if not statusline:
+          raise ConnectionResetError('Connection closed by server')
+        response, keepalive = await self.readresponse(reader, statusline, method, keepbody)
+      except BaseException as e:
+        writer.close()
+        if reused and isinstance(e, (ConnectionError, asyncio.IncompleteReadError)):
+          continue
+        raise
+      if keepalive:
+        idle.append((reader, writer))
+      else:
+        writer.close()
+      return response
+
+  async def readresponse(self, reader, statusline:bytes, method:str, keepbody:bool):
+    parts = statusline.decode('latin-1').rstrip('\r\n').split(' ', 2)
+    status = int(parts[1]) ; reason = parts[2] if len(parts) > 2 else ''
+    headers = urllib3._collections.HTTPHeaderDict()
+    while True:
+      line = await reader.readline()
+      if line in (b'\r\n', b'\n', b''):
+        break
+      k, v = line.decode('latin-1').split(':', 1)
+      headers.add(k.strip(), v.strip())
+    chunks = [] ; size = 0 ; keepalive = headers.get('Connection', '').lower() != 'close'
+    if method == 'HEAD' or status in (204, 304) or status < 200:
+      pass
+    elif headers.get('Transfer-Encoding', '').lower() == 'chunked':
+      while True:
+        chunksize = int((await reader.readline()).split(b';')[0], 16)
+        if chunksize == 0:
+          await reader.readline()
+          break
+        chunk = await reader.readexactly(chunksize) ; await reader.readline()
+        size = size + chunksize
+        if keepbody:
+          chunks.append(chunk)
+    elif 'Content-Length' in headers:
+      remaining = int(headers['Content-Length'])
+      while remaining > 0:
+        chunk = await reader.read(min(remaining, 262144))
+        if not chunk:
+          raise asyncio.IncompleteReadError(b'', remaining)
+        remaining = remaining - len(chunk) ; size = size + len(chunk)
+        if keepbody:
+          chunks.append(chunk)
+    else:
+      keepalive = False
+      while True:
+        chunk = await reader.read(262144)
+        if not chunk:
+          break
+        size = size + len(chunk)
+        if keepbody:
+          chunks.append(chunk)
+    return asyncresponse(status, reason, headers, b''.join(chunks), size), keepalive
+
+
+# URLs of the newest segments of a manifest, from the last period and the first video representation of DASH
+def findnewestsegments(endpointtype:str, responsetext:bytes, url:str, count:int):
+  urls = []
+  if endpointtype == 'hls':
+    for line in responsetext.decode('utf-8').split('\n'):
+      line = line.strip()
+      if line and not line.startswith('#'):
+        urls.append(line)
+    return [urljoin(url, i) for i in urls[-count:]]
+  xmlroot = ET.fromstring(responsetext)
+  if endpointtype == 'dash':
+    namespaces = {'mpd': 'urn:mpeg:dash:schema:mpd:2011'}
+    xmlperiods = xmlroot.findall('mpd:Period', namespaces)
+    if not xmlperiods:
+      return urls
+    baseurl = url
+    for xmlbaseurl in [xmlroot.find('mpd:BaseURL', namespaces), xmlperiods[-1].find('mpd:BaseURL', namespaces)]:
+      if xmlbaseurl != None and xmlbaseurl.text:
+        baseurl = urljoin(baseurl, xmlbaseurl.text.strip())
+    for xmladaptationset in xmlperiods[-1].findall('mpd:AdaptationSet', namespaces):
+      xmlrepresentation = xmladaptationset.find('mpd:Representation', namespaces)
+      if xmlrepresentation == None or 'video' not in (xmladaptationset.get('mimeType', '') + xmladaptationset.get('contentType', '') + xmlrepresentation.get('mimeType', '')):
+        continue
+      xmltemplate = xmlrepresentation.find('mpd:SegmentTemplate', namespaces)
+      if xmltemplate == None:
+        xmltemplate = xmladaptationset.find('mpd:SegmentTemplate', namespaces)
+      if xmltemplate == None or xmltemplate.find('mpd:SegmentTimeline', namespaces) == None:
+        return urls
+      number = int(xmltemplate.get('startNumber', '1')) ; t = 0 ; segments = deque(maxlen = count)
+      for xmls in xmltemplate.find('mpd:SegmentTimeline', namespaces).findall('mpd:S', namespaces):
+        t = int(xmls.get('t', t)) ; d = int(xmls.get('d'))
+        for i in range(int(xmls.get('r', '0')) + 1):
+          segments.append((number, t))
+          number = number + 1 ; t = t + d
+      media = xmltemplate.get('media', '').replace('$RepresentationID$', xmlrepresentation.get('id', '')).replace('$Bandwidth$', xmlrepresentation.get('bandwidth', ''))
+      for number, t in segments:
+        segmenturl = re.sub(r'\$Number(%0(\d+)d)?\$', lambda m: str(number).zfill(int(m.group(2)) if m.group(2) else 0), media)
+        segmenturl = re.sub(r'\$Time(%0(\d+)d)?\$', lambda m: str(t).zfill(int(m.group(2)) if m.group(2) else 0), segmenturl)
+        urls.append(urljoin(baseurl, segmenturl))
+      break
+  elif endpointtype == 'smooth':
+    for xmlstreamindex in xmlroot.findall('StreamIndex'):
+      xmlqualitylevel = xmlstreamindex.find('QualityLevel')
+      if xmlstreamindex.get('Type') != 'video' or xmlqualitylevel == None:
+        continue
+      t = 0 ; times = deque(maxlen = count)
+      for xmlc in xmlstreamindex.findall('c'):
+        t = int(xmlc.get('t', t))
+        times.append(t)
+        t = t + int(xmlc.get('d', '0'))
+      template = xmlstreamindex.get('Url', '').replace('{bitrate}', xmlqualitylevel.get('Bitrate', '')).replace('{Bitrate}', xmlqualitylevel.get('Bitrate', ''))
+      urls = [urljoin(url, template.replace('{start time}', str(i)).replace('{start_time}', str(i))) for i in times]
+      break
+  return urls
+
+
+def createloadstats():
+  return {k: {'requests': 0, 'bytes': 0, '4xx': 0, '5xx': 0, 'timeout': 0, 'connection': 0, 'latency': createhistogram(), 'servicetime': createhistogram()} for k in ('manifest', 'segment', 'tracking')}
+
+
+# Request of a virtual player, latency is measured from the intended start time of the request
+async def loadrequest(pool, stats:dict, dsttype:str, url:str, intended:float):
+  loop = asyncio.get_running_loop() ; sent = loop.time() ; response = None ; error = None
+  try:
+    response = await pool.request('GET', url, {'User-Agent': 'CanaryMonitor (v2.0)', 'Accept-Encoding': 'gzip'}, keepbody = dsttype != 'segment')
+  except asyncio.TimeoutError:
+    error = 'timeout'
+  except (OSError, asyncio.IncompleteReadError, ValueError):
+    error = 'connection'
+  done = loop.time() ; dststats = stats[dsttype]
+  dststats['requests'] = dststats['requests'] + 1
+  recordhistogramvalue(dststats['latency'], int((done - intended) * 1000))
+  recordhistogramvalue(dststats['servicetime'], int((done - sent) * 1000))
+  if error:
+    dststats[error] = dststats[error] + 1
+    return None
+  dststats['bytes'] = dststats['bytes'] + response.size
+  if response.status >= 400:
+    dststats['4xx' if response.status < 500 else '5xx'] = dststats['4xx' if response.status < 500 else '5xx'] + 1
+    return None
+  return response
+
+
+# Refresh of a virtual player, the tracking response is requested together with the manifest with --trackingrequests
+async def playercycle(logger, pool, player:dict, intended:float, segmentscache:dict):
+  endpoint = player['endpoint']
+  cycle = [playermanifest(logger, pool, player, intended, segmentscache)]
+  if endpoint['tracking'] != '' and userargs['trackingrequests'] == True:
+    cycle.append(loadrequest(pool, endpoint['loadstats'], 'tracking', endpoint['tracking'], intended))
+  results = await asyncio.gather(*cycle)
+  # The first refresh of a player picks a rendition and requests all --loadsegments segments, it is not counted for calibration
+  player['refreshes'] = player['refreshes'] + 1
+  if player['refreshes'] > 1:
+    endpoint['loadcycles']['cycles'] = endpoint['loadcycles']['cycles'] + 1
+    endpoint['loadcycles']['requests'] = endpoint['loadcycles']['requests'] + results[0] + len(results) - 1
+
+
+# Manifest refresh of a virtual player, an HLS player picks a video rendition of the multivariant playlist on its first refresh, returns the number of requests
+async def playermanifest(logger, pool, player:dict, intended:float, segmentscache:dict):
+  endpoint = player['endpoint'] ; stats = endpoint['loadstats'] ; requests = 1
+  response = await loadrequest(pool, stats, 'manifest', player['url'], intended)
+  if not response:
+    return requests
+  if endpoint['type'] == 'hls' and not player['picked']:
+    responsetext = getresponsetext(response, True)
+    player['picked'] = True
+    if checkifprimary(logger, responsetext):
+      if 'loadrenditions' not in endpoint.keys():
+        renditions = [i for i in findrenditions(logger, responsetext, endpoint) if 'URL' in i.keys()]
+        endpoint['loadrenditions'] = [i for i in renditions if i.get('TYPE') == 'VIDEO'] or renditions
+      if not endpoint['loadrenditions']:
+        return requests
+      player['url'] = endpoint['loadrenditions'][player['index'] % len(endpoint['loadrenditions'])]['URL']
+      response = await loadrequest(pool, stats, 'manifest', player['url'], asyncio.get_running_loop().time()) ; requests = requests + 1
+      if not response:
+        return requests
+  if userargs['loadsegments'] == 0:
+    return requests
+  # Players of an endpoint share parsing of the same manifest
+  responsetext = getresponsetext(response, False)
+  key = (player['url'], hash(responsetext))
+  segments = segmentscache.get(key)
+  if segments == None:
+    try:
+      segments = findnewestsegments(endpoint['type'], responsetext, player['url'], userargs['loadsegments'])
+    except Exception:
+      logger.exception('Error finding newest segments in manifest %s', player['url'])
+      segments = []
+    if len(segmentscache) > 10000:
+      segmentscache.clear()
+    segmentscache[key] = segments
+  for url in segments:
+    if url not in player['segments']:
+      player['segments'].append(url)
+      await loadrequest(pool, stats, 'segment', url, asyncio.get_running_loop().time()) ; requests = requests + 1
+  return requests
+
+
+# Summary of load test statistics, e.g. manifest: 1200 requests, errors 0.50% (4xx 0, 5xx 6, timeout 0, connection 0), latency p50/p90/p99/p99.9/max 12/25/80/250/312 ms
+def getloadsummary(stats:dict):
+  summary = []
+  for dsttype, dststats in stats.items():
+    if dststats['requests'] == 0:
+      continue
+    errors = dststats['4xx'] + dststats['5xx'] + dststats['timeout'] + dststats['connection']
+    latency = {k: round(v) for k, v in histogrampercentiles(dststats['latency'], [50, 90, 99, 99.9]).items()}
+    servicetime = {k: round(v) for k, v in histogrampercentiles(dststats['servicetime'], [50, 90, 99, 99.9]).items()}
+    summary.append('%s: %s requests, errors %.2f%% (4xx %s, 5xx %s, timeout %s, connection %s), latency p50/p90/p99/p99.9/max %s/%s/%s/%s/%s ms, service time %s/%s/%s/%s/%s ms' % (
+      dsttype, dststats['requests'], errors * 100 / dststats['requests'], dststats['4xx'], dststats['5xx'], dststats['timeout'], dststats['connection'],
+      latency['p50'], latency['p90'], latency['p99'], latency['p99.9'], dststats['latency']['max'], servicetime['p50'], servicetime['p90'], servicetime['p99'], servicetime['p99.9'], dststats['servicetime']['max']))
+  return ', '.join(summary)
+
+
+# Log and publish load test statistics since the last report and add them to the totals
+def reportloadtest(logger, endpointslist:list, totals:dict, elapsed:float, targetrps:float):
+  interval = createloadstats()
+  for endpoint in endpointslist:
+    stats = endpoint['loadstats'] ; endpoint['loadstats'] = createloadstats()
+    if userargs['metrics'] == True:
+      metricstopublish = {}
+      for dsttype, dststats in stats.items():
+        if dststats['requests'] > 0:
+          metricstopublish['load' + dsttype + 'requests'] = dststats['requests']
+          metricstopublish['load' + dsttype + 'errors'] = dststats['4xx'] + dststats['5xx'] + dststats['timeout'] + dststats['connection']
+          metricstopublish['load' + dsttype + 'latency'] = dststats['latency']
+      publishmetrics(logger, endpoint, endpoint['name'], metricstopublish)
+    logger.debug('Load test endpoint %s: %s', endpoint['name'], getloadsummary(stats))
+    for dsttype, dststats in stats.items():
+      for target in (interval[dsttype], totals[dsttype]):
+        for k in ('requests', 'bytes', '4xx', '5xx', 'timeout', 'connection'):
+          target[k] = target[k] + dststats[k]
+        mergehistograms(target['latency'], dststats['latency']) ; mergehistograms(target['servicetime'], dststats['servicetime'])
+  requests = sum(i['requests'] for i in interval.values()) ; nbytes = sum(i['bytes'] for i in interval.values())
+  logger.info('Load test %.1f requests per second (target %.1f), %.1f MB/s, %s', requests / elapsed, targetrps, nbytes / elapsed / 1048576, getloadsummary(interval))
+  if userargs['metrics'] == True:
+    publishmainmetrics(logger, {'loadrequestspersecond': round(requests / elapsed, 1), 'loadmanifestlatency': interval['manifest']['latency'], 'loadsegmentlatency': interval['segment']['latency'], 'loadtrackinglatency': interval['tracking']['latency']})
+
+
+# Virtual player of an endpoint, with the first refresh at a start time
+def addloadplayer(schedule:list, endpoint:dict, start:float):
+  player = {'endpoint': endpoint, 'index': len(endpoint['loadplayers']), 'url': endpoint['url'], 'picked': False, 'stopped': False, 'refreshes': 0, 'segments': deque(maxlen = 2 * userargs['loadsegments'] + 1)}
+  endpoint['loadplayers'].append(player)
+  heapq.heappush(schedule, (start, id(player), player))
+
+
+# Number of players of an endpoint for its target rate from the requests per refresh made since the last calibration,
+# refreshes request fewer segments than --loadsegments when fewer new segments are in the manifest
+def calibrateloadplayers(schedule:list, endpoint:dict, now:float):
+  cycles = endpoint['loadcycles'] ; endpoint['loadcycles'] = {'cycles': 0, 'requests': 0}
+  if cycles['cycles'] == 0 or cycles['requests'] == 0:
+    return
+  count = max(1, round(endpoint['loadrps'] * userargs['frequency'] * cycles['cycles'] / cycles['requests']))
+  players = endpoint['loadplayers'] ; added = count - len(players)
+  while len(players) > count:
+    players.pop()['stopped'] = True
+  for i in range(added):
+    addloadplayer(schedule, endpoint, now + userargs['frequency'] * i / added)
+
+
+# Open-loop load test: virtual players refresh the manifest every --frequency seconds at fixed intended times, independently of responses,
+# and request its newest segments. Latency is measured from the intended time, so queueing behind slow responses is not hidden (coordinated omission)
+async def loadtest(logger, endpointslist:list):
+  loop = asyncio.get_running_loop()
+  pool = asynchttppool(userargs['loadconnections'], userargs['httptimeout'])
+  if userargs['loadendpointrps'] > 0:
+    endpointrps = userargs['loadendpointrps'] if userargs['loadrps'] == 0 else min(userargs['loadendpointrps'], userargs['loadrps'] / len(endpointslist))
+  else:
+    endpointrps = (userargs['loadrps'] if userargs['loadrps'] > 0 else 10 * len(endpointslist)) / len(endpointslist)
+  schedule = [] ; start = loop.time() + 1
+  for endpoint in endpointslist:
+    endpoint['loadstats'] = createloadstats() ; endpoint['loadcycles'] = {'cycles': 0, 'requests': 0} ; endpoint['loadplayers'] = [] ; endpoint['loadrps'] = endpointrps
+    # Requests per refresh are estimated until the first calibration
+    requestspercycle = 1 + userargs['loadsegments'] + (1 if endpoint['tracking'] != '' and userargs['trackingrequests'] == True else 0)
+    count = max(1, round(endpointrps * userargs['frequency'] / requestspercycle))
+    for i in range(count):
+      # Players of an endpoint are spread evenly over the refresh interval
+      addloadplayer(schedule, endpoint, start + userargs['frequency'] * i / count)
+  targetrps = endpointrps * len(endpointslist)
+  logger.info('Load test with %s virtual players on %s endpoints, target %.1f requests per second', len(schedule), len(endpointslist), targetrps)
+  tasks = set() ; segmentscache = {} ; totals = createloadstats() ; lastreport = start ; end = start + userargs['loadduration'] if userargs['loadduration'] > 0 else None
+  nextcalibration = start + 3 * userargs['frequency']
+  while not terminatethreads:
+    now = loop.time()
+    if end and now >= end:
+      break
+    if now >= nextcalibration:
+      for endpoint in endpointslist:
+        calibrateloadplayers(schedule, endpoint, now)
+      logger.debug('Load test with %s virtual players after calibration', sum(len(i['loadplayers']) for i in endpointslist))
+      nextcalibration = now + 30
+    if now - lastreport >= 30:
+      reportloadtest(logger, endpointslist, totals, now - lastreport, targetrps)
+      lastreport = now
+    intended, n, player = schedule[0]
+    if player['stopped']:
+      heapq.heappop(schedule)
+      continue
+    if intended > now:
+      await asyncio.sleep(min(intended - now, 1))
+      continue
+    heapq.heapreplace(schedule, (intended + userargs['frequency'], n, player))
+    task = loop.create_task(playercycle(logger, pool, player, intended, segmentscache))
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+  # Requests in flight are completed or timed out
+  if tasks:
+    await asyncio.wait(tasks, timeout = userargs['httptimeout'] * (2 + userargs['loadsegments']))
+  now = loop.time()
+  reportloadtest(logger, endpointslist, totals, max(now - lastreport, 0.001), targetrps)
+  requests = sum(i['requests'] for i in totals.values()) ; nbytes = sum(i['bytes'] for i in totals.values())
+  logger.info('Load test total %.1f requests per second (target %.1f) in %.1f seconds, %.1f MB/s, %s', requests / max(now - start, 0.001), targetrps, now - start, nbytes / max(now - start, 0.001) / 1048576, getloadsummary(totals))
+
+
+def runloadtest(logger, endpointslist:list):
+  asyncio.run(loadtest(logger, endpointslist))
+
+
+# Index of the avails of the tracking responses of a session by availId, with avail intervals sorted by start time for playhead lookups
+def createavailindex():
+  return {'hash': None, 'result': 'empty', 'invalidavails': 0, 'avails': {}, 'intervals': [], 'maxduration': 0.0}
+
+
+# Update avail index when the tracking response has changed, avails that are no longer in the response are removed, returns parse time [ms] or None if unchanged
+def updateavailindex(availindex:dict, trackingresponse):
+  trackingresponsetext = getresponsetext(trackingresponse, False)
+  digest = hashlib.blake2b(trackingresponsetext, digest_size = 16).digest()
+  if digest == availindex['hash']:
+    return None
+  start = time.perf_counter()
+  availindex['hash'] = digest ; availindex['invalidavails'] = 0
+  try:
+    trackingresponsedict = json.loads(trackingresponsetext)
+  except ValueError:
+    trackingresponsedict = None
+    availindex['result'] = 'invalid'
+  if trackingresponsedict == None:
+    pass
+  elif not trackingresponsedict:
+    availindex['result'] = 'empty'
+  elif 'avails' not in trackingresponsedict.keys():
+    availindex['result'] = 'noavails'
+  else:
+    availindex['result'] = 'ok'
+    avails = {}
+    for avail in trackingresponsedict['avails']:
+      if all(i in avail.keys() for i in ['availId', 'durationInSeconds', 'startTimeInSeconds']):
+        avails[str(avail['availId'])] = avail
+      else:
+        availindex['invalidavails'] = availindex['invalidavails'] + 1
+    for availid in [i for i in availindex['avails'].keys() if i not in avails]:
+      removeavailinterval(availindex, availid)
+    for availid, avail in avails.items():
+      interval = getavailinterval(availid, avail)
+      previous = availindex['avails'].get(availid)
+      availindex['avails'][availid] = avail
+      if previous != None:
+        if getavailinterval(availid, previous) == interval:
+          continue
+        removeavailinterval(availindex, availid, previous)
+        availindex['avails'][availid] = avail
+      bisect.insort(availindex['intervals'], interval)
+      availindex['maxduration'] = max(availindex['maxduration'], interval[1] - interval[0])
+  return round((time.perf_counter() - start) * 1000, 2)
+
+
+def getavailinterval(availid:str, avail:dict):
+  availstart = float(avail['startTimeInSeconds'])
+  return (availstart, availstart + float(avail['durationInSeconds']), availid)
+
+
+def removeavailinterval(availindex:dict, availid:str, avail:dict = None):
+  interval = getavailinterval(availid, avail if avail != None else availindex['avails'].pop(availid))
+  index = bisect.bisect_left(availindex['intervals'], interval)
+  if index < len(availindex['intervals']) and availindex['intervals'][index] == interval:
+    del availindex['intervals'][index]
+
+
+# Avail of the index with startTimeInSeconds <= playhead <= startTimeInSeconds + durationInSeconds
+def findavail(availindex:dict, playerplayhead:float):
+  if availindex['result'] != 'ok':
+    return None
+  index = bisect.bisect_right(availindex['intervals'], (playerplayhead, math.inf))
+  # Avails starting more than the longest avail duration before the playhead cannot contain it
+  while index > 0 and playerplayhead - availindex['intervals'][index - 1][0] <= availindex['maxduration']:
+    index = index - 1
+    if availindex['intervals'][index][1] >= playerplayhead:
+      return availindex['avails'][availindex['intervals'][index][2]]
+  return None
+
+
+# Session initialization URL of a MediaTailor playback URL, e.g. /v1/master/<account>/<config>/index.m3u8 -> /v1/session/<account>/<config>/index.m3u8
+def getsessionurl(url:str):
+  if '/v1/session/' in url:
+    return url
+  return url.replace('/v1/master/', '/v1/session/', 1).replace('/v1/dash/', '/v1/session/', 1)
+
+
+def createsessionstats(endpointtype:str):
+  return {'type': endpointtype, 'sessions': 0, 'failed': 0, 'sessioninit': createhistogram(), 'manifestresponsetime': createhistogram(), 'trackingresponsetime': createhistogram(),
+          'avails': 0, 'emptyavails': 0, 'adfill': createhistogram(), 'pods': {}}
+
+
+# Initialize --emtsessions sessions per endpoint with session initialization POST requests on shared connections, returns the sessions as endpoints
+async def createsessions(logger, endpointslist:list):
+  loop = asyncio.get_running_loop()
+  pool = asynchttppool(userargs['loadconnections'], userargs['httptimeout'])
+
+  async def createsession(endpoint:dict, index:int):
+    sessionurl = getsessionurl(endpoint['url'])
+    # Ads parameters can differ per session with {session} placeholder, e.g. {"userId": "user{session}"}
+    adsparams = {k: str(v).replace('{session}', str(index + 1)) for k, v in userargs['emtsessionparams'].items()}
+    body = json.dumps({'adsParams': adsparams, 'reportingMode': 'client'}).encode('utf-8')
+    start = loop.time() ; response = None
+    try:
+      response = await pool.request('POST', sessionurl, {'User-Agent': 'CanaryMonitor (v2.0)', 'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'}, body)
+    except asyncio.TimeoutError:
+      logger.warning('Session initialization timeout, url: %s', sessionurl)
+    except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+      logger.warning('Session initialization error, url: %s, exception: %s', sessionurl, repr(e))
+    latency = int((loop.time() - start) * 1000) ; session = None
+    if response and response.status >= 400:
+      logger.warning('Session initialization response %s, reason: %s, url: %s, response headers: %s', response.status, response.reason, sessionurl, response.headers.items())
+    elif response:
+      try:
+        sessioninfo = json.loads(getresponsetext(response, True))
+        session = dict(endpoint, name = endpoint['name'] + '-s' + str(index + 1), url = urljoin(sessionurl, sessioninfo['manifestUrl']),
+                       tracking = urljoin(sessionurl, sessioninfo['trackingUrl']) if sessioninfo.get('trackingUrl') else '', session = endpoint['name'])
+      except (ValueError, KeyError, TypeError):
+        logger.warning('Session initialization response without manifestUrl, url: %s', sessionurl)
+    with sessionstatslock:
+      stats = sessionstats.setdefault(endpoint['name'], createsessionstats(endpoint['type']))
+      recordhistogramvalue(stats['sessioninit'], latency)
+      if session:
+        stats['sessions'] = stats['sessions'] + 1
+      else:
+        stats['failed'] = stats['failed'] + 1
+    return session
+
+  sessions = await asyncio.gather(*(createsession(endpoint, i) for endpoint in endpointslist for i in range(userargs['emtsessions'])))
+  return [i for i in sessions if i]
+
+
+def initializesessions(logger, endpointslist:list):
+  start = time.perf_counter()
+  sessions = asyncio.run(createsessions(logger, endpointslist))
+  logger.info('Initialized %s of %s sessions of %s endpoints in %.1f seconds', len(sessions), len(endpointslist) * userargs['emtsessions'], len(endpointslist), time.perf_counter() - start)
+  return sessions
+
+
+# Fetch primary and rendition manifests of endpoints concurrently, at most --bootstrapconnections requests per origin
+# The monitoring thread of an endpoint starts as soon as its manifests are fetched and probes and monitors them without requesting them again
+async def bootstrapmonitors(logger, tlogger, endpointslist:list, lockm):
+  pool = asynchttppool(userargs['bootstrapconnections'], userargs['httptimeout'])
+  stats = {'endpoints': 0, 'requests': 0, 'failed': 0}
+  # Endpoints resuming from checkpoint are not probed
+  with checkpointlock:
+    resuming = set(v['endpoint'] for v in resumestates.values()) if userargs['checkpoint'] == True else set()
+
+  async def fetch(elogger, url:str):
+    start = time.perf_counter() ; response = None
+    stats['requests'] = stats['requests'] + 1
+    try:
+      response = await pool.request('GET', url, {'User-Agent': 'CanaryMonitor (v2.0)', 'Accept-Encoding': 'gzip'})
+    except asyncio.TimeoutError:
+      elogger.warning('Bootstrap request timeout, url: %s', url)
+    except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+      elogger.warning('Bootstrap request error, url: %s, exception: %s', url, repr(e))
+    if response and response.status >= 400:
+      elogger.warning('Bootstrap request response %s, reason: %s, url: %s', response.status, response.reason, url)
+      response = None
+    if not response:
+      stats['failed'] = stats['failed'] + 1
+      return None
+    return response, int((time.perf_counter() - start) * 1000)
+
+  async def bootstrapendpoint(endpoint:dict):
+    elogger = logging.LoggerAdapter(tlogger, {'endpointtype': endpoint['type'], 'renditionname': endpoint['name']})
+    primary = await fetch(elogger, endpoint['url']) if endpoint['name'] not in resuming else None
+    if primary:
+      prefetched = {'time': None, 'primary': primary, 'renditions': {}}
+      urls = []
+      if endpoint['type'] == 'hls':
+        responsetext = getresponsetext(primary[0], True)
+        if checkifprimary(elogger, responsetext):
+          renditions = findrenditions(elogger, responsetext, endpoint)
+          if renditions and (userargs['allrenditions'] == True or userargs['playerrenditions'] == True):
+            # The first rendition is probed
+            urls = [i['URL'] for i in [renditions[0]] + pickrenditions(renditions)]
+          elif renditions:
+            rendition = findrenditiontype(elogger, endpoint, renditions)
+            urls = [rendition['URL']] if rendition else []
+        else:
+          prefetched['renditions'][endpoint['url']] = primary
+      else:
+        prefetched['renditions'][endpoint['url']] = primary
+      urls = list(dict.fromkeys(urls))
+      for url, response in zip(urls, await asyncio.gather(*(fetch(elogger, i) for i in urls))):
+        if response:
+          prefetched['renditions'][url] = response
+      prefetched['time'] = time.perf_counter()
+      endpoint['bootstrap'] = prefetched
+      stats['endpoints'] = stats['endpoints'] + 1
+    startmonitorthread(tlogger, endpoint, lockm)
+
+  await asyncio.gather(*(bootstrapendpoint(i) for i in endpointslist))
+  return stats
+
+
+def bootstrapendpoints(logger, tlogger, endpointslist:list, lockm):
+  start = time.perf_counter()
+  stats = asyncio.run(bootstrapmonitors(logger, tlogger, endpointslist, lockm))
+  logger.info('Bootstrapped %s of %s endpoints with %s requests (%s failed) in %.1f seconds', stats['endpoints'], len(endpointslist), stats['requests'], stats['failed'], time.perf_counter() - start)
+
+
+# Record response time of a session for the aggregate of its MediaTailor configuration
+def recordsessionvalue(endpoint:dict, metric:str, value):
+  with sessionstatslock:
+    recordhistogramvalue(sessionstats[endpoint['session']][metric], value)
+
+
+# Record ad fill of an avail found in the tracking response of a session, ad pods (sequences of creatives) of the avail are compared across sessions
+def recordsessionavail(endpoint:dict, avail:dict):
+  ads = avail.get('ads', []) ; availduration = float(avail['durationInSeconds'])
+  filledduration = sum(float(i.get('durationInSeconds', 0)) for i in ads)
+  adfill = min(round(filledduration * 100 / availduration), 100) if availduration > 0 else 0
+  pod = tuple(str(i.get('creativeId', i.get('adId', ''))) for i in ads)
+  with sessionstatslock:
+    stats = sessionstats[endpoint['session']]
+    stats['avails'] = stats['avails'] + 1
+    if not ads:
+      stats['emptyavails'] = stats['emptyavails'] + 1
+    recordhistogramvalue(stats['adfill'], adfill)
+    pods = stats['pods'].setdefault(str(avail['availId']), {})
+    pods[pod] = pods.get(pod, 0) + 1
+
+
+# Log and publish aggregate ad fill and latency distributions of sessions per MediaTailor configuration since the last report
+def reportsessions(logger):
+  with sessionstatslock:
+    reports = {}
+    for name, stats in sessionstats.items():
+      reports[name] = stats
+      sessionstats[name] = createsessionstats(stats['type'])
+      sessionstats[name]['sessions'] = stats['sessions'] ; sessionstats[name]['failed'] = stats['failed']
+  for name, stats in reports.items():
+    percentiles = {k: '/'.join(str(i) for i in histogrampercentiles(stats[k], [50, 90, 99]).values()) or '-' for k in ('sessioninit', 'manifestresponsetime', 'trackingresponsetime')}
+    adfill = '/'.join(str(i) for i in histogrampercentiles(stats['adfill'], [10, 50, 90]).values()) or '-'
+    podcounts = [len(i) for i in stats['pods'].values()]
+    logger.info('Sessions of %s: %s active, %s failed initializations, session initialization p50/p90/p99 %s ms, manifest response time p50/p90/p99 %s ms, tracking response time p50/p90/p99 %s ms, '
+                'avails %s, ad fill p10/p50/p90 %s %%, mean ad fill %.1f %%, empty avails %s, distinct ad pods per avail mean %.1f, max %s',
+                name, stats['sessions'], stats['failed'], percentiles['sessioninit'], percentiles['manifestresponsetime'], percentiles['trackingresponsetime'], stats['avails'], adfill,
+                stats['adfill']['sum'] / stats['adfill']['count'] if stats['adfill']['count'] else 0, stats['emptyavails'],
+                sum(podcounts) / len(podcounts) if podcounts else 0, max(podcounts) if podcounts else 0)
+    if userargs['metrics'] == True:
+      metricstopublish = {'sessions': stats['sessions'], 'sessionavails': stats['avails'], 'sessionemptyavails': stats['emptyavails']}
+      for k in ('sessioninit', 'manifestresponsetime', 'trackingresponsetime', 'adfill'):
+        if stats[k]['count'] > 0:
+          metricstopublish['session' + k if not k.startswith('session') else k] = stats[k]
+      publishmetrics(logger, {'type': stats['type']}, name, metricstopublish)
+
+
+# Event loop of --firebeacons, runs in its own thread so that beacon requests never block monitor threads
+def runbeacons(logger):
+  global beaconloop, beaconpool
+  loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop)
+  beaconpool = asynchttppool(userargs['beaconconnections'], userargs['httptimeout'])
+  beaconloop = loop
+  logger.info('Firing ad beacons with up to ' + str(userargs['beaconconnections']) + ' connections per origin')
+  loop.run_forever()
+
+
+# Schedule beacons of all ads of an avail at the times of their tracking events relative to the player playhead, called by monitor threads
+def schedulebeacons(logger, endpoint:dict, avail:dict, playerplayhead:float):
+  loop = beaconloop
+  if loop == None:
+    return
+  beacons = []
+  for ad in avail.get('ads', []):
+    for trackingevent in ad.get('trackingEvents', []):
+      eventstart = float(trackingevent.get('startTimeInSeconds', ad.get('startTimeInSeconds', avail['startTimeInSeconds'])))
+      for url in trackingevent.get('beaconUrls', []):
+        beacons.append((max(eventstart - playerplayhead, 0.0), trackingevent.get('eventType', 'unknown'), url))
+  if beacons:
+    loop.call_soon_threadsafe(addbeacons, logger, endpoint, beacons)
+
+
+# Runs in the beacons event loop
+def addbeacons(logger, endpoint:dict, beacons:list):
+  loop = asyncio.get_running_loop()
+  for delay, eventtype, url in beacons:
+    loop.call_later(delay, lambda eventtype = eventtype, url = url: loop.create_task(firebeacon(logger, endpoint, eventtype, url)))
+
+
+async def firebeacon(logger, endpoint:dict, eventtype:str, url:str):
+  loop = asyncio.get_running_loop()
+  start = loop.time() ; result = 'requests'
+  try:
+    response = await beaconpool.request('GET', url, {'User-Agent': 'CanaryMonitor (v2.0)'}, keepbody = False)
+    if response.status >= 400:
+      result = 'errors'
+      logger.warning('Beacon request response %s, reason: %s, event type: %s, url: %s', response.status, response.reason, eventtype, url)
+  except asyncio.TimeoutError:
+    result = 'timeouts'
+    logger.warning('Beacon request timeout, event type: %s, url: %s', eventtype, url)
+  except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+    result = 'errors'
+    logger.warning('Beacon request error, event type: %s, url: %s, exception: %s', eventtype, url, repr(e))
+  latency = int((loop.time() - start) * 1000)
+  with beaconstatslock:
+    stats = beaconstats.setdefault(endpoint['name'], {'type': endpoint['type'], 'events': {}})['events'].setdefault(eventtype, {'requests': 0, 'errors': 0, 'timeouts': 0, 'latency': createhistogram()})
+    stats['requests'] = stats['requests'] + 1
+    if result != 'requests':
+      stats[result] = stats[result] + 1
+    if result != 'timeouts':
+      recordhistogramvalue(stats['latency'], latency)
+
+
+# Log and publish beacon requests, errors, timeouts and latency per endpoint and event type since the last report
+def reportbeacons(logger):
+  with beaconstatslock:
+    reports = dict(beaconstats)
+    beaconstats.clear()
+  for name, stats in reports.items():
+    logger.info('Beacons of %s: %s', name, ', '.join('%s %s requests, %s errors, %s timeouts, latency p50/p90/p99 %s ms' % (eventtype, i['requests'], i['errors'], i['timeouts'],
+                '/'.join(str(j) for j in histogrampercentiles(i['latency'], [50, 90, 99]).values()) or '-') for eventtype, i in stats['events'].items()))
+    if userargs['metrics'] == True:
+      metricstopublish = {}
+      for eventtype, i in stats['events'].items():
+        metricstopublish['beacon' + eventtype.lower() + 'requests'] = i['requests']
+        metricstopublish['beacon' + eventtype.lower() + 'errors'] = i['errors']
+        metricstopublish['beacon' + eventtype.lower() + 'timeouts'] = i['timeouts']
+        if i['latency']['count'] > 0:
+          metricstopublish['beacon' + eventtype.lower() + 'latency'] = i['latency']
+      publishmetrics(logger, {'type': stats['type']}, name, metricstopublish)
+
+
+# Find profiler thread group by thread name
+def getprofilergroup(threadname:str):
+  if threadname == 'MainThread':
+    return 'main'
+  for i in ['hls', 'dash', 'smooth']:
+    if threadname.startswith(i + '-'):
+      return i
+  return 'other'
+
+
+# Write collapsed stacks, one line per unique stack with sample count, e.g. for flamegraph.pl or speedscope
+def writecollapsedstacks(logger, samples:dict, folder:str):
+  lines = {}
+  for (group, stack), count in list(samples.items()):
+    frames = ';'.join(code.co_name + ' (' + os.path.basename(code.co_filename) + ':' + str(code.co_firstlineno) + ')' for code in stack)
+    lines.setdefault(group, []).append(group + ';' + frames + ' ' + str(count))
+  for group in lines.keys():
+    filepath = Path(folder, 'profile_' + group + '.folded')
+    try:
+      with Path(folder, 'profile_' + group + '.folded.tmp').open('w+t') as f:
+        f.write('\n'.join(lines[group]) + '\n')
+      os.replace(str(Path(folder, 'profile_' + group + '.folded.tmp')), str(filepath))
+    except Exception:
+      logger.exception('Error saving profile ' + str(filepath))
+
+
+# Sample stacks of all threads, sampling is slowed down if it would take more than the allowed share of one CPU
+def samplingprofiler(logger):
+  samples = {} ; threadgroups = {} ; samplescount = 0 ; samplingtime = 0.0
+  interval = 1 / userargs['profilerate'] ; maxoverhead = userargs['profileoverhead'] / 100
+  nextwritetime = time.perf_counter() + userargs['profileinterval'] ; ownident = threading.get_ident()
+  logger.info('Started sampling profiler at %s samples per second', userargs['profilerate'])
+  while not terminatethreads:
+    start = time.perf_counter()
+    # Refresh thread groups only when a new thread shows up
+    frames = sys._current_frames()
+    if any(i not in threadgroups.keys() for i in frames.keys()):
+      threadgroups = {i.ident: getprofilergroup(i.name) for i in threading.enumerate()}
+    for ident, frame in frames.items():
+      if ident == ownident:
+        continue
+      stack = []
+      while frame != None:
+        stack.append(frame.f_code)
+        frame = frame.f_back
+      key = (threadgroups.get(ident, 'other'), tuple(reversed(stack)))
+      samples[key] = samples.get(key, 0) + 1
+    del frames
+    samplescount = samplescount + 1
+    timeittook = time.perf_counter() - start ; samplingtime = samplingtime + timeittook
+    # Bound overhead: sampling time / (sampling time + sleep time) <= maxoverhead
+    time.sleep(max(interval - timeittook, timeittook / maxoverhead - timeittook))
+    if time.perf_counter() >= nextwritetime or terminatethreads:
+      writecollapsedstacks(logger, samples, userargs['logsfolder'])
+      logger.info('Sampling profiler wrote %s unique stacks from %s samples, average sampling time %.3f ms', len(samples), samplescount, samplingtime / samplescount * 1000)
+      nextwritetime = time.perf_counter() + userargs['profileinterval']
+
+
 # Compare HLS tags, which should be static
 def comparevalues(logger, source:dict, key:str, value):
   if key in source.keys():
     if not source[key] == value:
-      logger.warning('Manifest value has changed for ' + key + ', previously: ' + str(source[key]) + ', now: ' + str(value))
+      logger.warning('Manifest value has changed for %s, previously: %s, now: %s', key, source[key], value)
       source[key] = value
       return False
   else:
@@ -802,21 +2738,96 @@ def comparelastsegment(logger, new:dict, old:dict):
         oldlist.append({i: old[i]})
         arethesame = False
   if not arethesame:
-    logger.warning('Last segment info has changed, previously: ' + str(oldlist) + ', now: ' + str(newlist))
+    logger.warning('Last segment info has changed, previously: %s, now: %s', oldlist, newlist)
   return arethesame
 
 
 # CloudWatch metrics
 def addmetricvalue(metricstopublish:dict, metric:str, value):
-  if metric in metricstopublish.keys():
-    if value in metricstopublish[metric]['values']:
-      index = metricstopublish[metric]['values'].index(value)
-      metricstopublish[metric]['counts'][index] = metricstopublish[metric]['counts'][index] + 1
-    else:
-      metricstopublish[metric]['values'].append(value)
-      metricstopublish[metric]['counts'].append(1)
+  if metric not in metricstopublish.keys():
+    metricstopublish[metric] = createhistogram()
+  recordhistogramvalue(metricstopublish[metric], value)
+
+
+# Log-linear (HDR style) histogram with 128 sub-buckets per power of 2, i.e. less than 1% relative bucket width
+histogramsubbuckets = 128
+cloudwatchmaxvalues = 150
+
+
+# Histogram
+def createhistogram():
+  return {'buckets': {}, 'count': 0, 'sum': 0.0, 'min': None, 'max': None}
+
+
+# Find bucket key for a value in O(1), zero and negative values have their own buckets
+def histogrambucketkey(value):
+  if value == 0:
+    return 0
+  mantissa, exponent = math.frexp(abs(value))
+  key = (exponent + 1100) * histogramsubbuckets + int((mantissa * 2 - 1) * histogramsubbuckets) + 1
+  return key if value > 0 else -key
+
+
+# Record value, each bucket keeps count and sum so that its representative value is the mean of its values
+def recordhistogramvalue(histogram:dict, value, count:int = 1):
+  key = histogrambucketkey(value)
+  bucket = histogram['buckets'].get(key)
+  if bucket:
+    bucket[0] = bucket[0] + count ; bucket[1] = bucket[1] + value * count
   else:
-    metricstopublish[metric] = {'values': [value], 'counts': [1]}
+    histogram['buckets'][key] = [count, value * count]
+  histogram['count'] = histogram['count'] + count ; histogram['sum'] = histogram['sum'] + value * count
+  if histogram['min'] == None or value < histogram['min']:
+    histogram['min'] = value
+  if histogram['max'] == None or value > histogram['max']:
+    histogram['max'] = value
+
+
+# Merge histogram snapshot into another histogram
+def mergehistograms(target:dict, source:dict):
+  for key, bucket in list(source['buckets'].items()):
+    if key in target['buckets'].keys():
+      target['buckets'][key][0] = target['buckets'][key][0] + bucket[0] ; target['buckets'][key][1] = target['buckets'][key][1] + bucket[1]
+    else:
+      target['buckets'][key] = [bucket[0], bucket[1]]
+  target['count'] = target['count'] + source['count'] ; target['sum'] = target['sum'] + source['sum']
+  if source['min'] != None and (target['min'] == None or source['min'] < target['min']):
+    target['min'] = source['min']
+  if source['max'] != None and (target['max'] == None or source['max'] > target['max']):
+    target['max'] = source['max']
+  return target
+
+
+# Get sorted values and counts of histogram
+def histogramvaluescounts(histogram:dict):
+  values = [] ; counts = []
+  for key in sorted(histogram['buckets'].keys()):
+    count, total = histogram['buckets'][key]
+    value = total / count
+    values.append(int(value) if value == int(value) else round(value, 6))
+    counts.append(count)
+  return values, counts
+
+
+# Split histogram into CloudWatch Values / Counts chunks respecting the limit of values per metric datum
+def histogramtocloudwatch(histogram:dict):
+  values, counts = histogramvaluescounts(histogram)
+  return [(values[i:i + cloudwatchmaxvalues], counts[i:i + cloudwatchmaxvalues]) for i in range(0, len(values), cloudwatchmaxvalues)]
+
+
+# Get percentile summary of histogram, e.g. {'p50': 12, 'p99': 250}
+def histogrampercentiles(histogram:dict, percentiles:list = [50, 90, 99]):
+  summary = {} ; values, counts = histogramvaluescounts(histogram)
+  if not values:
+    return summary
+  for percentile in percentiles:
+    rank = histogram['count'] * percentile / 100 ; cumulative = 0
+    for value, count in zip(values, counts):
+      cumulative = cumulative + count
+      if cumulative >= rank:
+        break
+    summary['p' + str(percentile)] = value
+  return summary
 
 
 # Helper
@@ -847,35 +2858,198 @@ def addsegmenttonewsegments(manifestinfo, segmentinfo, xmlperiodid):
     manifestinfo['newsegmentspts'][(xmlperiodid, segmentinfo['n'])] = [pts]
 
 
+# Poll cycle phases, segment requests and archiving are recorded by request3() and saveresponse() and excluded from the enclosing phase
+pollphases = ['fetch', 'decompress', 'parse', 'checks', 'segments', 'tracking', 'archive', 'publish']
+
+
+# Start measuring phases of a poll cycle
+def startpollphases():
+  phasetimes = dict.fromkeys(pollphases, 0.0)
+  phasetimes['nested'] = 0.0 ; phasetimes['cpustart'] = time.thread_time() ; phasetimes['start'] = time.perf_counter()
+  pollphase.phasetimes = phasetimes
+  return phasetimes
+
+
+# Add time since mark to phase, excluding nested segment requests and archiving, and return new mark
+def addphasetime(phasetimes:dict, phase:str, mark:tuple):
+  now = time.perf_counter()
+  phasetimes[phase] = phasetimes[phase] + now - mark[0] - (phasetimes['nested'] - mark[1])
+  return (now, phasetimes['nested'])
+
+
+# Helper
+def getphasemark(phasetimes:dict):
+  return (time.perf_counter(), phasetimes['nested'])
+
+
+# Replaces phase functions in monitor() without --phaseprofiler
+def skipphases(*args):
+  return None
+
+
+# Add time of nested phase, called from request3() and saveresponse()
+def addnestedphasetime(phase:str, start:float):
+  phasetimes = getattr(pollphase, 'phasetimes', None)
+  if phasetimes != None:
+    elapsed = time.perf_counter() - start
+    phasetimes[phase] = phasetimes[phase] + elapsed ; phasetimes['nested'] = phasetimes['nested'] + elapsed
+
+
+# Finish measuring phases of a poll cycle and keep them for rolling percentiles
+def finishpollphases(renditionname:str, phasetimes:dict):
+  pollphase.phasetimes = None
+  stats = phasestats.get(renditionname)
+  if stats == None:
+    stats = {i: deque(maxlen = userargs['phasewindow']) for i in pollphases + ['cpu', 'total']}
+    phasestats[renditionname] = stats
+  for i in pollphases:
+    stats[i].append(round(phasetimes[i] * 1000, 3))
+  stats['cpu'].append(round((time.thread_time() - phasetimes['cpustart']) * 1000, 3))
+  stats['total'].append(round((time.perf_counter() - phasetimes['start']) * 1000, 3))
+
+
+# Add phase times of last finished poll cycle as metrics [milliseconds]
+def addphasemetrics(metricstopublish:dict, renditionname:str):
+  stats = phasestats.get(renditionname)
+  if stats != None and stats['total']:
+    for i in stats.keys():
+      metricstopublish['phase' + i] = stats[i][-1]
+
+
+# Rolling percentiles of poll cycle phases across all renditions and for the most expensive renditions [milliseconds]
+def getphasereport(top:int = 5):
+  overall = {} ; renditionstotals = []
+  for renditionname, stats in list(phasestats.items()):
+    for phase, values in list(stats.items()):
+      if phase not in overall.keys():
+        overall[phase] = createhistogram()
+      for value in list(values):
+        recordhistogramvalue(overall[phase], value)
+    total = createhistogram()
+    for value in list(stats['total']):
+      recordhistogramvalue(total, value)
+    if total['count'] > 0:
+      renditionstotals.append((histogrampercentiles(total, [90])['p90'], renditionname))
+  report = 'Poll cycle phases [ms] across ' + str(len(renditionstotals)) + ' renditions: ' + str({phase: histogrampercentiles(overall[phase]) for phase in overall.keys()})
+  renditionstotals.sort(reverse = True)
+  for p90, renditionname in renditionstotals[:top]:
+    stats = phasestats[renditionname] ; renditionreport = {}
+    for phase in stats.keys():
+      histogram = createhistogram()
+      for value in list(stats[phase]):
+        recordhistogramvalue(histogram, value)
+      renditionreport[phase] = histogrampercentiles(histogram, [90])['p90'] if histogram['count'] > 0 else 0
+    report = report + ', ' + renditionname + ' p90: ' + str(renditionreport)
+  return report
+
+
+# Save tracking response to the tracking folder of a rendition
+def savetrackingresponse(logger, trackingresponse, trackingfolder):
+  filepath = ''
+  if userargs['gzip'] == True:
+    foundcontentencodinggzip = False
+    for i in trackingresponse.headers.keys():
+      if 'content-encoding' == i.lower():
+        if trackingresponse.headers[i] == 'gzip':
+          foundcontentencodinggzip = True
+          break
+    if foundcontentencodinggzip:
+      filepath = saveresponse(logger, trackingresponse.data, trackingfolder, utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '.json', False, False)
+    else:
+      filepath = saveresponse(logger, getresponsetext(trackingresponse, True), trackingfolder, utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '.json', False, True)
+  else:
+    filepath = saveresponse(logger, getresponsetext(trackingresponse, True), trackingfolder, utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '.json', False, False)
+  if filepath:
+    logger.debug('Saved file %s', filepath)
+
+
+# Tracking poller of an endpoint, started by the first monitor of the endpoint and kept across monitor restarts
+def gettrackingpoller(tlogger, endpoint:dict, renditionname:str):
+  if 'trackingpoller' not in endpoint.keys():
+    endpoint['trackingpoller'] = {'lock': threading.Lock(), 'wake': threading.Event(), 'adbreak': False, 'playhead': None, 'snapshot': None, 'metrics': {}}
+    threading.Thread(target = polltracking, name = 'tracking-' + endpoint['name'], args = (tlogger, endpoint, renditionname, endpoint['trackingpoller']), daemon = True).start()
+  return endpoint['trackingpoller']
+
+
+# Poll tracking of a session independently of manifest requests, every --trackingfastinterval seconds during ad breaks and every --trackingslowinterval seconds otherwise.
+# Requests are conditional with the ETag of the last response, changed responses are parsed into the avail index and shared with the monitor as a snapshot
+def polltracking(tlogger, endpoint:dict, renditionname:str, poller:dict):
+  logger = logging.LoggerAdapter(tlogger, {'endpointtype': endpoint['type'], 'renditionname': renditionname})
+  availindex = createavailindex() ; indexsnapshot = createavailindex() ; etag = None ; etagurl = None ; metricstopublish = {}
+  if userargs['tracking'] == True:
+    trackingfolder = Path(userargs['trackingfolder'], renditionname)
+  while not terminatethreads:
+    pollstart = monotonicclock()
+    with poller['lock']:
+      adbreak = poller['adbreak'] ; playhead = poller['playhead']
+    if userargs['playheadawaretracking'] and playhead != None:
+      # Playhead moves with the clock since it was taken at the last manifest request
+      trackingurl = endpoint['tracking'] + '?aws.playheadPositionInSeconds=' + str(round(playhead[0] + pollstart - playhead[1]))
+    else:
+      trackingurl = endpoint['tracking']
+    headers = {'Accept-Encoding': 'gzip'}
+    if etag and etagurl == trackingurl:
+      headers['If-None-Match'] = etag
+    trackingresponse, trackingresponsetime = request3(logger, headers, trackingurl, 'GET', 'tracking', metricstopublish)
+    if userargs['metrics'] == True:
+      addmetricvalue(metricstopublish, 'trackingresponsetime', trackingresponsetime)
+    if 'session' in endpoint.keys():
+      recordsessionvalue(endpoint, 'trackingresponsetime', trackingresponsetime)
+    snapshot = None
+    if trackingresponse and trackingresponse.status != 304:
+      etag = trackingresponse.headers.get('ETag') ; etagurl = trackingurl
+      trackingparsetime = updateavailindex(availindex, trackingresponse)
+      if trackingparsetime != None:
+        indexsnapshot = dict(availindex, avails = dict(availindex['avails']), intervals = list(availindex['intervals']))
+        if userargs['metrics'] == True:
+          addmetricvalue(metricstopublish, 'trackingparsetime', trackingparsetime)
+      snapshot = {'response': trackingresponse, 'url': trackingurl, 'availindex': indexsnapshot}
+      if userargs['tracking'] == True:
+        savetrackingresponse(logger, trackingresponse, trackingfolder)
+    with poller['lock']:
+      if snapshot != None:
+        poller['snapshot'] = snapshot
+      for k, v in metricstopublish.items():
+        if isinstance(v, dict) and k in poller['metrics'].keys():
+          mergehistograms(poller['metrics'][k], v)
+        else:
+          poller['metrics'][k] = v
+    metricstopublish = {}
+    # Ad break start wakes the poller up
+    if poller['wake'].wait(max(pollstart + (userargs['trackingfastinterval'] if adbreak else userargs['trackingslowinterval']) - monotonicclock(), 0)):
+      poller['wake'].clear()
+
+
+# Share ad break state and playhead of a monitor with the tracking poller, returns the latest tracking snapshot
+def readtrackingpoller(poller:dict, adbreak:bool, playerplayhead, metricstopublish:dict):
+  with poller['lock']:
+    if adbreak and not poller['adbreak']:
+      poller['wake'].set()
+    poller['adbreak'] = adbreak
+    poller['playhead'] = (playerplayhead, monotonicclock()) if playerplayhead != None else None
+    metricstopublish.update(poller['metrics']) ; poller['metrics'] = {}
+    return poller['snapshot']
+
+
 # Main function for monitoring
-def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesponse:dict, fromprimary:bool, stoprunning, lock, sharedlist:list, dotracking = False):
+def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesponse:dict, fromprimary:bool, stoprunning, lock, sharedlist:list, dotracking = False, resume:dict = None):
   logger = logging.LoggerAdapter(tlogger, {'endpointtype': endpoint['type'], 'renditionname': renditionname})
-  # Loadtest
-  if userargs['loadtest'] == True:
-    while not terminatethreads and not stoprunning.is_set():
-      start = time.perf_counter() ; manifestresponsetime = 0 ; trackingresponsetime = 0
-      # Request manifest
-      if endpoint['type'] == 'hls':
-        manifestresponse, manifestresponsetime = request3(logger, {'Accept-Encoding': 'gzip'}, rendition['URL'], 'GET', 'manifest', {})
-      elif endpoint['type'] == 'dash':
-        manifestresponse, manifestresponsetime = request3(logger, {'Accept-Encoding': 'gzip'}, endpoint['url'], 'GET', 'manifest', {})
-      # Request tracking
-      if dotracking:
-        trackingresponse, trackingresponsetime = request3(logger, {'Accept-Encoding': 'gzip'}, endpoint['tracking'], 'GET', 'tracking', {})
-      # Wait between requests
-      waittime = start - time.perf_counter() + userargs['frequency']
-      if waittime > 0:
-        time.sleep(waittime)
-      elif waittime < -1:
-        logger.error('Negative wait time ' + '{:.3f}'.format(waittime) + ' sec between manifest requests, manifest response time: ' + str(manifestresponsetime) + ' msec, tracking response time: ' + str(trackingresponsetime))
-    return
-  
-  metricstopublish = {} ; segmentinfo = {} ; startsession = True ; segmenttags = [] ; manifestinfo = {} ; scteinfo = {} ; segmentationdescriptorinfo = {} ; segmentationdescriptors = [] ; stale = False ; oldperiods = [] ; newperiods = [] ; adaptationsets = [] ; presentationtimeoffsets = [] ; lastcontentdurations = deque(maxlen = 10) ; eventtypesdiscovered = set() ; adsinfo = {} ; adinfo = {} ; trackingresponsedict = {} ; ptsmisalignment = False
+  metricstopublish = {} ; segmentinfo = {} ; startsession = True ; segmenttags = [] ; manifestinfo = {} ; scteinfo = {} ; segmentationdescriptorinfo = {} ; segmentationdescriptors = [] ; stale = False ; oldperiods = [] ; newperiods = [] ; adaptationsets = [] ; presentationtimeoffsets = [] ; lastcontentdurations = deque(maxlen = 10) ; eventtypesdiscovered = set() ; adsinfo = {} ; adinfo = {} ; availindex = createavailindex() ; ptsmisalignment = False
+
+  # Time until all endpoints are monitored
+  recordmonitoredendpoint(endpoint)
+
+  # Poll cycle phases are measured only with --phaseprofiler
+  if userargs['phaseprofiler'] == True:
+    startphases = startpollphases ; addphase = addphasetime ; markphase = getphasemark
+  else:
+    startphases = skipphases ; addphase = skipphases ; markphase = skipphases
 
   # Common initial settings
-  now = time.perf_counter()
+  now = monotonicclock()
   nextstaletime = now + userargs['stale']
   nextdurationcalctime = now
+  nextcheckpointtime = now + userargs['checkpointinterval']
 
   # Configure manifests download folder for this endpoint
   if userargs['manifests'] == True:
@@ -885,6 +3059,11 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
   if userargs['tracking'] == True:
     trackingfolder = Path(userargs['trackingfolder'], renditionname)
 
+  # Tracking poller instead of tracking requests after manifest requests
+  trackingpoller = None
+  if userargs['trackingpoller'] == True and userargs['trackingrequests'] == True and endpoint['tracking'] != '' and (dotracking or endpoint['type'] == 'dash'):
+    trackingpoller = gettrackingpoller(tlogger, endpoint, renditionname)
+
   # DASH monitor
   if endpoint['type'] == 'dash':
 
@@ -899,12 +3078,16 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
       'newsegmentspts': {} # for comparing t value across representations
     }
 
-    logger.info('Started monitoring manifest URL ' + manifestinfo['url'])
+    # Warm restart from checkpoint
+    if resume != None:
+      sessionstarttime, sessioncontentduration = restorecheckpointstate(manifestinfo, resume) ; startsession = False
+
+    logger.info('Started monitoring manifest URL %s', manifestinfo['url'])
 
     while not terminatethreads and not stoprunning.is_set():
       metricstopublish.clear() ; segmentinfo.clear() ; segmenttags.clear() ; oldperiods.clear() ; newperiods.clear() ; segmentcount = 0 ; discontinuitysequence = 0 ; foundlastsegment = False ; foundnewsegment = False ; durationsum = 0.0 ; durationsumforpdt = 0.0 ; foundpdt = False ; foundsupplementalproperty = False ; calculatemanifestduration = False ; manifestinfo['foundlastsegment'] = False ; manifestinfo['foundnewsegment'] = False ; manifestinfo['foundnewperiod'] = False ; manifestinfo['foundlastperiod'] = False ; manifestinfo['newsegmentspts'].clear() ; newcontentduration = 0.0
     
-      mrequesttime = time.perf_counter()
+      mrequesttime = monotonicclock() ; phasetimes = startphases() ; phasemark = markphase(phasetimes)
     
       # Initialize session
       if startsession:
@@ -912,19 +3095,23 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
 
       # Request manifest
       logger.debug('Requesting manifest')
-      response, responsetime = request3(logger, {'Accept-Encoding': 'gzip'}, manifestinfo['url'], 'GET', 'manifest', metricstopublish)
+      response, responsetime = takeprefetched(endpoint, manifestinfo['url']) or request3(logger, {'Accept-Encoding': 'gzip'}, manifestinfo['url'], 'GET', 'manifest', metricstopublish)
+      phasemark = addphase(phasetimes, 'fetch', phasemark)
 
       # Manifest response time
       manifestinfo['latency'] = responsetime
-      if userargs['cwmetrics'] == True:
+      if userargs['metrics'] == True:
         metricstopublish['manifestresponsetime'] = manifestinfo['latency']
+      if 'session' in endpoint.keys():
+        recordsessionvalue(endpoint, 'manifestresponsetime', responsetime)
       
       if response:
         responsetext = getresponsetext(response, False)
+        phasemark = addphase(phasetimes, 'decompress', phasemark)
         
         # Manifest size https://docs.python.org/3/library/email.compat32-message.html#email.message.Message
         manifestinfo['size'] = len(responsetext)
-        if userargs['cwmetrics'] == True:
+        if userargs['metrics'] == True:
           metricstopublish['manifestsize'] = manifestinfo['size']
 
         # Save response
@@ -938,15 +3125,15 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                   foundcontentencodinggzip = True
                   break
             if foundcontentencodinggzip:
-              filepath = saveresponse(logger, response.data, manifestsfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, False)
+              filepath = saveresponse(logger, response.data, manifestsfolder, utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, False)
             else:
-              filepath = saveresponse(logger, responsetext.decode('utf-8'), manifestsfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, True)
+              filepath = saveresponse(logger, responsetext.decode('utf-8'), manifestsfolder, utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, True)
           else:
-            filepath = saveresponse(logger, responsetext.decode('utf-8'), manifestsfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, False)
+            filepath = saveresponse(logger, responsetext.decode('utf-8'), manifestsfolder, utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, False)
           if filepath:
-            logger.debug('Saved file ' + str(filepath))
+            logger.debug('Saved file %s', filepath)
         
-        if time.perf_counter() > nextdurationcalctime:
+        if monotonicclock() > nextdurationcalctime:
           calculatemanifestduration = True
           
         # Parse XML
@@ -959,18 +3146,18 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
           if xmlavailabilitystarttime:
             if 'xmlavailabilitystarttime' in manifestinfo.keys():
               if xmlavailabilitystarttime != manifestinfo['xmlavailabilitystarttime']:
-                logger.warning('Manifest value has changed for availabilityStartTime from ' + str(manifestinfo['xmlavailabilitystarttime']) + ' to ' + str(xmlavailabilitystarttime))
+                logger.warning('Manifest value has changed for availabilityStartTime from %s to %s', manifestinfo['xmlavailabilitystarttime'], xmlavailabilitystarttime)
                 try:
                   manifestinfo['xmlavailabilitystarttime'] = xmlavailabilitystarttime
                   manifestinfo['availabilitystarttimedatetime'] = datetime.datetime.strptime(xmlavailabilitystarttime[0:19],'%Y-%m-%dT%H:%M:%S')
                 except Exception:
-                  logger.error('Error parsing availabilityStartTime UTC time: ' + str(xmlavailabilitystarttime))
+                  logger.error('Error parsing availabilityStartTime UTC time: %s', xmlavailabilitystarttime)
             else:
               try:
                 manifestinfo['xmlavailabilitystarttime'] = xmlavailabilitystarttime
                 manifestinfo['availabilitystarttimedatetime'] = datetime.datetime.strptime(xmlavailabilitystarttime[0:19],'%Y-%m-%dT%H:%M:%S')
               except Exception:
-                logger.error('Error parsing availabilityStartTime UTC time: ' + str(xmlavailabilitystarttime))
+                logger.error('Error parsing availabilityStartTime UTC time: %s', xmlavailabilitystarttime)
           xmlperiods = xmlroot.findall('default:Period', ns)
           for xmlperiod in xmlperiods:
             scteinfo.clear() ; segmentationdescriptors.clear() ; adaptationsets.clear() ; presentationtimeoffsets.clear()
@@ -1000,7 +3187,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                   # Check duration of previous period
                   if 'lastperiodduration' in manifestinfo.keys():
                     if manifestinfo['lastperiodduration'] < 0.5:
-                      logger.warning('Duration of period was ' + '{:.3f}'.format(manifestinfo['lastperiodduration']) + ' seconds, which is less than 500 ms')
+                      logger.warning('Duration of period was %.3f seconds, which is less than 500 ms', manifestinfo['lastperiodduration'])
 
                   # Calculate EMT ad break duration
                   if userargs['emt'] == True and 'adbreak' in manifestinfo.keys():
@@ -1018,19 +3205,19 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                         if 'lastperiodduration' in manifestinfo.keys():
                           adbreakdurationdelta = manifestinfo['lastperiodduration'] - manifestinfo['advertisedadbreakduration']
                           if adbreakdurationdelta > 1:
-                            logger.warning('Ad break was longer than advertised by ' + '{:.3f}'.format(adbreakdurationdelta) + ' seconds, advertised: ' + str(manifestinfo['advertisedadbreakduration']) + ', actual: ' + '{:.3f}'.format(manifestinfo['lastperiodduration']))
+                            logger.warning('Ad break was longer than advertised by %.3f seconds, advertised: %s, actual: %.3f', adbreakdurationdelta, manifestinfo['advertisedadbreakduration'], manifestinfo['lastperiodduration'])
                           if adbreakdurationdelta < -1:
-                            logger.warning('Ad break was shorter than advertised by ' + '{:.3f}'.format(abs(adbreakdurationdelta)) + ' seconds, advertised: ' + str(manifestinfo['advertisedadbreakduration']) + ', actual: ' + '{:.3f}'.format(manifestinfo['lastperiodduration']))
-                          if userargs['cwmetrics'] == True:
+                            logger.warning('Ad break was shorter than advertised by %.3f seconds, advertised: %s, actual: %.3f', abs(adbreakdurationdelta), manifestinfo['advertisedadbreakduration'], manifestinfo['lastperiodduration'])
+                          if userargs['metrics'] == True:
                             addmetricvalue(metricstopublish, 'addurationdelta', round(adbreakdurationdelta, 3))
-                      if userargs['cwmetrics'] == True:
+                      if userargs['metrics'] == True:
                         if 'lastperiodduration' in manifestinfo.keys():
                           addmetricvalue(metricstopublish, 'addurationactual', round(manifestinfo['lastperiodduration'], 3))
 
                   # EMT ad break start
                   if 'lastperiod' in manifestinfo.keys():
                     if userargs['emt'] == True and '_' in segmentinfo['period'] and '_' not in manifestinfo['lastperiod']:
-                      if userargs['cwmetrics'] == True:
+                      if userargs['metrics'] == True:
                         if 'adbreak' not in manifestinfo.keys():
                           addmetricvalue(metricstopublish, 'adbreak', 1)
                           manifestinfo['emtadbreakduration'] = 0
@@ -1039,7 +3226,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                           manifestinfo['emtadbreakduration'] = 0
                       manifestinfo['adbreak'] = True
                       manifestinfo['trackingconfirmed'] = False
-                      manifestinfo['adbreakstart'] = time.perf_counter()
+                      manifestinfo['adbreakstart'] = monotonicclock()
 
                   # Capture scte info of a new period when non EMT
                   xmleventstream = xmlperiod.find('default:EventStream', ns)
@@ -1130,7 +3317,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                             manifestinfo['advertisedadbreakduration'] = 0.0
 
                         # Publish metrics
-                        if userargs['cwmetrics']:
+                        if userargs['metrics']:
                           if newadbreak:
                             addmetricvalue(metricstopublish, 'adbreak', 1)
                             if 'availNum' in scteinfo.keys():
@@ -1140,7 +3327,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                           if newadduration:
                             addmetricvalue(metricstopublish, 'addurationadvertised', adduration)
 
-                  logger.info('Found new period: {\'id\': ' + xmlperiodid + ', \'SCTE35 - signal type\': ' + str(scteinfo) + ', \'segmentation descriptor info\': ' + str(segmentationdescriptors) + '}')
+                  logger.info('Found new period: {\'id\': %s, \'SCTE35 - signal type\': %s, \'segmentation descriptor info\': %s}', xmlperiodid, scteinfo, segmentationdescriptors)
 
                   manifestinfo['lastperiodduration'] = 0.0
 
@@ -1153,7 +3340,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                     if 'adbreak' in manifestinfo.keys():
                       if '_' not in segmentinfo['period'] and manifestinfo['adbreak'] == True:
                         if 'emtadbreakduration' in manifestinfo.keys():
-                          if userargs['cwmetrics'] == True:
+                          if userargs['metrics'] == True:
                             addmetricvalue(metricstopublish, 'addurationactual', round(manifestinfo['emtadbreakduration'], 3))
                         manifestinfo['adbreak'] = False
                         if 'trackingconfirmed' in manifestinfo.keys() and endpoint['tracking'] != '':
@@ -1194,7 +3381,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                         manifestinfo['spdatetime'] = datetime.datetime.strptime(xmlsupplementalpropertyutctime, '%Y-%m-%dT%H:%M:%SZ')
                         foundsupplementalproperty = True
                       except Exception:
-                        logger.error('Error parsing SupplementalProperty UTC time: ' + str(xmlsupplementalpropertyutctime))
+                        logger.error('Error parsing SupplementalProperty UTC time: %s', xmlsupplementalpropertyutctime)
 
                 # Go through adaptation sets
                 xmladaptationsets = xmlperiod.findall('default:AdaptationSet', ns)
@@ -1212,7 +3399,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                             foundrepresentationid = True
                             break
                       if foundrepresentationid == False:
-                        logger.warning('Updated primary monitoring representation id because representation id ' + rendition['ID'] + ' is not present in period ' + segmentinfo['period'])
+                        logger.warning('Updated primary monitoring representation id because representation id %s is not present in period %s', rendition['ID'], segmentinfo['period'])
                         rendition['ID'] = xmlrepresentations[0].get('id')
                   for xmlrepresentation in xmlrepresentations:
                     foundlastsegment = True if manifestinfo['foundnewperiod'] == True else False
@@ -1249,8 +3436,8 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                                     if foundlastsegment and 'nextt' in manifestinfo['lastsegmentinfo'].keys():
                                       if manifestinfo['lastsegmentinfo']['nextt'] != segmentinfo['t']:
                                         if manifestinfo['lastsegmentinfo']['period'] == segmentinfo['period']:
-                                          logger.warning('Discontinuity inside period ' + str(segmentinfo['period']))
-                                        if userargs['cwmetrics'] == True:
+                                          logger.warning('Discontinuity inside period %s', segmentinfo['period'])
+                                        if userargs['metrics'] == True:
                                           addmetricvalue(metricstopublish, 'discontinuity', 1)
                                     for i in range(sr + 1):
                                       segmentinfo['n'] = segmentinfo['n'] + 1 ; segmentinfo['t'] = int(xmlt) + segmentinfo['d'] * i ; segmentinfo['nextt'] = segmentinfo['t'] + segmentinfo['d']
@@ -1281,7 +3468,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                                         if xmlbaseurl != None:
                                           segmentinfo['url'] = urljoin(endpoint['url'], xmlbaseurl.text)
                                           segmentinfo['url'] = urljoin(segmentinfo['url'], segmentinfo['name'])
-                                        logger.debug('Found new segment in the first video representation, segment info: ' + str(segmentinfo))
+                                        logger.debug('Found new segment in the first video representation, segment info: %s', segmentinfo)
                                         manifestinfo['foundnewsegment'] = True ; manifestinfo['newsegmentinfo'] = segmentinfo.copy()
                                         sessioncontentduration = sessioncontentduration + segmentinfo['dsec'] ; newcontentduration = newcontentduration + segmentinfo['dsec']
                                         if 'lastperiodduration' in manifestinfo.keys():
@@ -1294,15 +3481,15 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                                             segmentresponse, segmentresponsetime = request3(logger, {}, segmentinfo['url'], 'GET', 'segment', metricstopublish)
                                           # Segment response time
                                           srtime = segmentresponsetime
-                                          if userargs['cwmetrics'] == True:
+                                          if userargs['metrics'] == True:
                                             addmetricvalue(metricstopublish, 'segmentresponsetime', srtime)
                                           if segmentresponse != None:
                                             # Save response
                                             if userargs['segments'] == True:
                                               segmentname = segmentinfo['name'].split('?')[0]
-                                              filepath = saveresponse(logger, segmentresponse.data, segmentsfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '_' + segmentname, True, False)
+                                              filepath = saveresponse(logger, segmentresponse.data, segmentsfolder, utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '_' + segmentname, True, False)
                                               if filepath:
-                                                logger.debug('Saved file ' + str(filepath))
+                                                logger.debug('Saved file %s', filepath)
 
                                             # Check segment size
                                             foundcontentlength = False
@@ -1311,7 +3498,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                                                 foundcontentlength = True
                                                 break
                                             if foundcontentlength:
-                                              if userargs['cwmetrics'] == True:
+                                              if userargs['metrics'] == True:
                                                 addmetricvalue(metricstopublish, 'segmentsize', int(segmentresponse.headers[i]))
 
                                         # Collect segment PTS information
@@ -1325,8 +3512,8 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                                     if foundlastsegment and 'nextt' in manifestinfo['lastsegmentinfo'].keys():
                                       if manifestinfo['lastsegmentinfo']['nextt'] != segmentinfo['t']:
                                         if manifestinfo['lastsegmentinfo']['period'] == segmentinfo['period']:
-                                          logger.warning('Discontinuity inside period' + str(segmentinfo['period']))
-                                        if userargs['cwmetrics'] == True:
+                                          logger.warning('Discontinuity inside period%s', segmentinfo['period'])
+                                        if userargs['metrics'] == True:
                                           addmetricvalue(metricstopublish, 'discontinuity', 1)
                                     helpt = int(xmlt)
                                     for i in range(pr + 1):
@@ -1365,7 +3552,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                                               if xmlbaseurl != None:
                                                 segmentinfo['url'] = urljoin(endpoint['url'], xmlbaseurl.text)
                                                 segmentinfo['url'] = urljoin(segmentinfo['url'], segmentinfo['name'])
-                                              logger.debug('Found new segment in the first video representation, segment info: ' + str(segmentinfo))
+                                              logger.debug('Found new segment in the first video representation, segment info: %s', segmentinfo)
                                               sessioncontentduration = sessioncontentduration + segmentinfo['dsec'] ; newcontentduration = newcontentduration + segmentinfo['dsec']
                                               manifestinfo['foundnewsegment'] = True ; manifestinfo['newsegmentinfo'] = segmentinfo.copy()
                                               if 'lastperiodduration' in manifestinfo.keys():
@@ -1378,14 +3565,14 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                                                   segmentresponse, segmentresponsetime = request3(logger, {}, segmentinfo['url'], 'GET', 'segment', metricstopublish)
                                                 if segmentresponse != None:
                                                   srtime = segmentresponsetime
-                                                  if userargs['cwmetrics'] == True:
+                                                  if userargs['metrics'] == True:
                                                     addmetricvalue(metricstopublish, 'segmentresponsetime', srtime)
                                                   # Save response
                                                   if userargs['segments'] == True:
                                                     segmentname = segmentinfo['name'].split('?')[0]
-                                                    filepath = saveresponse(logger, segmentresponse.data, segmentsfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '_' + segmentname, True, False)
+                                                    filepath = saveresponse(logger, segmentresponse.data, segmentsfolder, utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '_' + segmentname, True, False)
                                                     if filepath:
-                                                      logger.debug('Saved file ' + str(filepath))
+                                                      logger.debug('Saved file %s', filepath)
 
                                                   # Check segment size
                                                   foundcontentlength = False
@@ -1394,7 +3581,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                                                       foundcontentlength = True
                                                       break
                                                   if foundcontentlength:
-                                                    if userargs['cwmetrics'] == True:
+                                                    if userargs['metrics'] == True:
                                                       addmetricvalue(metricstopublish, 'segmentsize', int(segmentresponse.headers[i]))
                                               # Collect segment PTS information
                                               addsegmenttonewsegments(manifestinfo, segmentinfo, xmlperiodid)
@@ -1437,11 +3624,12 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                                           helpt = segmentinfo['t'] + segmentinfo['d']
                       else:
                         logger.error('Did not find any SegmentTemplate')
+        phasemark = addphase(phasetimes, 'parse', phasemark)
         # After parsing manifest
         if manifestinfo['foundnewsegment']:
           # Update stale time
           stale = False
-          nextstaletime = time.perf_counter() + userargs['stale']
+          nextstaletime = monotonicclock() + userargs['stale']
           # Update last segment info
           manifestinfo['lastperiod'] = manifestinfo['lastsegmentinfo']['period'] ; manifestinfo['lastn'] = manifestinfo['lastsegmentinfo']['n']
           # Compare pts value across all representations for each new segment
@@ -1450,19 +3638,19 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
             ptsdelta = round(abs(maxpts - minpts), 3)
             if ptsdelta > 0.1:
               if ptsmisalignment == False:
-                logger.warning('Possible lip sync issue, maximum absolute PTS delta across representations: ' + str(ptsdelta) + ' sec, segment number: ' + str(key[1])  + ', PTS values: ' + str(manifestinfo['newsegmentspts'][key]))
+                logger.warning('Possible lip sync issue, maximum absolute PTS delta across representations: %s sec, segment number: %s, PTS values: %s', ptsdelta, key[1], manifestinfo['newsegmentspts'][key])
               ptsmisalignment = True
             else:
               if ptsmisalignment == True:
                 logger.info('PTS delta across representations is now within 100 ms')
               ptsmisalignment = False
-            if userargs['cwmetrics'] == True:
+            if userargs['metrics'] == True:
               addmetricvalue(metricstopublish, 'ptsdelta', ptsdelta)
 
         # Check if found last segment
         if not manifestinfo['foundlastsegment']:
           lastmanifestheaders = str(manifestinfo['lastmanifestheaders']) if 'lastmanifestheaders' in manifestinfo.keys() else '[]'
-          logger.warning('Last segment {\'period\': ' + manifestinfo['lastperiod'] + ', \'n\': ' + str(manifestinfo['lastn']) + '}' + ' not found, previous manifest response headers: ' + lastmanifestheaders + ', manifest response headers now: ' + str(response.headers.items()) )
+          logger.warning('Last segment {\'period\': %s, \'n\': %s} not found, previous manifest response headers: %s, manifest response headers now: %s', manifestinfo['lastperiod'], manifestinfo['lastn'], lastmanifestheaders, response.headers.items() )
 
         # Check PDT delta (includes the duration of last segment)
         if foundsupplementalproperty:
@@ -1471,8 +3659,8 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
               helpt = (manifestinfo['lastsegmentinfo']['t'] + manifestinfo['lastsegmentinfo']['d'] - manifestinfo['lastsegmentinfo']['pto']) / manifestinfo['lastsegmentinfo']['timescale']
             else:
               helpt = (manifestinfo['lastsegmentinfo']['t'] + manifestinfo['lastsegmentinfo']['d']) / manifestinfo['lastsegmentinfo']['timescale']
-            manifestinfo['pdtdelta'] = (manifestinfo['spdatetime'] - datetime.datetime.utcnow()).total_seconds() + helpt
-            if userargs['cwmetrics'] == True and manifestinfo['foundnewsegment']:
+            manifestinfo['pdtdelta'] = (manifestinfo['spdatetime'] - utcnow()).total_seconds() + helpt
+            if userargs['metrics'] == True and manifestinfo['foundnewsegment']:
               metricstopublish['pdtdelta'] = round(manifestinfo['pdtdelta'])
 
         # Compare manifests
@@ -1481,109 +3669,106 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
             # Check if all not-new periods in this request are present in previous request
             if not all(x in manifestinfo['periods'] for x in oldperiods):
               lastmanifestheaders = str(manifestinfo['lastmanifestheaders']) if 'lastmanifestheaders' in manifestinfo.keys() else '[]'
-              logger.warning('Inconsistency in manifest periods, previous manifest response headers: ' + lastmanifestheaders + ', this manifest response headers: ' + str(response.headers.items()) + ', these periods: ' + str(oldperiods) + ' are not subset of these periods: ' + str(manifestinfo['periods']))
+              logger.warning('Inconsistency in manifest periods, previous manifest response headers: %s, this manifest response headers: %s, these periods: %s are not subset of these periods: %s', lastmanifestheaders, response.headers.items(), oldperiods, manifestinfo['periods'])
 
         # Save all periods
         manifestinfo['periods'] = oldperiods + newperiods         
 
         # Manifest duration
         if calculatemanifestduration:
-          if userargs['cwmetrics'] == True:
+          if userargs['metrics'] == True:
             metricstopublish['manifestduration'] = round(durationsum / 60, 1)
-          nextdurationcalctime = time.perf_counter() + 300
+          nextdurationcalctime = monotonicclock() + 300
 
+        phasemark = addphase(phasetimes, 'checks', phasemark)
         # Get tracking
         if endpoint['tracking'] != '':
           if userargs['trackingrequests'] == True:
             foundplayerplayhead = False ; playerplayhead = 0.0
             if 'availabilitystarttimedatetime' in manifestinfo.keys():
-              playerplayhead = (datetime.datetime.utcnow() - manifestinfo['availabilitystarttimedatetime']).total_seconds()
+              playerplayhead = (utcnow() - manifestinfo['availabilitystarttimedatetime']).total_seconds()
               foundplayerplayhead = True
-            if userargs['playheadawaretracking'] and foundplayerplayhead:
-              trackingurl = endpoint['tracking'] + '?aws.playheadPositionInSeconds=' + str(round(playerplayhead))
+            if trackingpoller != None:
+              trackingresponse = None
+              snapshot = readtrackingpoller(trackingpoller, manifestinfo.get('adbreak', False), playerplayhead if foundplayerplayhead else None, metricstopublish)
+              if snapshot != None:
+                trackingresponse = snapshot['response'] ; trackingurl = snapshot['url'] ; availindex = snapshot['availindex']
             else:
-              trackingurl = endpoint['tracking']
-            trackingresponse, trackingresponsetime = request3(logger, {'Accept-Encoding': 'gzip'}, trackingurl, 'GET', 'tracking', metricstopublish)
-            if userargs['cwmetrics'] == True:
-              metricstopublish['trackingresponsetime'] = trackingresponsetime
+              if userargs['playheadawaretracking'] and foundplayerplayhead:
+                trackingurl = endpoint['tracking'] + '?aws.playheadPositionInSeconds=' + str(round(playerplayhead))
+              else:
+                trackingurl = endpoint['tracking']
+              trackingresponse, trackingresponsetime = request3(logger, {'Accept-Encoding': 'gzip'}, trackingurl, 'GET', 'tracking', metricstopublish)
+              if userargs['metrics'] == True:
+                metricstopublish['trackingresponsetime'] = trackingresponsetime
+              if 'session' in endpoint.keys():
+                recordsessionvalue(endpoint, 'trackingresponsetime', trackingresponsetime)
             if trackingresponse:
               if all(i in manifestinfo.keys() for i in ['adbreak', 'adbreakstart', 'trackingconfirmed']):
                 if manifestinfo['adbreak'] == True:
-                  # Parse tracking response
-                  trackingresponsetext = getresponsetext(trackingresponse, True) ; trackingresponsedict.clear()
-                  try:
-                    trackingresponsedict = json.loads(trackingresponsetext)
-                  except json.decoder.JSONDecodeError:
+                  # Parse tracking response only when it has changed and find the avail at the playhead in the avail index
+                  if trackingpoller == None:
+                    trackingparsetime = updateavailindex(availindex, trackingresponse)
+                    if trackingparsetime != None and userargs['metrics'] == True:
+                      metricstopublish['trackingparsetime'] = trackingparsetime
+                  if availindex['result'] == 'invalid':
                     logger.error('Tracking response could not be converted to json')
-                  if trackingresponsedict:
-                    if 'avails' in trackingresponsedict.keys():
-                      for avail in trackingresponsedict['avails']:
-                        if all(i in avail.keys() for i in ['availId', 'durationInSeconds', 'startTimeInSeconds']):
-                          if float(avail['startTimeInSeconds']) <= playerplayhead <= float(avail['startTimeInSeconds']) + float(avail['durationInSeconds']):
-                            availadscount = 0 ; adsinfo.clear()
-                            if 'ads' in avail.keys():
-                              availadscount = len(avail['ads'])
-                              if manifestinfo['trackingconfirmed'] == False:
-                                for index, ad in enumerate(avail['ads']):
-                                  adinfo.clear()
-                                  if 'adId' in ad.keys():
-                                    adinfo['adId'] = ad['adId']
-                                  if 'durationInSeconds' in ad.keys():
-                                    adinfo['durationInSeconds'] = ad['durationInSeconds']
-                                  if 'creativeId' in ad.keys():
-                                    adinfo['creativeId'] = ad['creativeId']
-                                  if 'adTitle' in ad.keys():
-                                    adinfo['adTitle'] = ad['adTitle']
-                                  adsinfo[str(index + 1)] = adinfo.copy()
-                              if userargs['checktrackingevents'] == True:
-                                for index, ad in enumerate(avail['ads']):
-                                  eventtypesdiscovered.clear()
-                                  if 'trackingEvents' in ad.keys():
-                                    for trackingevent in ad['trackingEvents']:
-                                      if 'eventType' in trackingevent.keys():
-                                        eventtypesdiscovered.add(trackingevent['eventType'])
-                                      else:
-                                        logger.warning('Missing eventType in trackingEvent in avail')
-                                    if len(eventtypestolookfor - eventtypesdiscovered) > 0:
-                                      logger.warning('Missing event types in avail ad: ' + str(eventtypestolookfor - eventtypesdiscovered))
-                                  else:
-                                    logger.warning('Missing trackingEvents in ad')
-                            if manifestinfo['trackingconfirmed'] == False:
-                              manifestinfo['trackingconfirmed'] = True
-                              timesinceadbreakstart = round(time.perf_counter() - manifestinfo['adbreakstart'])
-                              if foundplayerplayhead:
-                                playerplayheaddelta = round(playerplayhead - avail['startTimeInSeconds'])
-                                if abs(playerplayheaddelta) > userargs['frequency'] * 3 or abs(timesinceadbreakstart) > userargs['frequency'] * 3:
-                                  logger.warning('Found avail in tracking response, but playhead is drifted, avail id: ' + str(avail['availId']) + ', duration: ' + str(avail['durationInSeconds']) + ', ads count: ' + str(availadscount) + ', ads info: ' + str(adsinfo) + ', time since ad break start: ' + str(timesinceadbreakstart) + ' sec, playhead: ' + str(round(playerplayhead)) + ' sec, avail startTimeInSeconds: ' + str(round(avail['startTimeInSeconds'])) + ' sec, delta: ' + str(playerplayheaddelta) + ' sec, tracking url: ' + trackingurl + ', response headers: ' + str(trackingresponse.headers.items()))
-                                else:
-                                  logger.info('Found avail in tracking response, avail id: ' + str(avail['availId']) + ', duration: ' + str(avail['durationInSeconds']) + ', ads count: ' + str(availadscount) + ', ads info: ' + str(adsinfo) + ', time since ad break start: ' + str(timesinceadbreakstart) + ' sec, playhead: ' + str(round(playerplayhead)) + ' sec, avail startTimeInSeconds: ' + str(round(avail['startTimeInSeconds'])) + ' sec, delta: ' + str(playerplayheaddelta) + ' sec, tracking url: ' + trackingurl)
+                  elif availindex['result'] == 'empty':
+                    logger.warning('Empty tracking response')
+                  elif availindex['result'] == 'noavails':
+                    logger.warning('No avails in tracking response')
+                  elif availindex['invalidavails'] > 0:
+                    logger.warning('Missing some important fields in avail, avails: %s', availindex['invalidavails'])
+                  avail = findavail(availindex, playerplayhead)
+                  if avail != None:
+                    availadscount = 0 ; adsinfo.clear()
+                    if 'ads' in avail.keys():
+                      availadscount = len(avail['ads'])
+                      if manifestinfo['trackingconfirmed'] == False:
+                        for index, ad in enumerate(avail['ads']):
+                          adinfo.clear()
+                          if 'adId' in ad.keys():
+                            adinfo['adId'] = ad['adId']
+                          if 'durationInSeconds' in ad.keys():
+                            adinfo['durationInSeconds'] = ad['durationInSeconds']
+                          if 'creativeId' in ad.keys():
+                            adinfo['creativeId'] = ad['creativeId']
+                          if 'adTitle' in ad.keys():
+                            adinfo['adTitle'] = ad['adTitle']
+                          adsinfo[str(index + 1)] = adinfo.copy()
+                      if userargs['checktrackingevents'] == True:
+                        for index, ad in enumerate(avail['ads']):
+                          eventtypesdiscovered.clear()
+                          if 'trackingEvents' in ad.keys():
+                            for trackingevent in ad['trackingEvents']:
+                              if 'eventType' in trackingevent.keys():
+                                eventtypesdiscovered.add(trackingevent['eventType'])
                               else:
-                                logger.warning('Found avail in tracking response, but cannot get playhead, avail id: ' + str(avail['availId']) + ', duration: ' + str(avail['durationInSeconds']) + ', ads count: ' + str(availadscount) + ', time since ad break start: ' + str(timesinceadbreakstart) + ' sec, tracking url: ' + trackingurl + ', response headers: ' + str(trackingresponse.headers.items()))
+                                logger.warning('Missing eventType in trackingEvent in avail')
+                            if len(eventtypestolookfor - eventtypesdiscovered) > 0:
+                              logger.warning('Missing event types in avail ad: %s', eventtypestolookfor - eventtypesdiscovered)
+                          else:
+                            logger.warning('Missing trackingEvents in ad')
+                    if manifestinfo['trackingconfirmed'] == False:
+                      manifestinfo['trackingconfirmed'] = True
+                      if 'session' in endpoint.keys():
+                        recordsessionavail(endpoint, avail)
+                      if userargs['firebeacons'] == True and foundplayerplayhead:
+                        schedulebeacons(logger, endpoint, avail, playerplayhead)
+                      timesinceadbreakstart = round(monotonicclock() - manifestinfo['adbreakstart'])
+                      if foundplayerplayhead:
+                        playerplayheaddelta = round(playerplayhead - avail['startTimeInSeconds'])
+                        if abs(playerplayheaddelta) > userargs['frequency'] * 3 or abs(timesinceadbreakstart) > userargs['frequency'] * 3:
+                          logger.warning('Found avail in tracking response, but playhead is drifted, avail id: %s, duration: %s, ads count: %s, ads info: %s, time since ad break start: %s sec, playhead: %s sec, avail startTimeInSeconds: %s sec, delta: %s sec, tracking url: %s, response headers: %s', avail['availId'], avail['durationInSeconds'], availadscount, adsinfo, timesinceadbreakstart, round(playerplayhead), round(avail['startTimeInSeconds']), playerplayheaddelta, trackingurl, trackingresponse.headers.items())
                         else:
-                          logger.warning('Missing some important fields in avail')
-                    else:
-                      logger.warning('No avails in tracking response')
-                  else:
-                    logger.warning('Empty tracking response')
-              # Save tracking response
-              if userargs['tracking']:
-                filepath = ''
-                if userargs['gzip'] == True:
-                  foundcontentencodinggzip = False
-                  for i in trackingresponse.headers.keys():
-                    if 'content-encoding' == i.lower():
-                      if trackingresponse.headers[i] == 'gzip':
-                        foundcontentencodinggzip = True
-                        break
-                  if foundcontentencodinggzip:
-                    filepath = saveresponse(logger, trackingresponse.data, trackingfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '.json', False, False)
-                  else:
-                    filepath = saveresponse(logger, getresponsetext(trackingresponse, True), trackingfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '.json', False, True)
-                else:
-                  filepath = saveresponse(logger, getresponsetext(trackingresponse, True), trackingfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '.json', False, False)
-                if filepath:
-                  logger.debug('Saved file ' + str(filepath))
+                          logger.info('Found avail in tracking response, avail id: %s, duration: %s, ads count: %s, ads info: %s, time since ad break start: %s sec, playhead: %s sec, avail startTimeInSeconds: %s sec, delta: %s sec, tracking url: %s', avail['availId'], avail['durationInSeconds'], availadscount, adsinfo, timesinceadbreakstart, round(playerplayhead), round(avail['startTimeInSeconds']), playerplayheaddelta, trackingurl)
+                      else:
+                        logger.warning('Found avail in tracking response, but cannot get playhead, avail id: %s, duration: %s, ads count: %s, time since ad break start: %s sec, tracking url: %s, response headers: %s', avail['availId'], avail['durationInSeconds'], availadscount, timesinceadbreakstart, trackingurl, trackingresponse.headers.items())
+              # Save tracking response, the tracking poller saves its own responses
+              if userargs['tracking'] and trackingpoller == None:
+                savetrackingresponse(logger, trackingresponse, trackingfolder)
 
+        phasemark = addphase(phasetimes, 'tracking', phasemark)
         # Check for new content shortage
         lastcontentdurations.append(newcontentduration)
         if len(lastcontentdurations) == lastcontentdurations.maxlen:
@@ -1597,8 +3782,8 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
           if goahead == True and lasttwocontentdurations < 0.25 * 2 * userargs['frequency']:
             lastmanifestheaders = str(manifestinfo['lastmanifestheaders']) if 'lastmanifestheaders' in manifestinfo.keys() else '[]'
             thismanifestheaders = str(response.headers.items()) if response else '[]'
-            logger.warning('Content shortage during last 2 manifest requests. New content duration of last 10 manifest requests: ' + str(lastcontentdurations) + ', previous manifest response headers: ' + lastmanifestheaders + ', this manifest response headers: ' + thismanifestheaders)
-            if userargs['cwmetrics'] == True:
+            logger.warning('Content shortage during last 2 manifest requests. New content duration of last 10 manifest requests: %s, previous manifest response headers: %s, this manifest response headers: %s', lastcontentdurations, lastmanifestheaders, thismanifestheaders)
+            if userargs['metrics'] == True:
               metricstopublish['contentshortage'] = 1
               
         # Update last manifest headers
@@ -1610,39 +3795,50 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
 
       # Check input buffer size
       inputbuffersize = int(userargs['initialinputbuffersize'] - (mrequesttime - sessionstarttime) + sessioncontentduration)
-      if userargs['cwmetrics'] == True:
+      if userargs['metrics'] == True:
         metricstopublish['inputbuffersize'] = inputbuffersize
       if inputbuffersize < 0:
         if manifestinfo['foundnewsegment']:
           startsession = True
 
       # Check if stale
-      now = time.perf_counter()
+      now = monotonicclock()
       if now > nextstaletime:
         stale = True
       if stale:
         manifestheaders = str(response.headers.items()) if response else ''
         if manifestheaders:
-          logger.warning('Stale manifest, last manifest headers: ' + manifestheaders)
+          logger.warning('Stale manifest, last manifest headers: %s', manifestheaders)
         else:
           logger.warning('Stale manifest')
-        if userargs['cwmetrics'] == True:
+        if userargs['metrics'] == True:
           metricstopublish['stale'] = 1
 
       # Publish metrics
-      if userargs['cwmetrics'] == True:
+      phasemark = addphase(phasetimes, 'checks', phasemark)
+      if userargs['phaseprofiler'] == True and userargs['phasemetrics'] == True:
+        addphasemetrics(metricstopublish, renditionname)
+      if userargs['metrics'] == True:
         publishmetrics(logger, endpoint, renditionname, metricstopublish)
+      phasemark = addphase(phasetimes, 'publish', phasemark)
+      if userargs['phaseprofiler'] == True:
+        finishpollphases(renditionname, phasetimes)
     
+      # Keep state for warm restart
+      if userargs['checkpoint'] == True and mrequesttime >= nextcheckpointtime:
+        savecheckpointstate(endpoint, rendition, renditionname, fromprimary, manifestinfo, mrequesttime - sessionstarttime, sessioncontentduration)
+        nextcheckpointtime = mrequesttime + userargs['checkpointinterval']
+
       # Stop if stale and rendition is from primary manifest
       if stale and fromprimary:
         break
 
       # Wait between requests
-      waittime = mrequesttime - time.perf_counter() + userargs['frequency']
+      waittime = mrequesttime - monotonicclock() + userargs['frequency']
       if waittime > 0:
-        time.sleep(waittime)
+        monitorsleep(waittime)
       elif not calculatemanifestduration and waittime < -1:
-        logger.error('Negative wait time ' + '{:.3f}'.format(waittime) + ' sec between manifest requests')
+        logger.error('Negative wait time %.3f sec between manifest requests', waittime)
   
   # HLS monitor      
   elif endpoint['type'] == 'hls':
@@ -1653,13 +3849,17 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
     manifestinfo['initialmanifestduration'] = proberesponse['manifestduration']
     manifestinfo['url'] = rendition['URL']
 
-    logger.info('Started monitoring manifest URL ' + manifestinfo['url'])
+    # Warm restart from checkpoint
+    if resume != None:
+      sessionstarttime, sessioncontentduration = restorecheckpointstate(manifestinfo, resume) ; startsession = False
+
+    logger.info('Started monitoring manifest URL %s', manifestinfo['url'])
 
     # Loop until terminated by parent thread
     while not terminatethreads and not stoprunning.is_set():
       metricstopublish.clear() ; segmentinfo.clear() ; segmenttags.clear() ; segmentcount = 0 ; discontinuitysequence = 0 ; foundlastsegment = False ; foundnewsegment = False ; durationsum = 0.0 ; durationsumforpdt = 0.0 ; foundpdt = False ; lastsequenceofthismanifest = 0 ; samefirstsegment = False ; calculatemanifestduration = False ; manifestinfo['foundlastsegment'] = False ; manifestinfo['foundnewsegment'] = False ; newcontentduration = 0.0 ; gonethroughheaders = False
 
-      mrequesttime = time.perf_counter()
+      mrequesttime = monotonicclock() ; phasetimes = startphases() ; phasemark = markphase(phasetimes)
     
       # Initialize session
       if startsession:
@@ -1667,19 +3867,23 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
 
       # Request manifest
       logger.debug('Requesting manifest')
-      response, responsetime = request3(logger, {'Accept-Encoding': 'gzip'}, manifestinfo['url'], 'GET', 'manifest', metricstopublish)
+      response, responsetime = takeprefetched(endpoint, manifestinfo['url']) or request3(logger, {'Accept-Encoding': 'gzip'}, manifestinfo['url'], 'GET', 'manifest', metricstopublish)
+      phasemark = addphase(phasetimes, 'fetch', phasemark)
       
       # Manifest response time
       manifestinfo['latency'] = responsetime
-      if userargs['cwmetrics'] == True:
+      if userargs['metrics'] == True:
         metricstopublish['manifestresponsetime'] = manifestinfo['latency']
+      if 'session' in endpoint.keys():
+        recordsessionvalue(endpoint, 'manifestresponsetime', responsetime)
 
       if response:
         responsetext = getresponsetext(response, True)
+        phasemark = addphase(phasetimes, 'decompress', phasemark)
         
         # Manifest size
         manifestinfo['size'] = len(responsetext)
-        if userargs['cwmetrics'] == True:
+        if userargs['metrics'] == True:
           metricstopublish['manifestsize'] = manifestinfo['size']
           
         # Save response
@@ -1693,13 +3897,13 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                   foundcontentencodinggzip = True
                   break
             if foundcontentencodinggzip:
-              filepath = saveresponse(logger, response.data, manifestsfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, False)
+              filepath = saveresponse(logger, response.data, manifestsfolder, utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, False)
             else:
-              filepath = saveresponse(logger, responsetext, manifestsfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, True)
+              filepath = saveresponse(logger, responsetext, manifestsfolder, utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, True)
           else:
-            filepath = saveresponse(logger, responsetext, manifestsfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, False)
+            filepath = saveresponse(logger, responsetext, manifestsfolder, utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, False)
           if filepath:
-            logger.debug('Saved file ' + str(filepath))
+            logger.debug('Saved file %s', filepath)
 
         for line in responsetext.split('\n'):
           line = line.strip()
@@ -1761,7 +3965,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                 if match:
                   manifestinfo['lastexplicitpdtdate'] = datetime.datetime.strptime(match.group(), '%Y-%m-%dT%H:%M:%S')
                 else:
-                  logger.error('Error parsing EXT-X-PROGRAM-DATE-TIME: ' + line)
+                  logger.error('Error parsing EXT-X-PROGRAM-DATE-TIME: %s', line)
 
           # EXTINF
           elif line.startswith('#EXTINF:'):
@@ -1812,7 +4016,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
 
             # Is new segment
             if segmentinfo['mediasequence'] > manifestinfo['lastmediasequence']:
-              logger.debug('Found new segment, segment info: ' + str(segmentinfo) + ', segment tags: ' + str(segmenttags))
+              logger.debug('Found new segment, segment info: %s, segment tags: %s', segmentinfo, segmenttags)
               foundnewsegment = True ; manifestinfo['foundnewsegment'] = True
               sessioncontentduration = sessioncontentduration + segmentinfo['duration'] ; newcontentduration = newcontentduration + segmentinfo['duration']
               # Publish segment duration
@@ -1821,7 +4025,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
               # Check segment duration
               if 'EXT-X-TARGETDURATION' in manifestinfo.keys():
                 if round(segmentinfo['duration']) > manifestinfo['EXT-X-TARGETDURATION']:
-                  logger.warning('Segment duration exceeded target duration (EXT-X-TARGETDURATION: ' + str(manifestinfo['EXT-X-TARGETDURATION']) + ', segment duration: ' + str(segmentinfo['duration']) + ')')
+                  logger.warning('Segment duration exceeded target duration (EXT-X-TARGETDURATION: %s, segment duration: %s)', manifestinfo['EXT-X-TARGETDURATION'], segmentinfo['duration'])
                 
 
               # Check for PDT jump
@@ -1831,10 +4035,10 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                   if match1 and match2:
                     pdtjump = datetime.datetime.strptime(match1.group(), '%Y-%m-%dT%H:%M:%S.%f') - datetime.datetime.strptime(match2.group(), '%Y-%m-%dT%H:%M:%S.%f')
                     if pdtjump < datetime.timedelta():
-                      logger.warning('Negative jump in PDT value, from ' + manifestinfo['lastsegmentinfo']['pdt'] + ' to ' + segmentinfo['pdt'])
+                      logger.warning('Negative jump in PDT value, from %s to %s', manifestinfo['lastsegmentinfo']['pdt'], segmentinfo['pdt'])
                     # if pdtjump > datetime.timedelta(milliseconds = manifestinfo['lastsegmentinfo']['duration'] * 2500):
                     if pdtjump > datetime.timedelta(milliseconds = int(manifestinfo['EXT-X-TARGETDURATION']) * 2 * 1000):
-                      logger.warning('Positive jump in PDT value by more than 2x EXT-X-TARGETDURATION, from ' + manifestinfo['lastsegmentinfo']['pdt'] + ' to ' + segmentinfo['pdt'])
+                      logger.warning('Positive jump in PDT value by more than 2x EXT-X-TARGETDURATION, from %s to %s', manifestinfo['lastsegmentinfo']['pdt'], segmentinfo['pdt'])
                   else:
                     logger.error('Cannot compute PDT jump')
 
@@ -1858,19 +4062,19 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                               if match.group(2) == manifestinfo['datarangeid']:
                                 adbreakend = True
                               else:
-                                logger.warning('Found ad break end SCTE35-IN EXT-X-DATERANGE tag with id ' + match.group(2) + ', which is not maching ad break start SCTE35-OUT EXT-X-DATERANGE tag id ' + manifestinfo['datarangeid'])
+                                logger.warning('Found ad break end SCTE35-IN EXT-X-DATERANGE tag with id %s, which is not maching ad break start SCTE35-OUT EXT-X-DATERANGE tag id %s', match.group(2), manifestinfo['datarangeid'])
                           break
                     if adbreakend:
                       if manifestinfo['advertisedadbreakduration'] > 0:
                         if 'actualadbreakduration' in manifestinfo.keys():
                           adbreakdurationdelta = manifestinfo['actualadbreakduration'] - manifestinfo['advertisedadbreakduration']
                           if adbreakdurationdelta > 1:
-                            logger.warning('Ad break was longer than advertised by ' + '{:.3f}'.format(adbreakdurationdelta) + ' seconds, advertised: ' + str(manifestinfo['advertisedadbreakduration']) + ', actual: ' + '{:.3f}'.format(manifestinfo['actualadbreakduration']))
+                            logger.warning('Ad break was longer than advertised by %.3f seconds, advertised: %s, actual: %.3f', adbreakdurationdelta, manifestinfo['advertisedadbreakduration'], manifestinfo['actualadbreakduration'])
                           if adbreakdurationdelta < -1:
-                            logger.warning('Ad break was shorter than advertised by ' + '{:.3f}'.format(abs(adbreakdurationdelta)) + ' seconds, advertised: ' + str(manifestinfo['advertisedadbreakduration']) + ', actual: ' + '{:.3f}'.format(manifestinfo['actualadbreakduration']))
-                          if userargs['cwmetrics'] == True:
+                            logger.warning('Ad break was shorter than advertised by %.3f seconds, advertised: %s, actual: %.3f', abs(adbreakdurationdelta), manifestinfo['advertisedadbreakduration'], manifestinfo['actualadbreakduration'])
+                          if userargs['metrics'] == True:
                             addmetricvalue(metricstopublish, 'addurationdelta', round(adbreakdurationdelta, 3))
-                      if userargs['cwmetrics'] == True:
+                      if userargs['metrics'] == True:
                         addmetricvalue(metricstopublish, 'addurationactual', round(manifestinfo['actualadbreakduration'], 3))
                       manifestinfo['adbreak'] = False
 
@@ -1881,7 +4085,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                       if 'trackingconfirmed' in manifestinfo.keys() and endpoint['tracking'] != '':
                         if manifestinfo['trackingconfirmed'] == False and userargs['trackingrequests'] == True:
                           logger.warning('Did not find expected tracking info during ad break')
-                      if userargs['cwmetrics'] == True:
+                      if userargs['metrics'] == True:
                         if 'actualadbreakduration' in manifestinfo.keys():
                           addmetricvalue(metricstopublish, 'addurationactual', round(manifestinfo['actualadbreakduration'], 3))
                   manifestinfo['adbreak'] = False
@@ -1895,13 +4099,13 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                     manifestinfo['adbreak'] = True
                     manifestinfo['actualadbreakduration'] = 0.0
                     manifestinfo['advertisedadbreakduration'] = 0.0
-                    if userargs['cwmetrics'] == True:
+                    if userargs['metrics'] == True:
                       addmetricvalue(metricstopublish, 'adbreak', 1)
                     # Look for duration
                     match = re.search(r'\d*\.?\d+', i)
                     if match:
                       manifestinfo['advertisedadbreakduration'] = float(match.group())
-                      if userargs['cwmetrics'] == True:
+                      if userargs['metrics'] == True:
                         addmetricvalue(metricstopublish, 'addurationadvertised', manifestinfo['advertisedadbreakduration'])
                   if i.startswith('#EXT-X-DATERANGE:') and 'SCTE35-OUT' in i:
                     tagsplit = i[17:].split(',') ; manifestinfo['datarangeid'] = '' ; manifestinfo['advertisedadbreakduration'] = 0.0
@@ -1919,7 +4123,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                       manifestinfo['adbreak'] = True
                       manifestinfo['actualadbreakduration'] = 0.0
                       manifestinfo['advertisedadbreakduration'] = 0.0
-                      if userargs['cwmetrics'] == True:
+                      if userargs['metrics'] == True:
                         addmetricvalue(metricstopublish, 'adbreak', 1)
                       # Look for duration
                       for pair in tagsplit:
@@ -1929,16 +4133,16 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                             manifestinfo['advertisedadbreakduration'] = float(match.group())
                             break
                       if manifestinfo['advertisedadbreakduration'] > 0:
-                        if userargs['cwmetrics'] == True:
+                        if userargs['metrics'] == True:
                           addmetricvalue(metricstopublish, 'addurationadvertised', manifestinfo['advertisedadbreakduration'])
                     else:
-                      logger.warning('No ID found in EXT-X-DATERANGE tag ' + i)
+                      logger.warning('No ID found in EXT-X-DATERANGE tag %s', i)
 
                 # Ad break start EMT
                 if userargs['emt'] == True and i.startswith('#EXT-X-DISCONTINUITY') and userargs['emtadsegmentstring'] in segmentinfo['name']:
                   if 'lastsegmentinfo' in manifestinfo.keys():
                     if userargs['emtadsegmentstring'] not in manifestinfo['lastsegmentinfo']['name']:
-                      if userargs['cwmetrics'] == True:
+                      if userargs['metrics'] == True:
                         if 'adbreak' not in manifestinfo.keys():
                           addmetricvalue(metricstopublish, 'adbreak', 1)
                         elif manifestinfo['adbreak'] == False:
@@ -1946,12 +4150,12 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                       manifestinfo['advertisedadbreakduration'] = 0.0
                       manifestinfo['actualadbreakduration'] = 0.0
                       manifestinfo['adbreak'] = True
-                      manifestinfo['adbreakstart'] = time.perf_counter()
+                      manifestinfo['adbreakstart'] = monotonicclock()
                       manifestinfo['trackingconfirmed'] = False
 
                 # Discontinuity
                 if i == '#EXT-X-DISCONTINUITY':
-                  if userargs['cwmetrics'] == True:
+                  if userargs['metrics'] == True:
                     addmetricvalue(metricstopublish, 'discontinuity', 1)
                   if userargs['emt'] == False:
                     logger.warning('Discontinuity')
@@ -1972,16 +4176,16 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                   segmentresponse, segmentresponsetime = request3(logger, {}, segmentinfo['url'], 'GET', 'segment', metricstopublish)
                 # Segment response time
                 srtime = segmentresponsetime
-                if userargs['cwmetrics'] == True:
+                if userargs['metrics'] == True:
                   addmetricvalue(metricstopublish, 'segmentresponsetime', srtime)
                 if segmentresponse:
                   # Save response
                   if userargs['segments'] == True:
                     segmentname = segmentinfo['name'].split('/')[-1]
                     segmentname = segmentname.split('?')[0]
-                    filepath = saveresponse(logger, segmentresponse.data, segmentsfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '_' + segmentname, True, False)
+                    filepath = saveresponse(logger, segmentresponse.data, segmentsfolder, utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '_' + segmentname, True, False)
                     if filepath:
-                      logger.debug('Saved file ' + str(filepath))
+                      logger.debug('Saved file %s', filepath)
 
                   # Check segment size
                   foundcontentlength = False
@@ -1990,7 +4194,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                       foundcontentlength = True
                       break
                   if foundcontentlength:
-                    if userargs['cwmetrics'] == True:
+                    if userargs['metrics'] == True:
                       addmetricvalue(metricstopublish, 'segmentsize', int(segmentresponse.headers[i]))
 
               # Share segment info for parent thread to compare between renditions
@@ -2015,15 +4219,16 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
             durationsum = durationsum + segmentinfo['duration'] ; durationsumforpdt = durationsumforpdt + segmentinfo['duration'] ; segmentcount = segmentcount + 1
             segmentinfo.clear() ; segmenttags.clear()
 
+        phasemark = addphase(phasetimes, 'parse', phasemark)
         # After parsing manifest
         if foundnewsegment:
           stale = False
-          nextstaletime = time.perf_counter() + userargs['stale']
+          nextstaletime = monotonicclock() + userargs['stale']
 
         # Check if last segment was present
         if not foundlastsegment:
           lastmanifestheaders = str(manifestinfo['lastmanifestheaders']) if 'lastmanifestheaders' in manifestinfo.keys() else '[]'
-          logger.warning('Last segment not found, previously: ' + str(manifestinfo['lastmediasequence']) + ', now: ' + str(lastsequenceofthismanifest) + ', previous manifest response headers: ' + lastmanifestheaders + ', this manifest response headers: ' + str(response.headers.items()))
+          logger.warning('Last segment not found, previously: %s, now: %s, previous manifest response headers: %s, this manifest response headers: %s', manifestinfo['lastmediasequence'], lastsequenceofthismanifest, lastmanifestheaders, response.headers.items())
 
         # Compare manifests
         if userargs['comparemanifests'] == True:
@@ -2031,106 +4236,103 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
             if 'lastmanifestcontent' in manifestinfo.keys() and 'lastmanifestlength' in manifestinfo.keys():
               if manifestinfo['lastmanifestcontent'] != responsetext[:manifestinfo['lastmanifestlength']]:
                 lastmanifestheaders = str(manifestinfo['lastmanifestheaders']) if 'lastmanifestheaders' in manifestinfo.keys() else '[]'
-                logger.warning('Manifests do not match, previous manifest response headers: ' + lastmanifestheaders + ', this manifest response headers: ' + str(response.headers.items()))
+                logger.warning('Manifests do not match, previous manifest response headers: %s, this manifest response headers: %s', lastmanifestheaders, response.headers.items())
           manifestinfo['lastmanifestlength'] = len(responsetext)
           manifestinfo['lastmanifestcontent'] = responsetext
 
         # Check PDT delta (includes the duration of last segment)
         if 'lastexplicitpdtdate' in manifestinfo.keys() and foundnewsegment:
-          manifestinfo['pdtdelta'] = (manifestinfo['lastexplicitpdtdate'] - datetime.datetime.utcnow()).total_seconds() + durationsumforpdt
-          if userargs['cwmetrics'] == True and foundnewsegment:
+          manifestinfo['pdtdelta'] = (manifestinfo['lastexplicitpdtdate'] - utcnow()).total_seconds() + durationsumforpdt
+          if userargs['metrics'] == True and foundnewsegment:
             metricstopublish['pdtdelta'] = round(manifestinfo['pdtdelta'])
 
         # Publish manifest duration
-        if userargs['cwmetrics'] == True:
+        if userargs['metrics'] == True:
           metricstopublish['manifestduration'] = round(durationsum / 60, 1)
 
+        phasemark = addphase(phasetimes, 'checks', phasemark)
         # Get tracking
         if dotracking == True:
           if userargs['trackingrequests'] == True:
             playerplayhead = manifestinfo['initialmanifestduration'] + sessioncontentduration
-            if userargs['playheadawaretracking']:
-              trackingurl = endpoint['tracking'] + '?aws.playheadPositionInSeconds=' + str(round(playerplayhead))
+            if trackingpoller != None:
+              trackingresponse = None
+              snapshot = readtrackingpoller(trackingpoller, manifestinfo.get('adbreak', False), playerplayhead, metricstopublish)
+              if snapshot != None:
+                trackingresponse = snapshot['response'] ; trackingurl = snapshot['url'] ; availindex = snapshot['availindex']
             else:
-              trackingurl = endpoint['tracking']
-            trackingresponse, trackingresponsetime = request3(logger, {'Accept-Encoding': 'gzip'}, trackingurl, 'GET', 'tracking', metricstopublish)
-            if userargs['cwmetrics'] == True:
-              metricstopublish['trackingresponsetime'] = trackingresponsetime
+              if userargs['playheadawaretracking']:
+                trackingurl = endpoint['tracking'] + '?aws.playheadPositionInSeconds=' + str(round(playerplayhead))
+              else:
+                trackingurl = endpoint['tracking']
+              trackingresponse, trackingresponsetime = request3(logger, {'Accept-Encoding': 'gzip'}, trackingurl, 'GET', 'tracking', metricstopublish)
+              if userargs['metrics'] == True:
+                metricstopublish['trackingresponsetime'] = trackingresponsetime
+              if 'session' in endpoint.keys():
+                recordsessionvalue(endpoint, 'trackingresponsetime', trackingresponsetime)
             if trackingresponse:
               if all(i in manifestinfo.keys() for i in ['adbreak', 'adbreakstart', 'trackingconfirmed']):
                 if manifestinfo['adbreak'] == True:
-                  # Parse tracking response
-                  trackingresponsetext = getresponsetext(trackingresponse, True) ; trackingresponsedict.clear()
-                  try:
-                    trackingresponsedict = json.loads(trackingresponsetext)
-                  except json.decoder.JSONDecodeError:
+                  # Parse tracking response only when it has changed and find the avail at the playhead in the avail index
+                  if trackingpoller == None:
+                    trackingparsetime = updateavailindex(availindex, trackingresponse)
+                    if trackingparsetime != None and userargs['metrics'] == True:
+                      metricstopublish['trackingparsetime'] = trackingparsetime
+                  if availindex['result'] == 'invalid':
                     logger.error('Tracking response could not be converted to json')
-                  if trackingresponsedict:
-                    if 'avails' in trackingresponsedict.keys():
-                      for avail in trackingresponsedict['avails']:
-                        if all(i in avail.keys() for i in ['availId', 'durationInSeconds', 'startTimeInSeconds']):
-                          if float(avail['startTimeInSeconds']) <= playerplayhead <= float(avail['startTimeInSeconds']) + float(avail['durationInSeconds']):
-                            availadscount = 0 ; adsinfo.clear()
-                            if 'ads' in avail.keys():
-                              availadscount = len(avail['ads'])
-                              if manifestinfo['trackingconfirmed'] == False:
-                                for index, ad in enumerate(avail['ads']):
-                                  adinfo.clear()
-                                  if 'adId' in ad.keys():
-                                    adinfo['adId'] = ad['adId']
-                                  if 'durationInSeconds' in ad.keys():
-                                    adinfo['durationInSeconds'] = ad['durationInSeconds']
-                                  if 'creativeId' in ad.keys():
-                                    adinfo['creativeId'] = ad['creativeId']
-                                  if 'adTitle' in ad.keys():
-                                    adinfo['adTitle'] = ad['adTitle']
-                                  adsinfo[str(index + 1)] = adinfo.copy()
-                              if userargs['checktrackingevents'] == True:
-                                for index, ad in enumerate(avail['ads']):
-                                  eventtypesdiscovered.clear()
-                                  if 'trackingEvents' in ad.keys():
-                                    for trackingevent in ad['trackingEvents']:
-                                      if 'eventType' in trackingevent.keys():
-                                        eventtypesdiscovered.add(trackingevent['eventType'])
-                                      else:
-                                        logger.warning('Missing eventType in trackingEvent in avail')
-                                    if len(eventtypestolookfor - eventtypesdiscovered) > 0:
-                                      logger.warning('Missing event types in avail ad: ' + str(eventtypestolookfor - eventtypesdiscovered))
-                                  else:
-                                    logger.warning('Missing trackingEvents in ad')
-                            if manifestinfo['trackingconfirmed'] == False:
-                              timesinceadbreakstart = round(time.perf_counter() - manifestinfo['adbreakstart'])
-                              playerplayheaddelta = round(playerplayhead - avail['startTimeInSeconds'])
-                              if abs(playerplayheaddelta) > userargs['frequency'] * 3 or abs(timesinceadbreakstart) > userargs['frequency'] * 3:
-                                logger.warning('Found avail in tracking response, but timing is not exact, avail id: ' + str(avail['availId']) + ', duration: ' + str(avail['durationInSeconds']) + ', ads count: ' + str(availadscount) + ', ads info: ' + str(adsinfo) + ', time since ad break start: ' + str(timesinceadbreakstart) + ' sec, playhead: ' + str(round(playerplayhead)) + ' sec, avail startTimeInSeconds: ' + str(round(avail['startTimeInSeconds'])) + ' sec, delta: ' + str(playerplayheaddelta) + ' sec, tracking url: ' + trackingurl + ', response headers: ' + str(trackingresponse.headers.items()))
-                              else:
-                                logger.info('Found avail in tracking response, avail id: ' + str(avail['availId']) + ', duration: ' + str(avail['durationInSeconds']) + ', ads count: ' + str(availadscount) + ', ads info: ' + str(adsinfo) + ', time since ad break start: ' + str(timesinceadbreakstart) + ' sec, playhead: ' + str(round(playerplayhead)) + ' sec, avail startTimeInSeconds: ' + str(round(avail['startTimeInSeconds'])) + ' sec, delta: ' + str(playerplayheaddelta) + ' sec, tracking url: ' + trackingurl)
-                              manifestinfo['trackingconfirmed'] = True
-                        else:
-                          logger.warning('Missing some important fields in avail')
-                    else:
-                      logger.warning('No avails in tracking response')
-                  else:
+                  elif availindex['result'] == 'empty':
                     logger.warning('Empty tracking response')
-              # Save tracking response
-              if userargs['tracking']:
-                filepath = ''
-                if userargs['gzip'] == True:
-                  foundcontentencodinggzip = False
-                  for i in trackingresponse.headers.keys():
-                    if 'content-encoding' == i.lower():
-                      if trackingresponse.headers[i] == 'gzip':
-                        foundcontentencodinggzip = True
-                        break
-                  if foundcontentencodinggzip:
-                    filepath = saveresponse(logger, trackingresponse.data, trackingfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '.json', False, False)
-                  else:
-                    filepath = saveresponse(logger, getresponsetext(trackingresponse, True), trackingfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '.json', False, True)
-                else:
-                  filepath = saveresponse(logger, getresponsetext(trackingresponse, True), trackingfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + '.json', False, False)
-                if filepath:
-                  logger.debug('Saved file ' + str(filepath))
-
+                  elif availindex['result'] == 'noavails':
+                    logger.warning('No avails in tracking response')
+                  elif availindex['invalidavails'] > 0:
+                    logger.warning('Missing some important fields in avail, avails: %s', availindex['invalidavails'])
+                  avail = findavail(availindex, playerplayhead)
+                  if avail != None:
+                    availadscount = 0 ; adsinfo.clear()
+                    if 'ads' in avail.keys():
+                      availadscount = len(avail['ads'])
+                      if manifestinfo['trackingconfirmed'] == False:
+                        for index, ad in enumerate(avail['ads']):
+                          adinfo.clear()
+                          if 'adId' in ad.keys():
+                            adinfo['adId'] = ad['adId']
+                          if 'durationInSeconds' in ad.keys():
+                            adinfo['durationInSeconds'] = ad['durationInSeconds']
+                          if 'creativeId' in ad.keys():
+                            adinfo['creativeId'] = ad['creativeId']
+                          if 'adTitle' in ad.keys():
+                            adinfo['adTitle'] = ad['adTitle']
+                          adsinfo[str(index + 1)] = adinfo.copy()
+                      if userargs['checktrackingevents'] == True:
+                        for index, ad in enumerate(avail['ads']):
+                          eventtypesdiscovered.clear()
+                          if 'trackingEvents' in ad.keys():
+                            for trackingevent in ad['trackingEvents']:
+                              if 'eventType' in trackingevent.keys():
+                                eventtypesdiscovered.add(trackingevent['eventType'])
+                              else:
+                                logger.warning('Missing eventType in trackingEvent in avail')
+                            if len(eventtypestolookfor - eventtypesdiscovered) > 0:
+                              logger.warning('Missing event types in avail ad: %s', eventtypestolookfor - eventtypesdiscovered)
+                          else:
+                            logger.warning('Missing trackingEvents in ad')
+                    if manifestinfo['trackingconfirmed'] == False:
+                      timesinceadbreakstart = round(monotonicclock() - manifestinfo['adbreakstart'])
+                      playerplayheaddelta = round(playerplayhead - avail['startTimeInSeconds'])
+                      if abs(playerplayheaddelta) > userargs['frequency'] * 3 or abs(timesinceadbreakstart) > userargs['frequency'] * 3:
+                        logger.warning('Found avail in tracking response, but timing is not exact, avail id: %s, duration: %s, ads count: %s, ads info: %s, time since ad break start: %s sec, playhead: %s sec, avail startTimeInSeconds: %s sec, delta: %s sec, tracking url: %s, response headers: %s', avail['availId'], avail['durationInSeconds'], availadscount, adsinfo, timesinceadbreakstart, round(playerplayhead), round(avail['startTimeInSeconds']), playerplayheaddelta, trackingurl, trackingresponse.headers.items())
+                      else:
+                        logger.info('Found avail in tracking response, avail id: %s, duration: %s, ads count: %s, ads info: %s, time since ad break start: %s sec, playhead: %s sec, avail startTimeInSeconds: %s sec, delta: %s sec, tracking url: %s', avail['availId'], avail['durationInSeconds'], availadscount, adsinfo, timesinceadbreakstart, round(playerplayhead), round(avail['startTimeInSeconds']), playerplayheaddelta, trackingurl)
+                      manifestinfo['trackingconfirmed'] = True
+                      if 'session' in endpoint.keys():
+                        recordsessionavail(endpoint, avail)
+                      if userargs['firebeacons'] == True:
+                        schedulebeacons(logger, endpoint, avail, playerplayhead)
+              # Save tracking response, the tracking poller saves its own responses
+              if userargs['tracking'] and trackingpoller == None:
+                savetrackingresponse(logger, trackingresponse, trackingfolder)
+
+        phasemark = addphase(phasetimes, 'tracking', phasemark)
         # Check for new content shortage
         lastcontentdurations.append(newcontentduration)
         if len(lastcontentdurations) == lastcontentdurations.maxlen:
@@ -2144,8 +4346,8 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
           if goahead == True and lasttwocontentdurations < 0.25 * 2 * userargs['frequency']:
             lastmanifestheaders = str(manifestinfo['lastmanifestheaders']) if 'lastmanifestheaders' in manifestinfo.keys() else '[]'
             thismanifestheaders = str(response.headers.items()) if response else '[]'
-            logger.warning('Content shortage during last 2 manifest requests. New content duration of last 10 manifest requests: ' + str(lastcontentdurations) + ', previous manifest response headers: ' + lastmanifestheaders + ', this manifest response headers: ' + thismanifestheaders)
-            if userargs['cwmetrics'] == True:
+            logger.warning('Content shortage during last 2 manifest requests. New content duration of last 10 manifest requests: %s, previous manifest response headers: %s, this manifest response headers: %s', lastcontentdurations, lastmanifestheaders, thismanifestheaders)
+            if userargs['metrics'] == True:
               metricstopublish['contentshortage'] = 1
               
         # Update last manifest headers
@@ -2157,39 +4359,50 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
 
       # Check input buffer size
       inputbuffersize = int(userargs['initialinputbuffersize'] - (mrequesttime - sessionstarttime) + sessioncontentduration)
-      if userargs['cwmetrics'] == True:
+      if userargs['metrics'] == True:
         metricstopublish['inputbuffersize'] = inputbuffersize
       if inputbuffersize < 0:
         if manifestinfo['foundnewsegment']:
           startsession = True
 
       # Check if stale
-      now = time.perf_counter()
+      now = monotonicclock()
       if now > nextstaletime:
         stale = True
       if stale:
         manifestheaders = str(response.headers.items()) if response else ''
         if manifestheaders:
-          logger.warning('Stale manifest, last manifest headers: ' + manifestheaders)
+          logger.warning('Stale manifest, last manifest headers: %s', manifestheaders)
         else:
           logger.warning('Stale manifest')
-        if userargs['cwmetrics'] == True:
+        if userargs['metrics'] == True:
           metricstopublish['stale'] = 1
 
       # Publish metrics
-      if userargs['cwmetrics'] == True:
+      phasemark = addphase(phasetimes, 'checks', phasemark)
+      if userargs['phaseprofiler'] == True and userargs['phasemetrics'] == True:
+        addphasemetrics(metricstopublish, renditionname)
+      if userargs['metrics'] == True:
         publishmetrics(logger, endpoint, renditionname, metricstopublish)
+      phasemark = addphase(phasetimes, 'publish', phasemark)
+      if userargs['phaseprofiler'] == True:
+        finishpollphases(renditionname, phasetimes)
     
+      # Keep state for warm restart
+      if userargs['checkpoint'] == True and mrequesttime >= nextcheckpointtime:
+        savecheckpointstate(endpoint, rendition, renditionname, fromprimary, manifestinfo, mrequesttime - sessionstarttime, sessioncontentduration)
+        nextcheckpointtime = mrequesttime + userargs['checkpointinterval']
+
       # Stop if stale and rendition is from primary manifest
       if stale and fromprimary:
         break
 
       # Wait between requests
-      waittime = mrequesttime - time.perf_counter() + userargs['frequency']
+      waittime = mrequesttime - monotonicclock() + userargs['frequency']
       if waittime > 0:
-        time.sleep(waittime)
+        monitorsleep(waittime)
       elif not calculatemanifestduration and waittime < -1:
-        logger.error('Negative wait time ' + '{:.3f}'.format(waittime) + ' sec between manifest requests')
+        logger.error('Negative wait time %.3f sec between manifest requests', waittime)
 
   # Smooth monitor
   elif endpoint['type'] == 'smooth':
@@ -2204,13 +4417,13 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
       'newsubtitlesegments': []
     }
 
-    logger.info('Started monitoring manifest URL ' + manifestinfo['url'])
+    logger.info('Started monitoring manifest URL %s', manifestinfo['url'])
 
     # Loop until terminated by parent thread
     while not terminatethreads and not stoprunning.is_set():
       metricstopublish.clear() ; segmentinfo.clear() ; segmenttags.clear() ; discontinuitysequence = 0 ; foundlastsegment = False ; foundnewsegment = False ; durationsum = 0.0 ; durationsumforpdt = 0.0 ; foundpdt = False ; lastsequenceofthismanifest = 0 ; samefirstsegment = False ; calculatemanifestduration = False ; manifestinfo['foundlastsegment'] = False ; manifestinfo['foundnewsegment'] = False ; manifestinfo['newvideosegments'].clear() ; manifestinfo['newaudiosegments'].clear() ; manifestinfo['newsubtitlesegments'].clear()
 
-      mrequesttime = time.perf_counter()
+      mrequesttime = monotonicclock() ; phasetimes = startphases() ; phasemark = markphase(phasetimes)
     
       # Initialize session
       if startsession:
@@ -2218,19 +4431,21 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
 
       # Request manifest
       logger.debug('Requesting manifest')
-      response, responsetime = request3(logger, {'Accept-Encoding': 'gzip'}, manifestinfo['url'], 'GET', 'manifest', {})
+      response, responsetime = takeprefetched(endpoint, manifestinfo['url']) or request3(logger, {'Accept-Encoding': 'gzip'}, manifestinfo['url'], 'GET', 'manifest', {})
+      phasemark = addphase(phasetimes, 'fetch', phasemark)
       
       if response:
         responsetext = getresponsetext(response, False)
+        phasemark = addphase(phasetimes, 'decompress', phasemark)
         
         # Manifest response time
         manifestinfo['latency'] = responsetime
-        if userargs['cwmetrics'] == True:
+        if userargs['metrics'] == True:
           metricstopublish['manifestresponsetime'] = manifestinfo['latency']
           
         # Manifest size https://docs.python.org/3/library/email.compat32-message.html#email.message.Message
         manifestinfo['size'] = len(responsetext)
-        if userargs['cwmetrics'] == True:
+        if userargs['metrics'] == True:
           metricstopublish['manifestsize'] = manifestinfo['size']
           
         # Save response
@@ -2244,13 +4459,13 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                   foundcontentencodinggzip = True
                   break
             if foundcontentencodinggzip:
-              filepath = saveresponse(logger, response.data, manifestsfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, False)
+              filepath = saveresponse(logger, response.data, manifestsfolder, utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, False)
             else:
-              filepath = saveresponse(logger, responsetext.decode('utf-8'), manifestsfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, True)
+              filepath = saveresponse(logger, responsetext.decode('utf-8'), manifestsfolder, utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, True)
           else:
-            filepath = saveresponse(logger, responsetext.decode('utf-8'), manifestsfolder, datetime.datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, False)
+            filepath = saveresponse(logger, responsetext.decode('utf-8'), manifestsfolder, utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f') + fileextension, False, False)
           if filepath:
-            logger.debug('Saved file ' + str(filepath))
+            logger.debug('Saved file %s', filepath)
         
         # Parse XML 
         xmlroot = ET.fromstring(responsetext)
@@ -2303,7 +4518,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                     # Found new segment
                     if segmentinfo['t'] > manifestinfo['lastsegmentinfo']['t']:
                       sessioncontentduration = sessioncontentduration + segmentinfo['dsec']
-                      logger.debug('Found new segment, segment info: ' + str(segmentinfo))
+                      logger.debug('Found new segment, segment info: %s', segmentinfo)
                       foundnewsegment = True ; manifestinfo['foundnewsegment'] = True
                       # Check discontinuity
                       if foundlastsegment and 'lastvideosegmentinfo' in manifestinfo.keys():
@@ -2311,7 +4526,7 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                           logger.warning('Discontinuity')
                       # Check duration
                       if segmentinfo['dsec'] != 2:
-                        logger.warning('Unexpected segment duration ' + '{:.3f}'.format(segmentinfo['dsec']) + ' sec')
+                        logger.warning('Unexpected segment duration %.3f sec', segmentinfo['dsec'])
                       # Save last video segment for discontinuity check
                     manifestinfo['lastvideosegmentinfo'] = segmentinfo.copy()
                   # Audio
@@ -2321,24 +4536,25 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
                   elif xmlstreamindextype == 'text':
                     manifestinfo['lastsubtitlesegmentinfo'] = segmentinfo.copy()
 
+            phasemark = addphase(phasetimes, 'parse', phasemark)
             # Compare PTS
             if all(i in manifestinfo.keys() for i in ['lastvideosegmentinfo', 'lastaudiosegmentinfo', 'lastsubtitlesegmentinfo']):
               ptsdelta = abs(manifestinfo['lastvideosegmentinfo']['tsec'] - manifestinfo['lastaudiosegmentinfo']['tsec'])
               if ptsdelta > 0.05:
-                logger.warning('Possible lip sync issue. AV PTS delta: ' + '{:.3f}'.format(ptsdelta))
+                logger.warning('Possible lip sync issue. AV PTS delta: %.3f', ptsdelta)
               ptsdelta = abs(manifestinfo['lastvideosegmentinfo']['tsec'] - manifestinfo['lastsubtitlesegmentinfo']['tsec'])
               if ptsdelta > 0.5:
-                logger.warning('Subtitles out of sync. PTS delta: ' + '{:.3f}'.format(ptsdelta))
+                logger.warning('Subtitles out of sync. PTS delta: %.3f', ptsdelta)
 
             # Update stale time
             if foundnewsegment:
               stale = False
-              nextstaletime = time.perf_counter() + userargs['stale']
+              nextstaletime = monotonicclock() + userargs['stale']
 
             # Check if found last segment
             if not foundlastsegment:
               lastmanifestheaders = str(manifestinfo['lastmanifestheaders']) if 'lastmanifestheaders' in manifestinfo.keys() else '[]'
-              logger.warning('Last segment ' + str(manifestinfo['lastsegmentinfo']) + ' not found, previous manifest response headers: ' + lastmanifestheaders + ', this manifest response headers: ' + str(response.headers.items()))
+              logger.warning('Last segment %s not found, previous manifest response headers: %s, this manifest response headers: %s', manifestinfo['lastsegmentinfo'], lastmanifestheaders, response.headers.items())
 
             # Update last segment info
             manifestinfo['lastsegmentinfo'] = manifestinfo['lastvideosegmentinfo'].copy()
@@ -2352,35 +4568,117 @@ def monitor(tlogger, endpoint:dict, rendition:dict, renditionname:str, proberesp
 
       # Check input buffer size
       inputbuffersize = int(userargs['initialinputbuffersize'] - (mrequesttime - sessionstarttime) + sessioncontentduration)
-      if userargs['cwmetrics'] == True:
+      if userargs['metrics'] == True:
         metricstopublish['inputbuffersize'] = inputbuffersize
       if inputbuffersize < 0:
         if manifestinfo['foundnewsegment']:
           startsession = True
 
       # Check if stale
-      now = time.perf_counter()
+      now = monotonicclock()
       if now > nextstaletime:
         stale = True
       if stale:
         logger.warning('Stale manifest')
-        if userargs['cwmetrics'] == True:
+        if userargs['metrics'] == True:
           metricstopublish['stale'] = 1
 
       # Publish metrics
-      # if userargs['cwmetrics'] == True:
+      phasemark = addphase(phasetimes, 'checks', phasemark)
+      if userargs['phaseprofiler'] == True and userargs['phasemetrics'] == True:
+        addphasemetrics(metricstopublish, renditionname)
+      # if userargs['metrics'] == True:
       #   publishmetrics(logger, endpoint, renditionname, metricstopublish)
+      phasemark = addphase(phasetimes, 'publish', phasemark)
+      if userargs['phaseprofiler'] == True:
+        finishpollphases(renditionname, phasetimes)
     
       # Stop if stale and rendition is from primary manifest
       if stale and fromprimary:
         break
 
       # Wait between requests
-      waittime = mrequesttime - time.perf_counter() + userargs['frequency']
+      waittime = mrequesttime - monotonicclock() + userargs['frequency']
       if waittime > 0:
-        time.sleep(waittime)
+        monitorsleep(waittime)
       elif not calculatemanifestduration and waittime < -1:
-        logger.error('Negative wait time ' + '{:.3f}'.format(waittime) + ' sec between manifest requests')
+        logger.error('Negative wait time %.3f sec between manifest requests', waittime)
+
+# Add check name to warnings and errors of monitoring threads, uses the unformatted message, summaries of repeated warnings keep the check of the warning
+class logcheckfilter(logging.Filter):
+  def filter(self, record):
+    if getattr(record, 'check', None) == None:
+      record.check = logcheck.getlogcheck(str(record.msg)) if record.levelno >= logging.WARNING else None
+    return True
+
+
+# Log the first warning of a rendition and check in --warningwindow seconds, the others only as a summary
+# Windows run on the monitor clock, i.e. on the replay clock of the replaying thread with --replay
+class warningratefilter(logging.Filter):
+  def filter(self, record):
+    if userargs['warningwindow'] <= 0 or record.levelno != logging.WARNING or getattr(record, 'warningsummary', False) or not hasattr(record, 'renditionname'):
+      return True
+    key = (record.renditionname, record.check if getattr(record, 'check', None) else str(record.msg)[0:40])
+    now = monotonicclock()
+    with warningwindowslock:
+      window = warningwindows.get(key)
+      if window and now - window['start'] < userargs['warningwindow']:
+        window['count'] = window['count'] + 1
+        window['last'] = record ; window['lasttime'] = now
+        return False
+      warningwindows[key] = {'start': now, 'count': 0, 'last': None, 'lasttime': now}
+    if window and window['count'] > 0:
+      logwarningsummary(window, now)
+    return True
+
+
+# Log summary of warnings suppressed in a window, the summary passes the rate filter
+def logwarningsummary(window:dict, now:float):
+  last = window['last']
+  record = logging.getLogger(last.name).makeRecord(last.name, logging.WARNING, last.pathname, last.lineno, 'Repeated %s times in %s seconds: %s', (window['count'], int(now - window['start']), last.getMessage()), None,
+    extra = {'renditionname': last.renditionname, 'endpointtype': last.endpointtype, 'check': getattr(last, 'check', None), 'warningsummary': True})
+  logging.getLogger(last.name).handle(record)
+
+
+# Log summaries of finished warning windows, called periodically from main thread, and of all windows at exit
+# Replay clocks are not known to the main thread, windows of replayed renditions end with the next warning or at exit
+def flushwarningwindows(flushall:bool = False):
+  if userargs['replay'] and not flushall:
+    return
+  now = None if userargs['replay'] else monotonicclock()
+  finished = []
+  with warningwindowslock:
+    for key in list(warningwindows.keys()):
+      if flushall or now - warningwindows[key]['start'] >= userargs['warningwindow']:
+        finished.append(warningwindows.pop(key))
+  for window in finished:
+    if window['count'] > 0:
+      logwarningsummary(window, now if now != None else window['lasttime'])
+
+
+# JSON lines log formatter with rendition, type and check fields
+class jsonlogformatter(logging.Formatter):
+  def format(self, record):
+    line = {'time': datetime.datetime.utcfromtimestamp(record.created).isoformat(timespec = 'milliseconds') + 'Z', 'level': record.levelname}
+    for field, attribute in (('rendition', 'renditionname'), ('type', 'endpointtype'), ('label', 'label'), ('check', 'check')):
+      if getattr(record, attribute, None) != None:
+        line[field] = getattr(record, attribute)
+    line['message'] = record.getMessage()
+    if record.exc_info:
+      line['exception'] = self.formatException(record.exc_info)
+    return json.dumps(line)
+
+
+# Move handlers of logger to a listener thread, logging threads only put records into a queue
+def configureasynclogging(logger):
+  loggingqueue = queue.SimpleQueue()
+  listener = logging.handlers.QueueListener(loggingqueue, *logger.handlers, respect_handler_level = True)
+  logger.handlers = [logging.handlers.QueueHandler(loggingqueue)]
+  listener.start()
+  # Stopped after all other threads finished to write their last records
+  atexit.register(listener.stop)
+  return listener
+
 
 def configurelogging(logsfolder:str):
   loggingconfig = {
@@ -2394,6 +4692,17 @@ def configurelogging(logsfolder:str):
       'threadformatter': {
         'format': '%(asctime)s.%(msecs)03d %(levelname).1s %(renditionname)s %(endpointtype)s %(message)s',
         'datefmt': '%Y-%m-%d %H:%M:%S'
+      },
+      'jsonformatter': {
+        '()': jsonlogformatter
+      }
+    },
+    'filters': {
+      'logcheckfilter': {
+        '()': logcheckfilter
+      },
+      'warningratefilter': {
+        '()': warningratefilter
       }
     },
     'handlers': {
@@ -2406,14 +4715,14 @@ def configurelogging(logsfolder:str):
       'filehandlermain': {
         'level': userargs['loglevel'],
         'class': 'logging.FileHandler',
-        'formatter': 'standardformatter',
+        'formatter': 'jsonformatter' if userargs['logformat'] == 'json' else 'standardformatter',
         'filename': logsfolder + '/main.log',
         'mode': 'a'
       },
       'filehandlerthread': {
         'level': userargs['loglevel'],
         'class': 'logging.FileHandler',
-        'formatter': 'threadformatter',
+        'formatter': 'jsonformatter' if userargs['logformat'] == 'json' else 'threadformatter',
         'filename': logsfolder + '/monitor.log',
         'mode': 'a'
       },
@@ -2433,11 +4742,13 @@ def configurelogging(logsfolder:str):
       'thread': {
         'level': userargs['loglevel'],
         'propagate': True,
+        'filters': ['logcheckfilter', 'warningratefilter'],
         'handlers': ['filehandlerthread']
       },
       'threadstdout': {
         'level': userargs['loglevel'],
         'propagate': True,
+        'filters': ['logcheckfilter', 'warningratefilter'],
         'handlers': ['filehandlerthread', 'consolehandlerthread']
       },
       'mainstdout': {
@@ -2455,7 +4766,7 @@ def loadendpointsfromfile(logger):
 
   endpointslistfilepath = Path(userargs['endpointslistfile'])
   if not endpointslistfilepath.is_file():
-    logger.error('No such file: ' + userargs['endpointslistfile'])
+    logger.error('No such file: %s', userargs['endpointslistfile'])
     return endpointslist
 
   with open(userargs['endpointslistfile']) as f:
@@ -2469,7 +4780,7 @@ def loadendpointsfromfile(logger):
         if len(splitline) > 2:
           trackingurl = splitline[2].strip()
         if len(endpointname) == 0 or len(endpointurl) == 0:
-          logger.error('Invalid line in ' + str(endpointslistfilepath) + ': ' + line.strip())
+          logger.error('Invalid line in %s: %s', endpointslistfilepath, line.strip())
           continue
         # Find type
         parsedurl = urlparse(endpointurl)
@@ -2481,10 +4792,10 @@ def loadendpointsfromfile(logger):
           elif parsedurl.path.split('/')[-1] == 'Manifest' or '.ism' in parsedurl.path.split('/')[-2] or userargs['endpointtype'] == 'smooth':
             endpointtype = 'smooth'
           else:
-            logger.error('Unable to detect stream type for url on line: ' + line)
+            logger.error('Unable to detect stream type for url on line: %s', line)
             continue
         else:
-          logger.error('Invalid manifest URL on line: ' + line)
+          logger.error('Invalid manifest URL on line: %s', line)
           continue
       else:
         continue
@@ -2511,8 +4822,45 @@ def loadendpointfromurl(logger):
 
   return [{'type': endpointtype, 'name': 'testendpoint', 'url': userargs['url'], 'tracking': ''}]
 
+# Load archived renditions to replay, the replay folder is a rendition folder or a folder of rendition folders
+def loadendpointsfromreplay(logger):
+  endpointslist = []
+
+  replayfolder = Path(userargs['replay'])
+  if not replayfolder.is_dir():
+    logger.error('No such folder: %s', userargs['replay'])
+    return endpointslist
+
+  if findreplayfiles(replayfolder):
+    folders = [replayfolder]
+  else:
+    folders = sorted(i for i in replayfolder.iterdir() if i.is_dir())
+  for folder in folders:
+    files = findreplayfiles(folder)
+    if not files:
+      continue
+    # Find type from the first archived manifest
+    filename = files[0].name
+    if filename.endswith('.pack'):
+      record = next(packarchive.iterpackrecords(files[0]), None)
+      filename = record['filename'] if record else ''
+    filename = filename[:-3] if filename.endswith('.gz') else filename
+    if filename.endswith('.m3u8'):
+      endpointtype = 'hls' ; manifestname = 'index.m3u8'
+    elif filename.endswith('.mpd'):
+      endpointtype = 'dash' ; manifestname = 'index.mpd'
+    elif filename.endswith('.Manifest'):
+      endpointtype = 'smooth' ; manifestname = 'Manifest'
+    else:
+      logger.error('Unable to detect stream type of archived manifests in %s', folder)
+      continue
+    # Relative URLs of segments are resolved against the folder
+    endpointslist.append({'type': endpointtype, 'name': folder.resolve().name, 'url': folder.resolve().as_uri() + '/' + manifestname, 'tracking': '', 'replay': folder})
+
+  return endpointslist
+
 def signalhandler(signalnumber, frame):
-  logger.info('Received signal ' + str(signalnumber) + ', stopping now')
+  logger.info('Received signal %s, stopping now', signalnumber)
   raise KeyboardInterrupt('')
 
 if __name__ == '__main__':
@@ -2523,7 +4871,43 @@ if __name__ == '__main__':
   terminatethreads = False
   renditionnames = {'hls': [], 'dash': [], 'smooth': []}
   lockm = threading.Lock()
-  dashboardcreated = False
+  dashboardshards = {}
+  changeddashboards = set()
+  dashboardevent = threading.Event()
+  prometheusregistry = {}
+  prometheusmainmetrics = {}
+  pollphase = threading.local()
+  phasestats = {}
+  createdfolders = set()
+  packwriters = {}
+  packwriterslock = threading.Lock()
+  archivequeues = []
+  archivestats = {'written': 0, 'dropped': 0, 'writetime': createhistogram(), 'rawbytes': 0, 'compressedbytes': 0, 'compresstime': createhistogram()}
+  archivestatslock = threading.Lock()
+  archivebatch = threading.local()
+  segmentstore = {'blobs': {}, 'totalsize': 0, 'storedbytes': 0, 'referencedbytes': 0}
+  segmentstorelock = threading.Lock()
+  flightrecorder = {}
+  flightrecorderorder = deque()
+  flightrecordercaptures = {}
+  flightrecorderstats = {'memory': 0, 'flushes': 0}
+  flightrecorderlock = threading.Lock()
+  warningwindows = {}
+  warningwindowslock = threading.Lock()
+  replayclock = threading.local()
+  replaystats = {'manifests': 0, 'bytes': 0}
+  replaystatslock = threading.Lock()
+  sessionstats = {}
+  sessionstatslock = threading.Lock()
+  checkpointstates = {}
+  resumestates = {}
+  checkpointlock = threading.Lock()
+  startupstats = {'start': time.perf_counter(), 'pending': set(), 'endpoints': 0, 'timetoallmonitored': None}
+  startupstatslock = threading.Lock()
+  beaconloop = None
+  beaconpool = None
+  beaconstats = {}
+  beaconstatslock = threading.Lock()
   segmentationtypeidmap = {
     '00': 'Not Indicated',
     '01': 'Content Identification',
@@ -2569,9 +4953,19 @@ if __name__ == '__main__':
   parser.add_argument('--tracking', action = 'store_true', help = 'download tracking response (default: False)')
   parser.add_argument('--playheadawaretracking', action = 'store_true', help = 'send tracking requests with playhead query string (default: False)')
   parser.add_argument('--checktrackingevents', action = 'store_true', help = 'check if each ad in a new avail contains all expected tracking event types (default: False)')
+  parser.add_argument('--trackingpoller', action = 'store_true', help = 'request tracking in a separate thread per session with conditional requests instead of after each manifest request, requires --trackingrequests (default: False)')
+  parser.add_argument('--trackingfastinterval', type = float, help = 'time between tracking requests of --trackingpoller during ad breaks [seconds], e.g. 1 (default: 2)')
+  parser.add_argument('--trackingslowinterval', type = float, help = 'time between tracking requests of --trackingpoller outside of ad breaks [seconds], e.g. 60 (default: 30)')
+  parser.add_argument('--firebeacons', action = 'store_true', help = 'fire beacons of ads in avails of tracking responses at the times of their tracking events and measure beacon latency, requires --trackingrequests (default: False)')
+  parser.add_argument('--beaconconnections', type = int, help = 'maximum number of beacon connections per origin, e.g. 500 (default: 100)')
   parser.add_argument('--trackingrequests', action = 'store_true', help = 'send tracking requests (default: False)')
   parser.add_argument('--segmentrequests', action = 'store_true', help = 'send HTTP HEAD requests for new segments (default: False)')
   parser.add_argument('--cwmetrics', action = 'store_true', help = 'publish metrics to AWS CloudWatch under \'CanaryMonitor\' namespace (default: False)')
+  parser.add_argument('--emf', action = 'store_true', help = 'write metrics in CloudWatch Embedded Metric Format to \'logs/metrics.emf\' file for the CloudWatch agent instead of or in addition to --cwmetrics (default: False)')
+  parser.add_argument('--emffile', type = str, help = 'file location for CloudWatch Embedded Metric Format metrics, e.g. /tmp/metrics.emf (default: metrics.emf in logs folder)')
+  parser.add_argument('--emfinterval', type = float, help = 'time between writes of collected metrics to CloudWatch Embedded Metric Format file [seconds], e.g. 60 (default: 10)')
+  parser.add_argument('--prometheus', action = 'store_true', help = 'serve collected metrics in Prometheus text format on /metrics (default: False)')
+  parser.add_argument('--prometheusport', type = int, help = 'port of the Prometheus /metrics HTTP endpoint, e.g. 9200 (default: 9110)')
   parser.add_argument('--cwregion', type = str, help = 'CloudWatch region name for sending metrics, e.g. us-east-1 (default: \'us-west-2\')')
   parser.add_argument('--dashboards', action = 'store_true', help = 'crate AWS Cloudwatch and Wiki dashboards for monitored endpoints in \'dashboards\' folder (default: False)')
   parser.add_argument('--property', type = str, help = 'property name as root folder for logs and manifests, e.g. tnf (default: \'\')')
@@ -2581,17 +4975,66 @@ if __name__ == '__main__':
   parser.add_argument('--manifestsfolder', type = str, help = 'manifests download folder, e.g. /tmp/manifests (default: local folder)')
   parser.add_argument('--segmentsfolder', type = str, help = 'segments download folder, e.g. /tmp/segments (default: local folder)')
   parser.add_argument('--templatesfolder', type = str, help = 'folder for AWS Cloudwatch dashboard templates, e.g. /tmp/templates (default: templates)')
+  parser.add_argument('--dashboardrenditions', type = int, help = 'maximum number of renditions in a dashboard, more renditions are split into several dashboards per endpoint type, e.g. 50 (default: as many as CloudWatch metric limits allow)')
   parser.add_argument('--dashboardsfolder', type = str, help = 'folder for storing created AWS Cloudwatch dashboard json file, e.g. /tmp/dashboards (default: local folder)')
   parser.add_argument('--trackingfolder', type = str, help = 'folder for storing tracking response files, e.g. /tmp/tracking (default: local folder)')
   parser.add_argument('--loglevel', type = str, help = 'logging detail level, i.e. DEBUG or INFO or WARNING (default: INFO)')
   parser.add_argument('--gzip', action = 'store_true', help = 'compress manifests and tracking when saving (default: False)')
+  parser.add_argument('--archiveformat', type = str, help = 'format of saved manifests and tracking responses, i.e. files (a file per response), pack (hourly pack file per rendition, see packarchive.py) or delta (pack file with deltas to previous responses) (default: files)')
+  parser.add_argument('--keyframeinterval', type = int, help = 'number of responses between full responses in pack files with --archiveformat delta, e.g. 120 (default: 60)')
+  parser.add_argument('--zstd', action = 'store_true', help = 'compress saved manifests and tracking responses in pack files with zstd using dictionaries trained per rendition, requires zstandard package (default: False)')
+  parser.add_argument('--zstdsamples', type = int, help = 'number of responses to train zstd dictionary from, e.g. 200 (default: 100)')
+  parser.add_argument('--zstdrotate', type = int, help = 'number of responses after which zstd dictionary is trained again from the latest responses, e.g. 5000 (default: 1000)')
+  parser.add_argument('--segmentstore', action = 'store_true', help = 'save each unique segment only once in the blobs folder of segments folder with references per rendition (default: False)')
+  parser.add_argument('--segmentstoresize', type = int, help = 'maximum size of segment store in MB, least recently referenced segments are removed, e.g. 10000 (default: 0, unlimited)')
+  parser.add_argument('--segmentstoreage', type = float, help = 'maximum age of segments in segment store since last reference in hours, e.g. 48 (default: 0, unlimited)')
+  parser.add_argument('--flightrecorder', action = 'store_true', help = 'keep the latest responses of every rendition in memory and save them only after a warning (default: False)')
+  parser.add_argument('--flightrecordersize', type = int, help = 'number of latest responses kept per rendition by flight recorder, e.g. 50 (default: 20)')
+  parser.add_argument('--flightrecordermemory', type = int, help = 'maximum memory used by flight recorder in MB, e.g. 1024 (default: 256)')
+  parser.add_argument('--flightrecorderafter', type = int, help = 'number of responses saved after a warning by flight recorder, e.g. 20 (default: 10)')
+  parser.add_argument('--flightrecordertriggers', type = str, help = 'comma separated beginnings of warnings saving flight recorder responses (default: Last segment not found,Stale manifest,Discontinuity,Did not find expected tracking info)')
+  parser.add_argument('--flightrecorderfolder', type = str, help = 'folder for flight recorder responses, e.g. /tmp/flightrecorder (default: local folder)')
+  parser.add_argument('--logformat', type = str, help = 'format of log files, i.e. text or json (JSON lines with rendition, type and check fields) (default: text)')
+  parser.add_argument('--asynclogging', action = 'store_true', help = 'write logs on a separate thread so monitoring threads do not wait for disk writes (default: False)')
+  parser.add_argument('--warningwindow', type = float, help = 'log the same kind of warning of a rendition only once in this number of seconds followed by a summary of repeats, e.g. 60 (default: 0, log every warning)')
+  parser.add_argument('--replay', type = str, help = 'replay manifests saved by --manifests from a rendition folder or a folder of rendition folders as fast as possible instead of requesting endpoints, e.g. manifests (default: None)')
+  parser.add_argument('--benchmark', action = 'store_true', help = 'run micro-benchmarks of manifest parsing and checks on generated manifests, compare them with --benchmarkbaseline and stop, exit status is 1 on regressions (default: False)')
+  parser.add_argument('--benchmarkbaseline', type = str, help = 'file with benchmark baseline results, saved by the first run when it does not exist, e.g. /tmp/benchmark.json (default: benchmark.json)')
+  parser.add_argument('--benchmarksave', action = 'store_true', help = 'save benchmark results as new baseline also when a baseline exists (default: False)')
+  parser.add_argument('--benchmarkthreshold', type = float, help = 'slowdown or memory growth against baseline reported as regression [percent], e.g. 10 (default: 20)')
+  parser.add_argument('--benchmarktime', type = float, help = 'measuring time per benchmark [seconds], e.g. 5 (default: 1)')
+  parser.add_argument('--checkpoint', action = 'store_true', help = 'keep monitor state of renditions in a checkpoint file and resume monitoring from it after restart without probing renditions, not supported with --allrenditions and --playerrenditions (default: False)')
+  parser.add_argument('--checkpointfile', type = str, help = 'checkpoint file, e.g. /tmp/checkpoint.json (default: checkpoint.json in logs folder)')
+  parser.add_argument('--checkpointinterval', type = int, help = 'time between checkpoints [seconds], e.g. 10 (default: 30)')
+  parser.add_argument('--checkpointttl', type = int, help = 'maximum age of rendition state in checkpoint for resuming monitoring [seconds], e.g. 60 (default: 300)')
+  parser.add_argument('--bootstrap', action = 'store_true', help = 'fetch and probe manifests of all endpoints concurrently at start and start monitoring threads as soon as their manifests are fetched (default: False)')
+  parser.add_argument('--bootstrapconnections', type = int, help = 'maximum concurrent bootstrap requests per origin, e.g. 50 (default: 20)')
+  parser.add_argument('--archivewriters', type = int, help = 'number of background threads writing saved manifests, segments and tracking responses, 0 writes them on the monitoring threads, e.g. 4 (default: 2)')
+  parser.add_argument('--archivequeuesize', type = int, help = 'maximum number of files waiting for archive writers, e.g. 10000 (default: 2000)')
+  parser.add_argument('--archivebatchsize', type = int, help = 'maximum number of files written by an archive writer in one batch, e.g. 200 (default: 100)')
+  parser.add_argument('--archivefsync', type = str, help = 'fsync policy for saved files, i.e. none, file (after every file) or batch (after every archive writer batch) (default: none)')
+  parser.add_argument('--archivedrop', action = 'store_true', help = 'drop files when archive writers queue is full instead of waiting for a free slot (default: False)')
   parser.add_argument('--endpointtype', type = str, help = 'force endpoint type, i.e. hls, dash or smooth (no default)')
   parser.add_argument('--stdout', action = 'store_true', help = 'print monitoring logs to standard output, (default: False)')
   parser.add_argument('--httptimeout', type = float, help = 'HTTP timeout for all HTTP requests [seconds], e.g. 5 (default: 3)')
   parser.add_argument('--comparemanifests', action = 'store_true', help = 'compare if current manifest content is the same as previous manifest content up to the last overlapping segment (default: False)')
-  parser.add_argument('--loadtest', action = 'store_true', help = 'send requests without performing manifest parsing and validations (default: False)')
+  parser.add_argument('--loadtest', action = 'store_true', help = 'run an open-loop load test with virtual players requesting manifests every --frequency seconds and their newest segments, without manifest validations (default: False)')
+  parser.add_argument('--loadrps', type = float, help = 'target requests per second of all endpoints for --loadtest, e.g. 5000 (default: 10 per endpoint)')
+  parser.add_argument('--loadendpointrps', type = float, help = 'target requests per second of each endpoint for --loadtest, limited by --loadrps, e.g. 50 (default: 10)')
+  parser.add_argument('--loadsegments', type = int, help = 'number of newest segments requested by virtual players after each manifest request, 0 for manifests only, e.g. 2 (default: 1)')
+  parser.add_argument('--loadduration', type = float, help = 'duration of --loadtest [seconds], e.g. 600 (default: until stopped)')
+  parser.add_argument('--loadconnections', type = int, help = 'maximum number of connections per origin for --loadtest, e.g. 5000 (default: 1000)')
+  parser.add_argument('--phaseprofiler', action = 'store_true', help = 'measure time of each phase of a manifest request cycle (fetch, decompress, parse, checks, segments, tracking, archive, publish) and thread CPU time and log rolling percentiles with the threads status (default: False)')
+  parser.add_argument('--phasemetrics', action = 'store_true', help = 'publish phase times measured by --phaseprofiler as metrics, e.g. phaseparse [milliseconds] (default: False)')
+  parser.add_argument('--phasewindow', type = int, help = 'number of most recent manifest request cycles per rendition used for --phaseprofiler percentiles, e.g. 100 (default: 60)')
+  parser.add_argument('--profile', action = 'store_true', help = 'sample stacks of all threads and periodically write them in collapsed stack format per thread group (hls, dash, smooth, main) into \'profile_<group>.folded\' files in logs folder (default: False)')
+  parser.add_argument('--profilerate', type = float, help = 'stack samples per second for --profile, e.g. 50 (default: 10)')
+  parser.add_argument('--profileinterval', type = float, help = 'time between writes of --profile files [seconds], e.g. 300 (default: 60)')
+  parser.add_argument('--profileoverhead', type = float, help = 'maximum share of one CPU used for --profile sampling [percent], sampling rate is lowered when exceeded, e.g. 2 (default: 1)')
   parser.add_argument('--emt', action = 'store_true', help = 'use when monitoring EMT (Elemental MediaTailor) endpoints (default: False)')
   parser.add_argument('--emtadsegmentstring', type = str, help = 'string by which the ad segments in an EMT (Elemental MediaTailor) endpoint can be identified (default: asset)')
+  parser.add_argument('--emtsessions', type = int, help = 'number of MediaTailor sessions initialized with session initialization POST requests and monitored per endpoint, endpoint URLs are playback or session initialization URLs, e.g. 100 (default: 0)')
+  parser.add_argument('--emtsessionparams', type = str, help = 'JSON object of ads parameters for session initialization, {session} is replaced by the session number, e.g. \'{"userId": "user{session}"}\' (default: {})')
 
   args = parser.parse_args()
 
@@ -2605,6 +5048,11 @@ if __name__ == '__main__':
     'label': args.label if args.label else 'test',
     'dayfolder': args.dayfolder if args.dayfolder else False,
     'cwmetrics': args.cwmetrics if args.cwmetrics else False,
+    'emf': args.emf if args.emf else False,
+    'emffile': args.emffile if args.emffile else '',
+    'emfinterval': args.emfinterval if args.emfinterval else 10,
+    'prometheus': args.prometheus if args.prometheus else False,
+    'prometheusport': args.prometheusport if args.prometheusport else 9110,
     'cwregion': args.cwregion if args.cwregion else 'us-west-2',
     'dashboards': args.dashboards if args.dashboards else False,
     'gzip': args.gzip if args.gzip else False,
@@ -2613,16 +5061,56 @@ if __name__ == '__main__':
     'tracking': args.tracking if args.tracking else False,
     'playheadawaretracking': args.playheadawaretracking if args.playheadawaretracking else False,
     'checktrackingevents': args.checktrackingevents if args.checktrackingevents else False,
+    'trackingpoller': args.trackingpoller if args.trackingpoller else False,
+    'trackingfastinterval': args.trackingfastinterval if args.trackingfastinterval else 2,
+    'trackingslowinterval': args.trackingslowinterval if args.trackingslowinterval else 30,
+    'firebeacons': args.firebeacons if args.firebeacons else False,
+    'beaconconnections': args.beaconconnections if args.beaconconnections else 100,
     'trackingrequests': args.trackingrequests if args.trackingrequests else False,
     'logsfolder': args.logsfolder if args.logsfolder else '',
     'manifestsfolder': args.manifestsfolder if args.manifestsfolder else '',
     'segmentsfolder': args.segmentsfolder if args.segmentsfolder else '',
+    'dashboardrenditions': args.dashboardrenditions if args.dashboardrenditions else 0,
     'dashboardsfolder': args.dashboardsfolder if args.dashboardsfolder else '',
     'templatesfolder': args.templatesfolder if args.templatesfolder else str(Path(os.path.dirname(os.path.realpath(__file__)), 'templates')),
     'trackingfolder': args.trackingfolder if args.trackingfolder else '',
     'allrenditions': args.allrenditions if args.allrenditions else False,
     'playerrenditions': args.playerrenditions if args.playerrenditions else False,
     'renditiontype': args.renditiontype if args.renditiontype else 'v1',
+    'archiveformat': args.archiveformat if args.archiveformat else 'files',
+    'keyframeinterval': args.keyframeinterval if args.keyframeinterval else 60,
+    'zstd': args.zstd if args.zstd else False,
+    'zstdsamples': args.zstdsamples if args.zstdsamples else 100,
+    'zstdrotate': args.zstdrotate if args.zstdrotate else 1000,
+    'segmentstore': args.segmentstore if args.segmentstore else False,
+    'segmentstoresize': args.segmentstoresize if args.segmentstoresize else 0,
+    'segmentstoreage': args.segmentstoreage if args.segmentstoreage else 0,
+    'flightrecorder': args.flightrecorder if args.flightrecorder else False,
+    'flightrecordersize': args.flightrecordersize if args.flightrecordersize else 20,
+    'flightrecordermemory': args.flightrecordermemory if args.flightrecordermemory else 256,
+    'flightrecorderafter': args.flightrecorderafter if args.flightrecorderafter != None else 10,
+    'flightrecordertriggers': args.flightrecordertriggers.split(',') if args.flightrecordertriggers else ['Last segment not found', 'Stale manifest', 'Discontinuity', 'Did not find expected tracking info'],
+    'flightrecorderfolder': args.flightrecorderfolder if args.flightrecorderfolder else '',
+    'logformat': args.logformat if args.logformat else 'text',
+    'asynclogging': args.asynclogging if args.asynclogging else False,
+    'warningwindow': args.warningwindow if args.warningwindow else 0,
+    'replay': args.replay if args.replay else '',
+    'benchmark': args.benchmark if args.benchmark else False,
+    'benchmarkbaseline': args.benchmarkbaseline if args.benchmarkbaseline else 'benchmark.json',
+    'benchmarksave': args.benchmarksave if args.benchmarksave else False,
+    'benchmarkthreshold': args.benchmarkthreshold if args.benchmarkthreshold else 20,
+    'benchmarktime': args.benchmarktime if args.benchmarktime else 1,
+    'checkpoint': args.checkpoint if args.checkpoint else False,
+    'checkpointfile': args.checkpointfile if args.checkpointfile else '',
+    'checkpointinterval': args.checkpointinterval if args.checkpointinterval else 30,
+    'checkpointttl': args.checkpointttl if args.checkpointttl else 300,
+    'bootstrap': args.bootstrap if args.bootstrap else False,
+    'bootstrapconnections': args.bootstrapconnections if args.bootstrapconnections else 20,
+    'archivewriters': args.archivewriters if args.archivewriters != None else 2,
+    'archivequeuesize': args.archivequeuesize if args.archivequeuesize else 2000,
+    'archivebatchsize': args.archivebatchsize if args.archivebatchsize else 100,
+    'archivefsync': args.archivefsync if args.archivefsync else 'none',
+    'archivedrop': args.archivedrop if args.archivedrop else False,
     'endpointtype': args.endpointtype if args.endpointtype else '',
     'segmentrequests': args.segmentrequests if args.segmentrequests else False,
     'initialinputbuffersize': 60,
@@ -2630,8 +5118,22 @@ if __name__ == '__main__':
     'stdout': args.stdout if args.stdout else False,
     'comparemanifests': args.comparemanifests if args.comparemanifests else False,
     'loadtest': args.loadtest if args.loadtest else False,
+    'loadrps': args.loadrps if args.loadrps else 0,
+    'loadendpointrps': args.loadendpointrps if args.loadendpointrps else 0,
+    'loadsegments': args.loadsegments if args.loadsegments != None else 1,
+    'loadduration': args.loadduration if args.loadduration else 0,
+    'loadconnections': args.loadconnections if args.loadconnections else 1000,
+    'phaseprofiler': args.phaseprofiler if args.phaseprofiler else False,
+    'phasemetrics': args.phasemetrics if args.phasemetrics else False,
+    'phasewindow': args.phasewindow if args.phasewindow else 60,
+    'profile': args.profile if args.profile else False,
+    'profilerate': args.profilerate if args.profilerate else 10,
+    'profileinterval': args.profileinterval if args.profileinterval else 60,
+    'profileoverhead': args.profileoverhead if args.profileoverhead else 1,
     'emt': args.emt if args.emt else False,
-    'emtadsegmentstring': args.emtadsegmentstring if args.emtadsegmentstring else 'asset'
+    'emtadsegmentstring': args.emtadsegmentstring if args.emtadsegmentstring else 'asset',
+    'emtsessions': args.emtsessions if args.emtsessions else 0,
+    'emtsessionparams': args.emtsessionparams if args.emtsessionparams else '{}',
   }
 
   # Create folder structure
@@ -2676,6 +5178,12 @@ if __name__ == '__main__':
   userargs['segmentsfolder'] = str(segmentsfolder)
   userargs['dashboardsfolder'] = str(dashboardsfolder)
   userargs['trackingfolder'] = str(trackingfolder)
+  if not userargs['flightrecorderfolder']:
+    userargs['flightrecorderfolder'] = str(Path(userargs['property'], 'flightrecorder')) if userargs['property'] else 'flightrecorder'
+  if not userargs['emffile']:
+    userargs['emffile'] = str(Path(logsfolder, 'metrics.emf'))
+  if not userargs['checkpointfile']:
+    userargs['checkpointfile'] = str(Path(logsfolder, 'checkpoint.json'))
 
   try:
     logsfolder.mkdir(parents = True, exist_ok = True)
@@ -2696,29 +5204,49 @@ if __name__ == '__main__':
     tlogger = logging.getLogger("thread")
     mlogger = logging.getLogger("main")
 
+  if userargs['asynclogging'] == True:
+    configureasynclogging(tlogger)
+    configureasynclogging(mlogger)
   logger = logging.LoggerAdapter(mlogger, {'label': userargs['label']})
 
+  # Replay only manifests, segment and tracking responses are not archived with them
+  if userargs['replay']:
+    userargs['segments'] = False ; userargs['segmentrequests'] = False ; userargs['tracking'] = False ; userargs['trackingrequests'] = False ; userargs['loadtest'] = False
+    tlogger.addFilter(replaytimefilter())
+
   # Load endpoints
-  if userargs['url']:
+  if userargs['benchmark'] == True:
+    endpointslist = []
+  elif userargs['replay']:
+    endpointslist = loadendpointsfromreplay(logger)
+  elif userargs['url']:
     endpointslist = loadendpointfromurl(logger)
   else:
     endpointslist = loadendpointsfromfile(logger)
+  # Initialize MediaTailor sessions
+  if userargs['emtsessions'] > 0 and not userargs['replay'] and userargs['benchmark'] == False:
+    try:
+      userargs['emtsessionparams'] = json.loads(userargs['emtsessionparams'])
+    except ValueError:
+      logger.error('Invalid --emtsessionparams JSON, initializing sessions without ads parameters')
+      userargs['emtsessionparams'] = {}
+    endpointslist = initializesessions(logger, endpointslist)
   logger.debug('Endpointslist: ' + str(endpointslist))
 
   # Load lxml library if any DASH or Smooth endpoint
   needxmllibrary = False
   for endpoint in endpointslist:
-    if endpoint['type'] != 'hls' and userargs['loadtest'] == False:
+    if endpoint['type'] != 'hls':
       needxmllibrary = True
       break
-  if needxmllibrary:
+  if needxmllibrary or userargs['benchmark'] == True:
     from lxml import etree as ET
 
   # Configure urllib3 pool
   http = urllib3.PoolManager(num_pools = 25, maxsize = len(endpointslist), timeout = userargs['httptimeout'])
 
   # Configure CloudWatch
-  if userargs['cwmetrics'] == True and userargs['loadtest'] == False:
+  if userargs['cwmetrics'] == True:
     import boto3
     import botocore.exceptions
     from botocore.config import Config
@@ -2741,10 +5269,38 @@ if __name__ == '__main__':
       logger.exception('Error configuring Cloudwatch.')
       userargs['cwmetrics'] = False
 
+  # Configure EMF
+  if userargs['emf'] == True:
+    emfqueue = queue.Queue()
+    emfthread = threading.Thread(target = emfwriter, name = 'emfwriter', args = (logger, userargs['emffile']))
+    emfthread.start()
+  else:
+    userargs['emf'] = False
+
+  # Configure Prometheus exporter
+  if userargs['prometheus'] == True:
+    try:
+      prometheusserver = ThreadingHTTPServer(('', userargs['prometheusport']), prometheusrequesthandler)
+      prometheusserver.daemon_threads = True
+      threading.Thread(target = prometheusserver.serve_forever, name = 'prometheus', daemon = True).start()
+      logger.info('Serving Prometheus metrics on port ' + str(userargs['prometheusport']))
+    except Exception:
+      logger.exception('Error starting Prometheus exporter')
+      userargs['prometheus'] = False
+  else:
+    userargs['prometheus'] = False
+
+  # Metrics are collected when publishing to CloudWatch, writing EMF or exporting to Prometheus
+  userargs['metrics'] = userargs['cwmetrics'] or userargs['emf'] or userargs['prometheus']
+
   # Check frequency
   if userargs['frequency'] < 0.5:
     userargs['frequency'] = 0.5
 
+  # Phase metrics need phase profiler
+  if userargs['phasemetrics'] == True:
+    userargs['phaseprofiler'] = True
+
   # Disable header requests if saving segments
   if userargs['segments'] == True:
     userargs['segmentrequests'] = False
@@ -2760,54 +5316,112 @@ if __name__ == '__main__':
   # Log user args to be used for monitoring
   logger.info('User arguments ' + str(userargs))
 
-  # Start monitoring threads
-  threads = {}
-  for i in endpointslist:
-    x = threading.Thread(target = premonitor, args = (tlogger, i, lockm))
-    i['thread'] = x
-    x.start()
-    time.sleep(0.05)
-  logger.debug('Created a thread for each endpoint')
+  # Configure zstd archive codec
+  if userargs['zstd'] == True:
+    if importlib.util.find_spec('zstandard') != None:
+      if userargs['archiveformat'] == 'files':
+        userargs['archiveformat'] = 'pack'
+        logger.info('Saving manifests and tracking responses into pack files as required by zstd dictionaries')
+    else:
+      logger.error('zstandard package is required by --zstd, saving without zstd')
+      userargs['zstd'] = False
+
+  # Load segment store
+  if userargs['segments'] == True and userargs['segmentstore'] == True:
+    loadsegmentstore(logger)
+  else:
+    userargs['segmentstore'] = False
+
+  # Trigger flight recorder on warnings of monitoring threads
+  if userargs['flightrecorder'] == True:
+    handler = flightrecorderhandler(level = logging.WARNING)
+    tlogger.addHandler(handler)
+    logger.info('Flight recorder keeps ' + str(userargs['flightrecordersize']) + ' responses per rendition, up to ' + str(userargs['flightrecordermemory']) + ' MB, triggers: ' + str(userargs['flightrecordertriggers']))
+
+  # Start archive writers
+  if userargs['manifests'] == True or userargs['segments'] == True or userargs['tracking'] == True or userargs['flightrecorder'] == True:
+    for i in range(userargs['archivewriters']):
+      archivequeues.append(queue.Queue(maxsize = max(1, userargs['archivequeuesize'] // userargs['archivewriters'])))
+      threading.Thread(target = archivewriter, name = 'archivewriter-' + str(i), args = (logger, archivequeues[-1])).start()
+  else:
+    userargs['archivewriters'] = 0
+
+  # Start dashboard writer, dashboards are rendered as renditions are registered
+  dashboardrenditions = 0
+  if userargs['dashboards'] == True and userargs['cwmetrics'] == True and userargs['loadtest'] == False:
+    if Path(userargs['templatesfolder']).is_dir():
+      env = Environment(loader = FileSystemLoader(os.path.join(os.path.dirname(os.path.realpath(__file__)), userargs['templatesfolder'])), trim_blocks = True, lstrip_blocks = True)
+      templates = {}
+      for i in dashboardtemplates:
+        if Path(userargs['templatesfolder'], i).is_file():
+          templates[i] = env.get_template(i)
+        else:
+          logger.error('Template file ' + i + ' not found in ' + userargs['templatesfolder'])
+      if templates:
+        dashboardrenditions = userargs['dashboardrenditions'] if userargs['dashboardrenditions'] > 0 else min(getdashboardcapacity(i) for i in templates.values())
+        logger.info('Dashboards have up to ' + str(dashboardrenditions) + ' renditions')
+        threading.Thread(target = dashboardwriter, name = 'dashboards', args = (logger, templates), daemon = True).start()
+    else:
+      logger.error('Templates folder ' + userargs['templatesfolder'] + ' not found')
+  userargs['dashboardrenditions'] = dashboardrenditions
+
+  # Load checkpoint of previous run and start checkpoint writer, renditions monitored together are not resumed from checkpoint
+  if userargs['checkpoint'] == True and (userargs['allrenditions'] == True or userargs['playerrenditions'] == True):
+    logger.warning('Checkpoints are not supported with --allrenditions and --playerrenditions, monitoring without checkpoints')
+    userargs['checkpoint'] = False
+  if userargs['checkpoint'] == True and not userargs['replay'] and userargs['benchmark'] == False and userargs['loadtest'] == False:
+    resumestates = loadcheckpoint(logger)
+    threading.Thread(target = checkpointwriter, name = 'checkpoint', args = (logger,), daemon = True).start()
+  else:
+    userargs['checkpoint'] = False
+
+  # Start beacons event loop
+  if userargs['firebeacons'] == True and userargs['trackingrequests'] == True and not userargs['replay'] and userargs['loadtest'] == False:
+    threading.Thread(target = runbeacons, name = 'beacons', args = (logger,), daemon = True).start()
+
+  # Start sampling profiler
+  if userargs['profile'] == True:
+    threading.Thread(target = samplingprofiler, name = 'profiler', args = (logger,)).start()
+
+  # Start load test or monitoring threads, replay time includes starting the replaying threads
+  threads = {} ; replaystart = time.perf_counter()
+  if userargs['loadtest'] == True:
+    loadthread = threading.Thread(target = runloadtest, name = 'loadtest', args = (logger, endpointslist))
+    loadthread.start()
+  else:
+    if not userargs['replay'] and userargs['benchmark'] == False:
+      with startupstatslock:
+        startupstats['pending'] = set(i['name'] for i in endpointslist) ; startupstats['endpoints'] = len(startupstats['pending'])
+    if userargs['bootstrap'] == True and not userargs['replay']:
+      bootstrapendpoints(logger, tlogger, endpointslist, lockm)
+    else:
+      for i in endpointslist:
+        startmonitorthread(tlogger, i, lockm)
+        if not userargs['replay']:
+          time.sleep(0.05)
+    logger.debug('Created a thread for each endpoint')
 
   try:
-    deadlist = []
-    while True:
-      # Create dashboard from template 
-      if userargs['dashboards'] == True and userargs['cwmetrics'] == True and userargs['loadtest'] == False and not dashboardcreated:
-        time.sleep(15)
-        metrics = []
-        templatespath = Path(userargs['templatesfolder'])
-        if templatespath.is_dir():
-          env = Environment(loader = FileSystemLoader(os.path.join(os.path.dirname(os.path.realpath(__file__)), userargs['templatesfolder'])), trim_blocks = True, lstrip_blocks = True)
-
-          templatehelper = {'all': ['cw_all.json']}
-          for k in templatehelper.keys():
-            for v in templatehelper[k]:
-              templatepath = Path(userargs['templatesfolder'], v)
-              if templatepath.is_file():
-                template = env.get_template(v)
-                if k == 'all':
-                  for i in renditionnames.keys():
-                    for j in renditionnames[i]:
-                      metrics.append(f"\"Type\", \"{i}\", \"Endpoint\", \"{j}\"")
-                else:
-                  for i in renditionnames[k]:
-                    metrics.append('"Type", "' + k + '", "Endpoint", "' + i + '"')
-                render = template.render(region = userargs['cwregion'], metrics = metrics, accountid = userargs['cwaccountid'], propertyname = userargs['property'], rendersegments = True if (userargs['segments'] == True or userargs['segmentrequests'] == True) else False, rendertracking = True if userargs['trackingrequests'] == True else False)
-                metrics.clear()
-                # Save dashboard
-                filepath = Path(userargs['dashboardsfolder'], v)
-                try:
-                  with filepath.open('w+t') as f:
-                    f.write(render)
-                except Exception:
-                  logger.exception('Error saving dashboard')
-                logger.info('Created dashboard file: ' + str(filepath))
-              else:
-                logger.error('Template file ' + v + ' not found in ' + userargs['templatesfolder'])
-        else:
-          logger.error('Templates folder ' + userargs['templatesfolder'] + ' not found')
-        dashboardcreated = True
+    deadlist = [] ; benchmarkfailed = False
+    # Run benchmarks and stop
+    if userargs['benchmark'] == True:
+      benchmarkfailed = runbenchmarks(logger, tlogger)
+      terminatethreads = True
+    # Wait until load test ends
+    elif userargs['loadtest'] == True:
+      while loadthread.is_alive():
+        loadthread.join(1)
+      terminatethreads = True
+    # Wait until all archived manifests are replayed
+    elif userargs['replay']:
+      for i in endpointslist:
+        i['thread'].join()
+      elapsed = time.perf_counter() - replaystart
+      logger.info('Replayed ' + str(replaystats['manifests']) + ' manifests (' + str(round(replaystats['bytes'] / 1048576, 1)) + ' MB) of ' + str(len(endpointslist)) + ' renditions in ' + str(round(elapsed, 3)) + ' seconds, ' + str(round(replaystats['manifests'] / elapsed if elapsed > 0 else 0, 1)) + ' manifests per second')
+      if userargs['phaseprofiler'] == True:
+        logger.info(getphasereport())
+      terminatethreads = True
+    while not terminatethreads:
       time.sleep(30)
 
       # Report status of threads
@@ -2820,18 +5434,57 @@ if __name__ == '__main__':
           else:
             deadcount = deadcount + 1
             deadlist.append(i)
+      if userargs['phaseprofiler'] == True:
+        logger.info(getphasereport())
       if deadcount > 0:
         logger.error('Some threads stopped unexpectedly, count: ' + str(deadcount) + ', info: ' + str(deadlist))
       else:
         logger.debug('Total threads count: ' + str(threading.active_count()) + ', main threads count: ' + str(threadscount) + ', running main threads count: ' + str(alivecount) + ', stopped main threads count and info: ' + str(deadcount) + ' (' + str(deadlist) + ')')
 
+      # Log summaries of repeated warnings
+      if userargs['warningwindow'] > 0:
+        flushwarningwindows()
+
+      # Apply segment store retention
+      if userargs['segmentstore'] == True and (userargs['segmentstoresize'] > 0 or userargs['segmentstoreage'] > 0):
+        evictsegmentblobs(logger)
+
+      # Report aggregate ad fill and latency of sessions
+      if userargs['emtsessions'] > 0:
+        reportsessions(logger)
+
+      # Report beacon latency
+      if userargs['firebeacons'] == True:
+        reportbeacons(logger)
+
       # Send main thread metrics
-      if userargs['cwmetrics'] == True:
-        response = cloudwatch.put_metric_data(Namespace = 'CanaryMonitor', MetricData = [{'MetricName': 'alivethreads', 'Dimensions': [{'Name': 'Property', 'Value': userargs['label']}], 'Value': threading.active_count()}, {'MetricName': 'deceasedthreads', 'Dimensions': [{'Name': 'Property', 'Value': userargs['label']}], 'Value': deadcount}])
+      if userargs['metrics'] == True:
+        mainmetrics = {'alivethreads': threading.active_count(), 'deceasedthreads': deadcount}
+        if userargs['archivewriters'] > 0 or userargs['segmentstore'] == True:
+          mainmetrics.update(getarchivemetrics())
+        if userargs['flightrecorder'] == True:
+          with flightrecorderlock:
+            mainmetrics['flightrecordermemory'] = round(flightrecorderstats['memory'] / 1048576, 1)
+            mainmetrics['flightrecorderflushes'] = flightrecorderstats['flushes']
+            flightrecorderstats['flushes'] = 0
+        with startupstatslock:
+          if startupstats['timetoallmonitored'] != None:
+            mainmetrics['timetoallmonitored'] = startupstats['timetoallmonitored'] ; startupstats['timetoallmonitored'] = None
+        publishmainmetrics(logger, mainmetrics)
       deadlist.clear()
         
   except KeyboardInterrupt:
     terminatethreads = True
   except Exception as e:
     logger.exception(e)
-    
+
+  # Write last checkpoint
+  if userargs['checkpoint'] == True:
+    writecheckpoint(logger)
+
+  # Log summaries of open warning windows after monitoring threads stopped, before the logging thread stops
+  atexit.register(flushwarningwindows, True)
+
+  # Regressions fail the benchmark run
+  if userargs['benchmark'] == True and benchmarkfailed:
+    sys.exit(1)
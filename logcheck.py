@@ -0,0 +1,44 @@
+# Check names of warnings and errors of monitor.log by beginning of message
+#
+# Used by canarymonitor.py for JSON log lines and warning rate limiting, and by logindex.py for queries by check.
+# Kept apart from canarymonitor.py, so that logindex.py runs without the dependencies of the monitor.
+
+logchecks = [
+  ('HTTP request', 'http'),
+  ('Stale manifest', 'stale'),
+  ('Discontinuity', 'discontinuity'),
+  ('Last segment', 'lastsegment'),
+  ('Manifests do not match', 'manifestmismatch'),
+  ('Inconsistency in manifest periods', 'periods'),
+  ('Duration of period was', 'periods'),
+  ('Presentation time offset misalignment', 'periods'),
+  ('Missing video adaptation set', 'adaptationsets'),
+  ('Missing audio adaptation set', 'adaptationsets'),
+  ('Updated primary monitoring representation', 'adaptationsets'),
+  ('Content shortage', 'contentshortage'),
+  ('Possible lip sync issue', 'lipsync'),
+  ('Subtitles out of sync', 'subtitlessync'),
+  ('Segment duration exceeded', 'segmentduration'),
+  ('Unexpected segment duration', 'segmentduration'),
+  ('Positive jump in PDT', 'pdtjump'),
+  ('Negative jump in PDT', 'pdtjump'),
+  ('Found differences in mediasequence', 'mediasequence'),
+  ('Manifest value has changed', 'manifestvalue'),
+  ('Ad break was', 'adbreakduration'),
+  ('Beacon request', 'beacon'),
+  ('Nested ad break start', 'adbreak'),
+  ('Found ad break end', 'adbreak'),
+  ('No ID found in EXT-X-DATERANGE', 'adbreak'),
+  ('Found avail in tracking response', 'trackingavail'),
+  ('Did not find expected tracking info', 'trackingavail'),
+  ('No avails in tracking response', 'trackingavail'),
+  ('Empty tracking response', 'trackingavail'),
+  ('Missing', 'trackingevents')
+]
+
+
+def getlogcheck(message:str):
+  for prefix, check in logchecks:
+    if message.startswith(prefix):
+      return check
+  return None
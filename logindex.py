@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+# Indexed queries over monitor.log (text or --logformat json)
+#
+# The index (monitor.log.idx) is a JSON lines file: a header with the block size and the beginning of the log file,
+# then one line per block of the log file (about --blocksize bytes of complete log lines) with its byte range,
+# first and last time, log lines per rendition, warnings and errors per check and per minute.
+# It is updated incrementally before every query, only the part of the log written since the last update is read.
+# Queries select blocks by the index and read only these blocks of the memory mapped log file.
+
+import argparse
+import json
+import mmap
+import os
+import re
+import sys
+
+import logcheck
+
+indexversion = 2
+
+# Summary of warnings suppressed by --warningwindow
+repeatedpattern = re.compile(r'Repeated (\d+) times in \d+ seconds: ')
+
+
+# Check and count of a warning or error message, a summary of repeated warnings counts as its warnings of the summarized check
+def classifymessage(message:str, check):
+  count = 1
+  match = repeatedpattern.match(message)
+  if match:
+    count = int(match.group(1))
+    message = message[match.end():]
+  if check == None:
+    check = logcheck.getlogcheck(message)
+  return (check if check != None else 'other'), count
+
+
+# Parse log line, returns (time, level letter, rendition, check, count of warnings) or None for continuation lines (e.g. tracebacks)
+def parseline(line:str):
+  if line.startswith('{'):
+    try:
+      entry = json.loads(line)
+    except ValueError:
+      return None
+    check = entry.get('check') ; count = 1
+    if entry.get('level', '')[0:1] in ('W', 'E'):
+      check, count = classifymessage(entry.get('message', ''), check)
+    return (entry.get('time', '').replace('T', ' ').rstrip('Z'), entry.get('level', '')[0:1], entry.get('rendition'), check, count)
+  if len(line) < 24 or line[4] != '-' or line[10] != ' ' or line[19] != '.':
+    return None
+  parts = line.split(' ', 5)
+  if len(parts) < 5:
+    return None
+  check = None ; count = 1
+  if parts[2] in ('W', 'E'):
+    check, count = classifymessage(parts[5] if len(parts) > 5 else '', None)
+  return (parts[0] + ' ' + parts[1], parts[2], parts[3], check, count)
+
+
+def indexblock(data:bytes, offset:int):
+  block = {'offset': offset, 'end': offset + len(data), 'start': None, 'last': None, 'renditions': {}, 'checks': {}, 'minutes': {}}
+  for line in data.decode('utf-8', errors = 'replace').splitlines():
+    parsed = parseline(line)
+    if parsed == None:
+      continue
+    linetime, level, rendition, check, count = parsed
+    if block['start'] == None or linetime < block['start']:
+      block['start'] = linetime
+    if block['last'] == None or linetime > block['last']:
+      block['last'] = linetime
+    if rendition:
+      block['renditions'][rendition] = block['renditions'].get(rendition, 0) + 1
+    if check:
+      block['checks'][check] = block['checks'].get(check, 0) + count
+      minute = block['minutes'].setdefault(linetime[0:16], {})
+      minute[check] = minute.get(check, 0) + count
+  return block
+
+
+# Load index, returns (header, blocks, position of last block line in index file)
+def loadindex(indexpath):
+  header = None ; blocks = [] ; lastposition = 0
+  if not os.path.exists(indexpath):
+    return header, blocks, lastposition
+  with open(indexpath, 'rb') as f:
+    position = 0
+    for line in f:
+      if not line.endswith(b'\n'):
+        break
+      entry = json.loads(line)
+      if header == None:
+        header = entry
+      else:
+        blocks.append(entry)
+        lastposition = position
+      position = position + len(line)
+  return header, blocks, lastposition
+
+
+# Index log lines written since the last update, the last block is indexed again until it is full
+def updateindex(logpath, blocksize:int):
+  indexpath = str(logpath) + '.idx'
+  header, blocks, lastposition = loadindex(indexpath)
+  size = os.path.getsize(logpath)
+  with open(logpath, 'rb') as f:
+    head = f.read(64).hex()
+  if header == None or header.get('version') != indexversion or header.get('head') != head[0:len(header.get('head', ''))] or (blocks and blocks[-1]['end'] > size):
+    # New, rotated or truncated log file
+    header = {'version': indexversion, 'blocksize': blocksize, 'head': head}
+    with open(indexpath, 'w') as f:
+      f.write(json.dumps(header) + '\n')
+    blocks = []
+  elif blocks and blocks[-1].get('tail'):
+    blocks.pop()
+    with open(indexpath, 'r+b') as f:
+      f.truncate(lastposition)
+  offset = blocks[-1]['end'] if blocks else 0
+  with open(logpath, 'rb') as f, open(indexpath, 'a') as indexfile:
+    f.seek(offset)
+    pending = b''
+    while True:
+      data = f.read(header['blocksize'])
+      if not data:
+        break
+      pending = pending + data
+      cut = pending.rfind(b'\n')
+      if cut < 0:
+        continue
+      block = indexblock(pending[0:cut + 1], offset)
+      if len(data) < header['blocksize']:
+        # Block at the end of the log file
+        block['tail'] = True
+      indexfile.write(json.dumps(block) + '\n')
+      blocks.append(block)
+      offset = block['end']
+      pending = pending[cut + 1:]
+  return blocks
+
+
+def selectblocks(blocks:list, rendition, start, end, check):
+  return [i for i in blocks if i['start'] != None
+          and (not rendition or rendition in i['renditions'])
+          and (not check or check in i['checks'])
+          and (not start or i['last'] >= start)
+          and (not end or i['start'] <= end)]
+
+
+# Iterate over log lines of selected blocks matching the query, continuation lines follow their log line
+def querylines(logpath, blocks:list, rendition, start, end, check, levels):
+  if os.path.getsize(logpath) == 0:
+    return
+  with open(logpath, 'rb') as f:
+    with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+      for block in blocks:
+        matched = False
+        for line in mm[block['offset']:block['end']].decode('utf-8', errors = 'replace').splitlines():
+          parsed = parseline(line)
+          if parsed == None:
+            if matched:
+              yield line, None
+            continue
+          linetime, level, linerendition, linecheck, count = parsed
+          matched = ((not rendition or linerendition == rendition) and (not check or linecheck == check)
+                     and (not levels or level in levels) and (not start or linetime >= start) and (not end or linetime <= end))
+          if matched:
+            yield line, parsed
+
+
+# Warnings and errors per minute and check, from the index only unless a rendition is given
+def minutecounts(logpath, blocks:list, rendition, start, end, check):
+  counts = {}
+  if rendition:
+    for line, parsed in querylines(logpath, blocks, rendition, start, end, check, ('W', 'E')):
+      if parsed and parsed[3]:
+        minute = counts.setdefault(parsed[0][0:16], {})
+        minute[parsed[3]] = minute.get(parsed[3], 0) + parsed[4]
+  else:
+    for block in blocks:
+      for minutetime, checks in block['minutes'].items():
+        if (start and minutetime < start[0:16]) or (end and minutetime > end[0:16]):
+          continue
+        minute = counts.setdefault(minutetime, {})
+        for k, v in checks.items():
+          if not check or k == check:
+            minute[k] = minute.get(k, 0) + v
+  return counts
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description = 'Indexed queries over monitor.log of canarymonitor.py, times are in the format of the log file, e.g. "2026-10-19 03:19" or "2026-10-19 03:19:32.236"')
+  parser.add_argument('logfile', type = str, nargs = '?', default = 'logs/monitor.log', help = 'log file (default: logs/monitor.log)')
+  parser.add_argument('--rendition', type = str, help = 'rendition name, e.g. myendpoint-v1')
+  parser.add_argument('--start', type = str, help = 'start time, e.g. "2026-10-19 03:00"')
+  parser.add_argument('--end', type = str, help = 'end time (inclusive), e.g. "2026-10-19 04:00"')
+  parser.add_argument('--check', type = str, help = 'check of warnings and errors, e.g. stale, discontinuity, lastsegment, pdtjump, lipsync, http or other')
+  parser.add_argument('--level', type = str, help = 'log level letters, e.g. WE for warnings and errors')
+  parser.add_argument('--counts', action = 'store_true', help = 'print warnings and errors per minute and check instead of log lines')
+  parser.add_argument('--update', action = 'store_true', help = 'only update the index')
+  parser.add_argument('--blocksize', type = int, help = 'block size of a new index in KB, e.g. 4096 (default: 1024)')
+  args = parser.parse_args()
+
+  if not os.path.exists(args.logfile):
+    print('No such file: ' + args.logfile, file = sys.stderr)
+    sys.exit(1)
+  # End time of a minute includes the whole minute
+  end = args.end + '~' if args.end else None
+  blocks = updateindex(args.logfile, (args.blocksize if args.blocksize else 1024) * 1024)
+  if args.update:
+    print('Indexed ' + str(len(blocks)) + ' blocks of ' + args.logfile)
+  elif args.counts:
+    counts = minutecounts(args.logfile, selectblocks(blocks, args.rendition, args.start, end, args.check), args.rendition, args.start, end, args.check)
+    for minute in sorted(counts.keys()):
+      if counts[minute]:
+        print(minute + '\t' + str(sum(counts[minute].values())) + '\t' + ', '.join(k + ' ' + str(v) for k, v in sorted(counts[minute].items(), key = lambda i: -i[1])))
+  else:
+    try:
+      for line, parsed in querylines(args.logfile, selectblocks(blocks, args.rendition, args.start, end, args.check), args.rendition, args.start, end, args.check, args.level):
+        print(line)
+    except BrokenPipeError:
+      pass
@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+
+# Local live origin simulator for testing canarymonitor.py at scale
+#
+# Every channel is generated from the clock, so any channel name can be requested and thousands of channels
+# cost no more than one. Segment n of every channel starts at n * --segmentduration seconds since Unix epoch.
+#   /<channel>/master.m3u8, /<channel>/<rendition>.m3u8    HLS multivariant and media playlists (v1..vN, a1)
+#   /<channel>/index.mpd                                   DASH with SegmentTimeline, a period per content and ad run
+#   /<channel>/channel.ism/Manifest                        Smooth
+#   /<channel>/tracking[/<session id>]                     MediaTailor style tracking JSON with ETag
+#   POST [/v1/session/<config>]/<channel>/<manifest>       MediaTailor style session initialization
+#   /beacon/...                                            ad beacons
+#   anything else                                          segment
+# Ad breaks start every --adinterval seconds, either with SCTE-35 (CUE-OUT/CUE-IN tags, SpliceInsert events)
+# or MediaTailor style (discontinuities, ad segments named asset_*, ad periods with '_' in id).
+# HLS tracking positions are relative to the first segment of the session, session ids are hls-<start time in ms>[-<session number>],
+# DASH tracking positions are relative to availabilityStartTime. Sessions initialized by POST requests get --adfill percent
+# of their avails filled and ads rotated over --creatives creatives by session number.
+#
+# Faults are read from a JSON file with a list of faults, e.g.
+#   [{"channels": ["ch1", "ch2*"], "type": "stale", "start": 60, "duration": 30, "every": 300},
+#    {"channels": ["*"], "type": "http", "value": 503, "rate": 0.1, "target": "segment"}]
+# with start, duration and every in seconds since the simulator started. Fault types and default values:
+#   stale             manifests do not change
+#   lastsegment       media sequence numbers and DASH segment numbers jump by value (1000)
+#   segmentinfo       segment names change
+#   targetduration    EXT-X-TARGETDURATION increases by value (1)
+#   adduration        advertised ad break duration differs by value seconds (10)
+#   notracking        tracking responses have no avails
+#   trackingoffset    avail start times in tracking responses move by value seconds (30)
+#   http              response status value (503) with probability rate (1.0) for target manifest, segment, tracking or all
+#   slow              response delay value seconds (5) for target
+#   discontinuity     discontinuity at segments starting in the fault window, DASH and Smooth time gap of value ms (1000)
+#   pdtjump           PDT of segments starting in the fault window moves by value seconds (60)
+#   segmentduration   EXTINF of segments starting in the fault window is longer by value seconds (target duration)
+#   lipsync           audio of segments starting in the fault window is offset by value ms (200)
+#   noaudio           DASH periods starting in the fault window have no audio adaptation set
+
+import argparse
+import datetime
+import fnmatch
+import gzip
+import hashlib
+import http.server
+import json
+import math
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+faultdefaults = {'stale': 0, 'lastsegment': 1000, 'segmentinfo': 0, 'targetduration': 1, 'adduration': 10, 'notracking': 0, 'trackingoffset': 30,
+                 'http': 503, 'slow': 5, 'discontinuity': 1000, 'pdtjump': 60, 'segmentduration': 0, 'lipsync': 200, 'noaudio': 0}
+# Faults changing the whole response at request time, the other faults change segments starting in the fault window
+requestfaults = ('stale', 'lastsegment', 'segmentinfo', 'targetduration', 'adduration', 'notracking', 'trackingoffset', 'http', 'slow')
+trackingevents = [('impression', 0.0), ('start', 0.0), ('firstQuartile', 0.25), ('midpoint', 0.5), ('thirdQuartile', 0.75), ('complete', 1.0)]
+dashepoch = datetime.datetime(2024, 1, 1, tzinfo = datetime.timezone.utc)
+
+
+# Configure simulated channels, also used for benchmark fixtures of canarymonitor.py
+def configure(settings:dict):
+  global simulatorargs, starttime, videorenditions, segmentbody, responsecache, channelfaults, faults
+  simulatorargs = settings
+  simulatorargs['segmentdurationms'] = int(round(simulatorargs['segmentduration'] * 1000))
+  simulatorargs['targetduration'] = math.ceil(simulatorargs['segmentduration'])
+  simulatorargs.setdefault('adfill', 100) ; simulatorargs.setdefault('creatives', 0)
+  starttime = time.time()
+  videorenditions = [('v' + str(i + 1), 400000 * (i + 1), 160 * (i + 4), 90 * (i + 4)) for i in range(simulatorargs['variants'])]
+  segmentbody = b'\0' * simulatorargs.get('segmentsize', 0)
+  responsecache = {}
+  channelfaults = {}
+  faults = []
+
+
+# Load faults from JSON file
+def loadfaults(filename:str):
+  with open(filename) as f:
+    loaded = json.load(f)
+  for fault in loaded:
+    if fault.get('type') not in faultdefaults.keys():
+      raise ValueError('Unknown fault type: ' + str(fault.get('type')))
+    fault['channels'] = fault.get('channels', ['*'])
+    fault['start'] = float(fault.get('start', 0))
+    fault['duration'] = float(fault.get('duration', 60))
+    fault['every'] = float(fault.get('every', 0))
+    fault['rate'] = float(fault.get('rate', 1.0))
+    fault['target'] = fault.get('target', 'manifest')
+    if 'value' not in fault.keys():
+      fault['value'] = simulatorargs['targetduration'] if fault['type'] == 'segmentduration' else faultdefaults[fault['type']]
+  return loaded
+
+
+# Faults matching the channel name, names in faults can use wildcards
+def getchannelfaults(channel:str):
+  matched = channelfaults.get(channel)
+  if matched == None:
+    matched = [i for i in faults if any(fnmatch.fnmatchcase(channel, j) for j in i['channels'])]
+    channelfaults[channel] = matched
+  return matched
+
+
+# Start of the fault window containing the time or None
+def faultwindow(fault:dict, t:float):
+  elapsed = t - starttime - fault['start']
+  if elapsed < 0:
+    return None
+  if fault['every'] > 0:
+    elapsed = elapsed % fault['every']
+  if elapsed < fault['duration']:
+    return t - elapsed
+  return None
+
+
+# Value of the fault of the type active at the time or None
+def faultvalue(matched:list, faulttype:str, t:float):
+  for fault in matched:
+    if fault['type'] == faulttype and faultwindow(fault, t) != None:
+      return fault['value']
+  return None
+
+
+# Index of the newest complete segment at the time
+def lastsegment(t:float):
+  return int(t * 1000) // simulatorargs['segmentdurationms'] - 1
+
+
+def isad(n:int):
+  if simulatorargs['adbreaks'] == 'none':
+    return False
+  return (n * simulatorargs['segmentdurationms']) % (simulatorargs['adinterval'] * 1000) < simulatorargs['adduration'] * 1000
+
+
+# First segment of the content or ad run containing segment n
+def runstart(n:int):
+  ad = isad(n) ; k = n ; limit = simulatorargs['adinterval'] * 1000 // simulatorargs['segmentdurationms'] + 1
+  while isad(k - 1) == ad and n - k < limit:
+    k = k - 1
+  return k
+
+
+# Number of discontinuities before segment n, ad break starts and ends of emt and starts of discontinuity faults
+def discontinuitiesbefore(matched:list, n:int):
+  count = 0 ; dms = simulatorargs['segmentdurationms'] ; interval = simulatorargs['adinterval'] * 1000
+  if simulatorargs['adbreaks'] == 'emt':
+    count = count + (n - 1) * dms // interval + 1 + max(((n - 1) * dms - simulatorargs['adduration'] * 1000) // interval + 1, 0)
+  for fault in matched:
+    if fault['type'] == 'discontinuity':
+      elapsed = (n - 1) * dms / 1000 - starttime - fault['start']
+      if elapsed >= 0:
+        count = count + (int(elapsed // fault['every']) + 1 if fault['every'] > 0 else 1)
+  return count
+
+
+def isotime(t:float):
+  return datetime.datetime.fromtimestamp(t, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def hlsmultivariantplaylist():
+  lines = ['#EXTM3U', '#EXT-X-INDEPENDENT-SEGMENTS', '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aac",NAME="English",LANGUAGE="en",DEFAULT=YES,AUTOSELECT=YES,CHANNELS="2",URI="a1.m3u8"']
+  for name, bandwidth, width, height in videorenditions:
+    lines.append('#EXT-X-STREAM-INF:BANDWIDTH=%s,RESOLUTION=%sx%s,CODECS="avc1.4d401f,mp4a.40.2",AUDIO="aac"' % (bandwidth, width, height))
+    lines.append(name + '.m3u8')
+  return '\n'.join(lines) + '\n'
+
+
+def hlsmediaplaylist(matched:list, rendition:str, t:float):
+  d = simulatorargs['segmentduration'] ; last = lastsegment(t) ; first = last - simulatorargs['window'] + 1
+  sequenceoffset = faultvalue(matched, 'lastsegment', t) or 0
+  targetduration = simulatorargs['targetduration'] + (faultvalue(matched, 'targetduration', t) or 0)
+  namesuffix = '?v=2' if faultvalue(matched, 'segmentinfo', t) != None else ''
+  adduration = simulatorargs['adduration'] + (faultvalue(matched, 'adduration', t) or 0)
+  lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:' + str(targetduration), '#EXT-X-MEDIA-SEQUENCE:' + str(first + sequenceoffset)]
+  if simulatorargs['adbreaks'] == 'emt' or any(i['type'] == 'discontinuity' for i in matched):
+    lines.append('#EXT-X-DISCONTINUITY-SEQUENCE:' + str(discontinuitiesbefore(matched, first)))
+  for n in range(first, last + 1):
+    segmentstart = n * simulatorargs['segmentdurationms'] / 1000 ; ad = isad(n) ; previousad = isad(n - 1)
+    if simulatorargs['adbreaks'] == 'emt':
+      if ad != previousad:
+        lines.append('#EXT-X-DISCONTINUITY')
+    elif simulatorargs['adbreaks'] == 'scte':
+      if ad and not previousad:
+        lines.append('#EXT-X-CUE-OUT:' + str(adduration))
+      elif ad:
+        lines.append('#EXT-X-CUE-OUT-CONT:ElapsedTime=%.3f,Duration=%s' % ((n - runstart(n)) * d, adduration))
+      elif previousad:
+        lines.append('#EXT-X-CUE-IN')
+    if faultvalue(matched, 'discontinuity', segmentstart) != None and faultvalue(matched, 'discontinuity', segmentstart - d) == None:
+      lines.append('#EXT-X-DISCONTINUITY')
+    lines.append('#EXT-X-PROGRAM-DATE-TIME:' + isotime(segmentstart + (faultvalue(matched, 'pdtjump', segmentstart) or 0)))
+    lines.append('#EXTINF:%.3f,' % (d + (faultvalue(matched, 'segmentduration', segmentstart) or 0)))
+    lines.append(('asset_' if ad and simulatorargs['adbreaks'] == 'emt' else '') + rendition + '_' + str(n) + '.ts' + namesuffix)
+  return '\n'.join(lines) + '\n'
+
+
+# Segment timeline of (t, d) pairs with repeats
+def segmenttimeline(entries:list):
+  elements = [] ; i = 0
+  while i < len(entries):
+    t, d = entries[i] ; r = 0
+    while i + r + 1 < len(entries) and entries[i + r + 1] == (t + (r + 1) * d, d):
+      r = r + 1
+    elements.append('<S t="%s" d="%s"%s/>' % (t, d, ' r="%s"' % r if r > 0 else ''))
+    i = i + r + 1
+  return '<SegmentTimeline>' + ''.join(elements) + '</SegmentTimeline>'
+
+
+def dashadaptationset(matched:list, t:float, mimetype:str, timescale:int, periodstart:int, first:int, last:int, prefix:str):
+  epochms = int(dashepoch.timestamp() * 1000) ; dms = simulatorargs['segmentdurationms'] ; entries = []
+  for n in range(first, last + 1):
+    segmentstart = n * dms / 1000 ; offsetms = 0
+    if faultvalue(matched, 'discontinuity', segmentstart) != None:
+      offsetms = offsetms + faultvalue(matched, 'discontinuity', segmentstart)
+    if mimetype == 'audio/mp4' and faultvalue(matched, 'lipsync', segmentstart) != None:
+      offsetms = offsetms + faultvalue(matched, 'lipsync', segmentstart)
+    entries.append(((n * dms - epochms + offsetms) * timescale // 1000, dms * timescale // 1000))
+  template = '<SegmentTemplate timescale="%s" presentationTimeOffset="%s" media="%s$RepresentationID$_$Number$.mp4" initialization="%s$RepresentationID$_init.mp4" startNumber="%s">%s</SegmentTemplate>' % (
+    timescale, (periodstart * dms - epochms) * timescale // 1000, prefix, prefix, first + (faultvalue(matched, 'lastsegment', t) or 0), segmenttimeline(entries))
+  if mimetype == 'video/mp4':
+    representations = ''.join('<Representation id="%s" bandwidth="%s" width="%s" height="%s" codecs="avc1.4d401f" frameRate="30"/>' % i for i in videorenditions)
+    return '<AdaptationSet mimeType="video/mp4" segmentAlignment="true" startWithSAP="1">' + template + representations + '</AdaptationSet>'
+  return '<AdaptationSet mimeType="audio/mp4" lang="en" segmentAlignment="true" startWithSAP="1">' + template + '<Representation id="a1" bandwidth="128000" codecs="mp4a.40.2" audioSamplingRate="48000"/></AdaptationSet>'
+
+
+def dashmanifest(matched:list, t:float):
+  d = simulatorargs['segmentduration'] ; dms = simulatorargs['segmentdurationms'] ; last = lastsegment(t) ; first = last - simulatorargs['window'] + 1
+  epochms = int(dashepoch.timestamp() * 1000)
+  adduration = simulatorargs['adduration'] + (faultvalue(matched, 'adduration', t) or 0)
+  periods = [] ; n = first
+  while n <= last:
+    start = runstart(n) ; ad = isad(n) ; end = n
+    while end + 1 <= last and isad(end + 1) == ad:
+      end = end + 1
+    periodid = str(start) + ('_1' if ad and simulatorargs['adbreaks'] == 'emt' else '')
+    period = '<Period id="%s" start="PT%.3fS">' % (periodid, (start * dms - epochms) / 1000)
+    if ad and simulatorargs['adbreaks'] == 'scte':
+      breakid = start * dms // (simulatorargs['adinterval'] * 1000)
+      period = period + ('<EventStream schemeIdUri="urn:scte:scte35:2013:xml" timescale="90000"><Event duration="%s" id="%s" presentationTime="%s">'
+        '<scte35:SpliceInfoSection protocolVersion="0" ptsAdjustment="0" tier="4095"><scte35:SpliceInsert spliceEventId="%s" spliceEventCancelIndicator="false" outOfNetworkIndicator="true" spliceImmediateFlag="false" uniqueProgramId="1" availNum="1" availsExpected="1">'
+        '<scte35:Program><scte35:SpliceTime ptsTime="%s"/></scte35:Program><scte35:BreakDuration autoReturn="true" duration="%s"/></scte35:SpliceInsert></scte35:SpliceInfoSection></Event></EventStream>') % (
+        int(adduration * 90000), breakid, (start * dms - epochms) * 90, breakid, (start * dms * 90) % 8589934592, int(adduration * 90000))
+    period = period + '<SupplementalProperty schemeIdUri="urn:scte:dash:utc-time" value="%s"/>' % isotime(start * dms / 1000)
+    prefix = 'asset_' if ad and simulatorargs['adbreaks'] == 'emt' else ''
+    period = period + dashadaptationset(matched, t, 'video/mp4', 90000, start, n, end, prefix)
+    if faultvalue(matched, 'noaudio', start * dms / 1000) == None:
+      period = period + dashadaptationset(matched, t, 'audio/mp4', 48000, start, n, end, prefix)
+    periods.append(period + '</Period>')
+    n = end + 1
+  return ('<?xml version="1.0" encoding="UTF-8"?>\n<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" xmlns:scte35="urn:scte:scte35:2013:xml" type="dynamic" profiles="urn:mpeg:dash:profile:isoff-live:2011" '
+          'availabilityStartTime="%s" publishTime="%s" minimumUpdatePeriod="PT%sS" minBufferTime="PT%sS" timeShiftBufferDepth="PT%sS" suggestedPresentationDelay="PT%sS">\n%s\n</MPD>\n') % (
+          dashepoch.strftime('%Y-%m-%dT%H:%M:%SZ'), isotime(t), d, d, d * simulatorargs['window'], d * 3, '\n'.join(periods))
+
+
+def smoothmanifest(matched:list, t:float):
+  dms = simulatorargs['segmentdurationms'] ; last = lastsegment(t) ; first = last - simulatorargs['window'] + 1
+  streams = []
+  for streamtype in ('video', 'audio', 'text'):
+    chunks = []
+    for n in range(first, last + 1):
+      segmentstart = n * dms / 1000 ; offsetms = 0
+      if faultvalue(matched, 'discontinuity', segmentstart) != None:
+        offsetms = offsetms + faultvalue(matched, 'discontinuity', segmentstart)
+      if streamtype == 'audio' and faultvalue(matched, 'lipsync', segmentstart) != None:
+        offsetms = offsetms + faultvalue(matched, 'lipsync', segmentstart)
+      chunks.append('<c t="%s" d="%s"/>' % ((n * dms + offsetms) * 10000, dms * 10000))
+    if streamtype == 'video':
+      qualitylevels = ''.join('<QualityLevel Index="%s" Bitrate="%s" FourCC="H264" MaxWidth="%s" MaxHeight="%s" CodecPrivateData="000000016742C01F"/>' % (index, bandwidth, width, height) for index, (name, bandwidth, width, height) in enumerate(videorenditions))
+      streams.append('<StreamIndex Type="video" Name="video" TimeScale="10000000" Chunks="%s" QualityLevels="%s" Url="QualityLevels({bitrate})/Fragments(video={start time})">%s%s</StreamIndex>' % (len(chunks), len(videorenditions), qualitylevels, ''.join(chunks)))
+    elif streamtype == 'audio':
+      streams.append('<StreamIndex Type="audio" Name="audio" Language="eng" TimeScale="10000000" Chunks="%s" QualityLevels="1" Url="QualityLevels({bitrate})/Fragments(audio={start time})"><QualityLevel Index="0" Bitrate="128000" FourCC="AACL" SamplingRate="48000" Channels="2" BitsPerSample="16" PacketSize="4" AudioTag="255" CodecPrivateData="1190"/>%s</StreamIndex>' % (len(chunks), ''.join(chunks)))
+    else:
+      streams.append('<StreamIndex Type="text" Name="textstream_eng" Language="eng" Subtype="CAPT" TimeScale="10000000" Chunks="%s" QualityLevels="1" Url="QualityLevels({bitrate})/Fragments(textstream_eng={start time})"><QualityLevel Index="0" Bitrate="1000" FourCC="TTML"/>%s</StreamIndex>' % (len(chunks), ''.join(chunks)))
+  return '<?xml version="1.0" encoding="UTF-8"?>\n<SmoothStreamingMedia MajorVersion="2" MinorVersion="2" TimeScale="10000000" Duration="0" IsLive="TRUE" LookAheadFragmentCount="2" DVRWindowLength="%s">%s</SmoothStreamingMedia>\n' % (
+    simulatorargs['window'] * dms * 10000, ''.join(streams))
+
+
+# Tracking response with the avails of the current and the previous ad breaks
+def trackingresponse(matched:list, channel:str, sessionid:str, t:float):
+  if faultvalue(matched, 'notracking', t) != None:
+    return json.dumps({'avails': [], 'nextToken': '', 'nonLinearAvailsList': []})
+  dms = simulatorargs['segmentdurationms'] ; interval = simulatorargs['adinterval'] ; adduration = simulatorargs['adduration']
+  # Positions are relative to the first segment of the session for HLS and to availabilityStartTime for DASH
+  origin = dashepoch.timestamp()
+  sessionparts = sessionid.split('-')
+  if sessionparts[0] == 'hls' and len(sessionparts) > 1:
+    try:
+      origin = (lastsegment(int(sessionparts[1]) / 1000) - simulatorargs['window'] + 1) * dms / 1000
+    except ValueError:
+      pass
+  sessionnumber = int(sessionparts[2]) if len(sessionparts) > 2 and sessionparts[2].isdigit() else 0
+  origin = origin - (faultvalue(matched, 'trackingoffset', t) or 0)
+  avails = [] ; adcount = simulatorargs['adsperavail']
+  for k in range(int(t // interval) - 2, int(t // interval) + 1):
+    # Ad breaks start at the first segment starting at or after the ad interval
+    availstart = math.ceil(k * interval * 1000 / dms) * dms / 1000
+    if availstart > t:
+      continue
+    ads = []
+    # Unfilled avails of sessions are the same for every request of the session
+    filled = simulatorargs['adfill'] >= 100 or random.Random(sessionid + '/' + str(k)).random() * 100 < simulatorargs['adfill']
+    for i in range(adcount if filled else 0):
+      adstart = availstart - origin + i * adduration / adcount
+      creative = (i + sessionnumber) % simulatorargs['creatives'] if simulatorargs['creatives'] else i
+      ads.append({'adId': '%s_%s' % (k, i + 1), 'adTitle': 'ad' + str(i + 1), 'creativeId': str(1000 + creative), 'creativeSequence': str(i + 1), 'durationInSeconds': adduration / adcount, 'startTimeInSeconds': adstart,
+                  'trackingEvents': [{'eventId': '%s_%s_%s' % (k, i + 1, event), 'eventType': event, 'beaconUrls': ['http://%s/beacon/%s/%s/%s/%s' % (simulatorargs['host'], channel, k, i + 1, event)],
+                                      'startTimeInSeconds': adstart + fraction * adduration / adcount, 'durationInSeconds': 0} for event, fraction in trackingevents]})
+    avails.append({'availId': str(k), 'availProgramDateTime': isotime(availstart), 'durationInSeconds': adduration, 'startTimeInSeconds': availstart - origin, 'adBreakTrackingEvents': [], 'ads': ads})
+  return json.dumps({'avails': avails, 'nextToken': '', 'nonLinearAvailsList': []})
+
+
+class originrequesthandler(http.server.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    self.respond(True)
+
+  def do_HEAD(self):
+    self.respond(False)
+
+  # Session initialization, returns manifest and tracking URLs of a new session
+  def do_POST(self):
+    self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    path = urlparse(self.path).path.strip('/').split('/')
+    if path[0:2] == ['v1', 'session']:
+      path = path[3:]
+    if len(path) < 2 or not (path[-1].endswith('.m3u8') or path[-1].endswith('.mpd')):
+      self.sendresponse(400, b'', 'text/plain', True)
+      return
+    global sessioncount
+    with statslock:
+      stats['session'] = stats['session'] + 1
+      sessioncount = sessioncount + 1
+      sessionid = '%s-%s-%s' % ('hls' if path[-1].endswith('.m3u8') else 'dash', int(time.time() * 1000), sessioncount)
+    body = json.dumps({'manifestUrl': '/%s?aws.sessionId=%s' % ('/'.join(path), sessionid), 'trackingUrl': '/%s/tracking/%s' % (path[0], sessionid)}).encode('utf-8')
+    self.sendresponse(200, body, 'application/json', True)
+
+  def respond(self, sendbody:bool):
+    t = time.time()
+    path = urlparse(self.path).path.strip('/').split('/')
+    channel = path[0] ; name = path[-1]
+    if channel == 'beacon':
+      target = 'beacon'
+    elif name.endswith('.m3u8') or name.endswith('.mpd') or name == 'Manifest':
+      target = 'manifest'
+    elif len(path) > 1 and path[1] == 'tracking':
+      target = 'tracking'
+    else:
+      target = 'segment'
+    matched = getchannelfaults(channel) if target != 'beacon' else []
+    with statslock:
+      stats[target] = stats[target] + 1
+    # Response faults
+    for fault in matched:
+      if fault['type'] in ('http', 'slow') and fault['target'] in (target, 'all') and faultwindow(fault, t) != None:
+        if fault['type'] == 'slow':
+          time.sleep(fault['value'])
+        elif random.random() < fault['rate']:
+          self.sendresponse(int(fault['value']), b'', 'text/plain', sendbody)
+          return
+    if target == 'beacon':
+      self.sendresponse(204, b'', 'text/plain', sendbody)
+      return
+    if target == 'segment':
+      self.sendresponse(200, segmentbody, 'video/mp4', sendbody)
+      return
+    if target == 'tracking':
+      body = trackingresponse(matched, channel, path[2] if len(path) > 2 else '', t).encode('utf-8')
+      # Tracking responses change only at avail starts, conditional requests get 304 responses
+      etag = '"' + hashlib.md5(body).hexdigest()[0:16] + '"'
+      if self.headers.get('If-None-Match') == etag:
+        with statslock:
+          stats['notmodified'] = stats['notmodified'] + 1
+        self.sendresponse(304, b'', 'application/json', False, etag)
+      else:
+        self.sendresponse(200, self.compress(body), 'application/json', sendbody, etag)
+      return
+    # Manifests of stale channels are generated at the start of the fault window
+    for fault in matched:
+      if fault['type'] == 'stale' and faultwindow(fault, t) != None:
+        t = faultwindow(fault, t)
+    # Manifests of channels without faults are the same for all channels
+    key = (channel if matched else '', name, lastsegment(t), tuple(i['type'] for i in matched if i['type'] in requestfaults and faultwindow(i, t) != None), self.acceptsgzip())
+    body = responsecache.get(key)
+    if body == None:
+      if name == 'master.m3u8':
+        body = hlsmultivariantplaylist()
+      elif name.endswith('.m3u8'):
+        body = hlsmediaplaylist(matched, name[:-5], t)
+      elif name.endswith('.mpd'):
+        body = dashmanifest(matched, t)
+      else:
+        body = smoothmanifest(matched, t)
+      body = self.compress(body.encode('utf-8'))
+      if len(responsecache) > 100000:
+        responsecache.clear()
+      responsecache[key] = body
+    contenttype = 'application/vnd.apple.mpegurl' if name.endswith('.m3u8') else 'application/dash+xml' if name.endswith('.mpd') else 'text/xml'
+    self.sendresponse(200, body, contenttype, sendbody)
+
+  def acceptsgzip(self):
+    return simulatorargs['gzip'] and 'gzip' in self.headers.get('Accept-Encoding', '')
+
+  def compress(self, body:bytes):
+    return gzip.compress(body, 1) if self.acceptsgzip() else body
+
+  def sendresponse(self, status:int, body:bytes, contenttype:str, sendbody:bool, etag:str = None):
+    self.send_response(status)
+    self.send_header('Content-Type', contenttype)
+    if status != 304:
+      self.send_header('Content-Length', str(len(body)))
+    if etag:
+      self.send_header('ETag', etag)
+    if self.acceptsgzip() and contenttype not in ('video/mp4', 'text/plain') and status != 304:
+      self.send_header('Content-Encoding', 'gzip')
+    self.send_header('Cache-Control', 'max-age=' + str(int(simulatorargs['segmentduration'])))
+    self.end_headers()
+    if sendbody:
+      self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+class originserver(http.server.ThreadingHTTPServer):
+  daemon_threads = True
+  request_queue_size = 1024
+
+
+# Write endpoints file for canarymonitor.py with all simulated channels
+def writeendpointsfile(filename:str):
+  base = 'http://' + simulatorargs['host'] ; session = str(int(starttime * 1000))
+  with open(filename, 'w') as f:
+    for i in range(simulatorargs['channels']):
+      channel = 'ch' + str(i + 1)
+      for endpointtype in simulatorargs['formats']:
+        if endpointtype == 'hls':
+          f.write('%s-hls,%s/%s/master.m3u8,%s/%s/tracking/hls-%s\n' % (channel, base, channel, base, channel, session))
+        elif endpointtype == 'dash':
+          f.write('%s-dash,%s/%s/index.mpd,%s/%s/tracking/dash-%s\n' % (channel, base, channel, base, channel, session))
+        elif endpointtype == 'smooth':
+          f.write('%s-smooth,%s/%s/channel.ism/Manifest\n' % (channel, base, channel))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description = 'Local live origin simulator for HLS, DASH and Smooth with ad breaks, MediaTailor style tracking and scripted faults')
+  parser.add_argument('--port', type = int, help = 'listening port, e.g. 8080 (default: 8080)')
+  parser.add_argument('--segmentduration', type = float, help = 'segment duration [seconds], e.g. 6 or 1.92 (default: 2)')
+  parser.add_argument('--window', type = int, help = 'number of segments in manifests, e.g. 300 for a 10 minute DVR window of 2 second segments (default: 10)')
+  parser.add_argument('--variants', type = int, help = 'number of video renditions, e.g. 8 (default: 3)')
+  parser.add_argument('--adbreaks', type = str, help = 'ad break signaling, i.e. scte (CUE-OUT/CUE-IN and SpliceInsert), emt (MediaTailor style) or none (default: scte)')
+  parser.add_argument('--adinterval', type = int, help = 'time between ad break starts [seconds], e.g. 300 (default: 120)')
+  parser.add_argument('--adduration', type = int, help = 'ad break duration [seconds], e.g. 60 (default: 30)')
+  parser.add_argument('--adsperavail', type = int, help = 'number of ads in an avail of tracking responses, e.g. 4 (default: 2)')
+  parser.add_argument('--adfill', type = int, help = 'percent of avails with ads in tracking responses of sessions initialized by POST requests, e.g. 80 (default: 100)')
+  parser.add_argument('--creatives', type = int, help = 'number of creatives rotated by session number over ads of sessions, e.g. 5 (default: 0, same ads in all sessions)')
+  parser.add_argument('--segmentsize', type = int, help = 'size of segment responses [bytes], e.g. 1000000 (default: 10000)')
+  parser.add_argument('--gzip', action = 'store_true', help = 'compress manifests and tracking responses when requested by Accept-Encoding (default: False)')
+  parser.add_argument('--faults', type = str, help = 'JSON file with list of scripted faults, e.g. faults.json (default: no faults)')
+  parser.add_argument('--endpointsfile', type = str, help = 'write an endpoints file for canarymonitor.py with --channels channels, e.g. endpoints.csv')
+  parser.add_argument('--channels', type = int, help = 'number of channels in endpoints file, e.g. 2000 (default: 10)')
+  parser.add_argument('--formats', type = str, help = 'comma separated endpoint types in endpoints file, e.g. hls,dash,smooth (default: hls)')
+  parser.add_argument('--host', type = str, help = 'host and port in URLs of endpoints file and beacons, e.g. 10.0.0.5:8080 (default: localhost:<port>)')
+  args = parser.parse_args()
+
+  simulatorargs = {
+    'port': args.port if args.port else 8080,
+    'segmentduration': args.segmentduration if args.segmentduration else 2,
+    'window': args.window if args.window else 10,
+    'variants': args.variants if args.variants else 3,
+    'adbreaks': args.adbreaks if args.adbreaks else 'scte',
+    'adinterval': args.adinterval if args.adinterval else 120,
+    'adduration': args.adduration if args.adduration else 30,
+    'adsperavail': args.adsperavail if args.adsperavail else 2,
+    'adfill': args.adfill if args.adfill != None else 100,
+    'creatives': args.creatives if args.creatives else 0,
+    'segmentsize': args.segmentsize if args.segmentsize != None else 10000,
+    'gzip': args.gzip if args.gzip else False,
+    'channels': args.channels if args.channels else 10,
+    'formats': args.formats.split(',') if args.formats else ['hls'],
+  }
+  simulatorargs['host'] = args.host if args.host else 'localhost:' + str(simulatorargs['port'])
+  configure(simulatorargs)
+  if simulatorargs['adbreaks'] not in ('scte', 'emt', 'none') or simulatorargs['adduration'] >= simulatorargs['adinterval']:
+    print('Invalid ad break settings', file = sys.stderr)
+    sys.exit(1)
+
+  # Global variables
+  stats = {'manifest': 0, 'tracking': 0, 'segment': 0, 'beacon': 0, 'session': 0, 'notmodified': 0}
+  sessioncount = 0
+  statslock = threading.Lock()
+  try:
+    faults = loadfaults(args.faults) if args.faults else []
+  except Exception as e:
+    print('Error loading faults: ' + str(e), file = sys.stderr)
+    sys.exit(1)
+
+  if args.endpointsfile:
+    writeendpointsfile(args.endpointsfile)
+    print('Wrote ' + str(simulatorargs['channels'] * len(simulatorargs['formats'])) + ' endpoints to ' + args.endpointsfile)
+
+  server = originserver(('', simulatorargs['port']), originrequesthandler)
+  threading.Thread(target = server.serve_forever, name = 'origin', daemon = True).start()
+  print('Serving simulated origin on port ' + str(simulatorargs['port']) + ' with ' + str(len(faults)) + ' faults')
+  try:
+    while True:
+      time.sleep(30)
+      with statslock:
+        print(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S') + ' Requests per second: ' + ', '.join(k + ' ' + str(round(v / 30, 1)) for k, v in stats.items()))
+        for k in stats.keys():
+          stats[k] = 0
+  except KeyboardInterrupt:
+    server.shutdown()
@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+
+# Pack archive of manifests and tracking responses saved with --archiveformat pack or delta
+#
+# One append-only pack file per folder (rendition) per hour, e.g. 2026_10_19_02.pack:
+#   magic, then records of payload length, timestamp [microseconds], codec, filename length, filename, payload
+# and its index file, e.g. 2026_10_19_02.idx:
+#   entries of timestamp [microseconds], record offset in the pack file
+#
+# Records are appended in time order, so the index is sorted and the record nearest to a given time
+# is found with a binary search over the memory mapped index.
+#
+# With --archiveformat delta, most records are stored as a delta to the previous record of the pack:
+#   copy (byte offset and length in the previous record) and insert (bytes) operations on lines and XML tags,
+# with a full (keyframe) record at the start of every pack file and every --keyframeinterval records.
+#
+# With --zstd, records (keyframes with delta) are compressed with Zstandard using a dictionary trained per rendition:
+#   payload starts with the dictionary id (0 before the first dictionary is trained), the dictionary is saved
+#   next to the pack files as zstd_<id>.dict. Requires the zstandard package.
+
+import argparse
+import datetime
+import difflib
+import gzip
+import importlib.util
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import time
+import random
+from collections import deque
+from pathlib import Path
+
+packmagic = b'CMPACK1\n'
+packrecordheader = struct.Struct('<IqBB')
+packindexentry = struct.Struct('<qQ')
+codecnone = 0
+codecgzip = 1
+codecdelta = 2
+codeczstd = 3
+codecnames = {codecnone: 'none', codecgzip: 'gzip', codecdelta: 'delta', codeczstd: 'zstd'}
+zstdheader = struct.Struct('<I')
+zstddictionarysize = 16384
+zstddictionaries = {}
+deltatokens = re.compile(rb'[^\n>]*(?:>\n?|\n)|[^\n>]+')
+deltacopy = 1
+deltainsert = 2
+
+
+# Pack name of the hour of a timestamp [microseconds]
+def packname(timestamp:int):
+  return datetime.datetime.utcfromtimestamp(timestamp / 1000000).strftime('%Y_%m_%d_%H')
+
+
+# Open pack and index files of the hour for appending
+def openpackwriter(folderpath, name:str):
+  pack = Path(folderpath, name + '.pack').open('ab')
+  if pack.tell() == 0:
+    pack.write(packmagic)
+  index = Path(folderpath, name + '.idx').open('ab')
+  return {'name': name, 'pack': pack, 'index': index, 'previous': None, 'sincekeyframe': 0, 'keyframeratio': 1.0}
+
+
+# Encode content as keyframe or as delta to the previous content of the pack, whichever is smaller, returns (codec, payload)
+# Keyframes are compressed by compress function returning (codec, payload) when provided
+def encodecontent(packwriter, content:bytes, compress, keyframeinterval:int):
+  previous = packwriter['previous'] ; delta = None
+  packwriter['previous'] = content
+  if previous != None and packwriter['sincekeyframe'] < keyframeinterval - 1:
+    delta = encodedelta(previous, content)
+    # The keyframe is compressed only when the delta is not smaller than the keyframe at the compression ratio of the last keyframe
+    if len(delta) < len(content) * packwriter['keyframeratio']:
+      packwriter['sincekeyframe'] = packwriter['sincekeyframe'] + 1
+      return codecdelta, delta
+  if compress:
+    keyframe = compress(content)
+  else:
+    keyframe = (codecnone, content)
+  if len(content) > 0:
+    packwriter['keyframeratio'] = len(keyframe[1]) / len(content)
+  if delta != None and len(delta) < len(keyframe[1]):
+    packwriter['sincekeyframe'] = packwriter['sincekeyframe'] + 1
+    return codecdelta, delta
+  packwriter['sincekeyframe'] = 0
+  return keyframe
+
+
+def compressgzip(content:bytes):
+  return codecgzip, gzip.compress(content)
+
+
+# Zstandard state of a rendition, the first dictionary is trained from samplecount records and a new one every rotateinterval records
+def createzstdstate(samplecount:int, rotateinterval:int, level:int = 3):
+  return {'dictionary': None, 'id': 0, 'compressor': None, 'samples': deque(maxlen = samplecount),
+          'sincetraining': 0, 'rotateinterval': rotateinterval, 'level': level}
+
+
+# Keep record as training sample, a new dictionary is trained and saved into folderpath when due
+# Delta packs sample every record before encoding it, so that their dictionaries are trained as often as without deltas
+def samplezstd(folderpath, zstdstate, content:bytes):
+  import zstandard
+  zstdstate['samples'].append(content)
+  zstdstate['sincetraining'] = zstdstate['sincetraining'] + 1
+  if (zstdstate['dictionary'] == None and len(zstdstate['samples']) == zstdstate['samples'].maxlen) or (zstdstate['dictionary'] != None and zstdstate['sincetraining'] >= zstdstate['rotateinterval']):
+    zstdstate['sincetraining'] = 0
+    try:
+      dictionary = zstandard.train_dictionary(zstddictionarysize, list(zstdstate['samples']))
+    except zstandard.ZstdError:
+      # Not enough different samples, e.g. identical tracking responses, try again with the next rotation
+      dictionary = None
+    if dictionary != None and dictionary.dict_id() != 0:
+      savezstddictionary(folderpath, dictionary)
+      zstdstate['dictionary'] = dictionary ; zstdstate['id'] = dictionary.dict_id()
+      zstdstate['compressor'] = zstandard.ZstdCompressor(level = zstdstate['level'], dict_data = dictionary)
+
+
+# Compress with the current dictionary of the rendition, a new dictionary is saved into folderpath, returns (codec, payload)
+def compresszstd(folderpath, zstdstate, content:bytes, sample:bool = True):
+  import zstandard
+  if sample:
+    samplezstd(folderpath, zstdstate, content)
+  if zstdstate['compressor'] == None:
+    zstdstate['compressor'] = zstandard.ZstdCompressor(level = zstdstate['level'])
+  return codeczstd, zstdheader.pack(zstdstate['id']) + zstdstate['compressor'].compress(content)
+
+
+def savezstddictionary(folderpath, dictionary):
+  dictionarypath = Path(folderpath, 'zstd_' + str(dictionary.dict_id()) + '.dict')
+  if not dictionarypath.exists():
+    with open(str(dictionarypath) + '.tmp', 'wb') as f:
+      f.write(dictionary.as_bytes())
+    os.replace(str(dictionarypath) + '.tmp', dictionarypath)
+
+
+def decompresszstd(folderpath, payload:bytes):
+  import zstandard
+  dictionaryid = zstdheader.unpack_from(payload)[0]
+  key = (str(folderpath), dictionaryid)
+  if key not in zstddictionaries:
+    if dictionaryid == 0:
+      zstddictionaries[key] = zstandard.ZstdDecompressor()
+    else:
+      dictionary = zstandard.ZstdCompressionDict(Path(folderpath, 'zstd_' + str(dictionaryid) + '.dict').read_bytes())
+      zstddictionaries[key] = zstandard.ZstdDecompressor(dict_data = dictionary)
+  return zstddictionaries[key].decompress(payload[zstdheader.size:])
+
+
+def encodevarint(value:int):
+  result = bytearray()
+  while value > 127:
+    result.append((value & 127) | 128)
+    value = value >> 7
+  result.append(value)
+  return result
+
+
+def decodevarint(buffer, offset:int):
+  value = 0 ; shift = 0
+  while True:
+    byte = buffer[offset]
+    offset = offset + 1
+    value = value | ((byte & 127) << shift)
+    if byte < 128:
+      return value, offset
+    shift = shift + 7
+
+
+# Delta of two contents on line and XML tag boundaries, previous content is reused with copy operations
+def encodedelta(previous:bytes, content:bytes):
+  previoustokens = deltatokens.findall(previous)
+  tokens = deltatokens.findall(content)
+  previousoffsets = [0]
+  for i in previoustokens:
+    previousoffsets.append(previousoffsets[-1] + len(i))
+  delta = bytearray()
+  position = 0
+  for previousposition, tokenposition, size in difflib.SequenceMatcher(None, previoustokens, tokens, autojunk = False).get_matching_blocks():
+    if tokenposition > position:
+      inserted = b''.join(tokens[position:tokenposition])
+      delta.append(deltainsert) ; delta += encodevarint(len(inserted)) ; delta += inserted
+    if size > 0:
+      delta.append(deltacopy) ; delta += encodevarint(previousoffsets[previousposition])
+      delta += encodevarint(previousoffsets[previousposition + size] - previousoffsets[previousposition])
+    position = tokenposition + size
+  return bytes(delta)
+
+
+def applydelta(previous:bytes, delta:bytes):
+  content = bytearray()
+  offset = 0
+  while offset < len(delta):
+    operation = delta[offset]
+    if operation == deltacopy:
+      start, offset = decodevarint(delta, offset + 1)
+      length, offset = decodevarint(delta, offset)
+      content += previous[start:start + length]
+    elif operation == deltainsert:
+      length, offset = decodevarint(delta, offset + 1)
+      content += delta[offset:offset + length]
+      offset = offset + length
+    else:
+      raise ValueError('Unknown delta operation ' + str(operation))
+  return bytes(content)
+
+
+# Append record to pack file, then its entry to index file, returns record offset
+def appendpackrecord(packwriter, timestamp:int, filename:str, codec:int, payload:bytes):
+  filenamebytes = filename.encode('utf-8')[:255]
+  offset = packwriter['pack'].tell()
+  packwriter['pack'].write(packrecordheader.pack(len(payload), timestamp, codec, len(filenamebytes)) + filenamebytes + payload)
+  packwriter['pack'].flush()
+  packwriter['index'].write(packindexentry.pack(timestamp, offset))
+  packwriter['index'].flush()
+  return offset
+
+
+def closepackwriter(packwriter):
+  packwriter['pack'].close()
+  packwriter['index'].close()
+
+
+# Read record at offset, returns dictionary with timestamp, filename, codec and payload (still encoded)
+def readpackrecord(buffer, offset:int):
+  length, timestamp, codec, filenamelength = packrecordheader.unpack_from(buffer, offset)
+  start = offset + packrecordheader.size
+  return {'offset': offset, 'timestamp': timestamp, 'codec': codec,
+          'filename': bytes(buffer[start:start + filenamelength]).decode('utf-8'),
+          'payload': bytes(buffer[start + filenamelength:start + filenamelength + length])}
+
+
+# Decode payload of a record, delta records need the content of the previous record of the pack
+# and zstd records the folder of the pack with dictionaries
+def decodepayload(record, previous:bytes = None, folderpath = None):
+  if record['codec'] == codecdelta:
+    if previous == None:
+      raise ValueError('Delta record at offset ' + str(record['offset']) + ' without previous content')
+    return applydelta(previous, record['payload'])
+  elif record['codec'] == codecgzip:
+    return gzip.decompress(record['payload'])
+  elif record['codec'] == codeczstd:
+    return decompresszstd(folderpath, record['payload'])
+  elif record['codec'] == codecnone:
+    return record['payload']
+  raise ValueError('Unknown codec ' + str(record['codec']) + ' in record at offset ' + str(record['offset']))
+
+
+# Iterate over all records of a pack file, a truncated last record (e.g. after a crash) is skipped
+def iterpackrecords(packpath):
+  with open(packpath, 'rb') as f:
+    if os.fstat(f.fileno()).st_size <= len(packmagic):
+      return
+    with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+      if mm[:len(packmagic)] != packmagic:
+        raise ValueError(str(packpath) + ' is not a pack file')
+      offset = len(packmagic)
+      while offset + packrecordheader.size <= len(mm):
+        length, timestamp, codec, filenamelength = packrecordheader.unpack_from(mm, offset)
+        end = offset + packrecordheader.size + filenamelength + length
+        if end > len(mm):
+          break
+        yield readpackrecord(mm, offset)
+        offset = end
+
+
+# Iterate over all records of a pack file with their decoded content
+def iterpackcontents(packpath):
+  previous = None
+  for record in iterpackrecords(packpath):
+    record['content'] = decodepayload(record, previous, Path(packpath).parent)
+    previous = record['content']
+    yield record
+
+
+# Write index file again from pack file
+def rebuildpackindex(packpath):
+  indexpath = Path(packpath).with_suffix('.idx')
+  with open(str(indexpath) + '.tmp', 'wb') as f:
+    for record in iterpackrecords(packpath):
+      f.write(packindexentry.pack(record['timestamp'], record['offset']))
+  os.replace(str(indexpath) + '.tmp', indexpath)
+  return indexpath
+
+
+# Binary search for the index entry nearest to timestamp, returns (position, timestamp, offset) or None
+def findindexentry(indexpath, timestamp:int):
+  with open(indexpath, 'rb') as f:
+    count = os.fstat(f.fileno()).st_size // packindexentry.size
+    if count == 0:
+      return None
+    with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+      low = 0 ; high = count
+      while low < high:
+        middle = (low + high) // 2
+        if packindexentry.unpack_from(mm, middle * packindexentry.size)[0] < timestamp:
+          low = middle + 1
+        else:
+          high = middle
+      candidates = [(i,) + packindexentry.unpack_from(mm, i * packindexentry.size) for i in (low - 1, low) if 0 <= i < count]
+  return min(candidates, key = lambda entry: abs(entry[1] - timestamp))
+
+
+# Read record at index position with decoded content, delta records are decoded from the preceding keyframe
+def readpackcontent(packpath, indexpath, position:int):
+  with open(indexpath, 'rb') as indexfile, open(packpath, 'rb') as packfile:
+    with mmap.mmap(indexfile.fileno(), 0, access = mmap.ACCESS_READ) as indexmm, mmap.mmap(packfile.fileno(), 0, access = mmap.ACCESS_READ) as packmm:
+      records = [readpackrecord(packmm, packindexentry.unpack_from(indexmm, position * packindexentry.size)[1])]
+      while records[-1]['codec'] == codecdelta and position > 0:
+        position = position - 1
+        records.append(readpackrecord(packmm, packindexentry.unpack_from(indexmm, position * packindexentry.size)[1]))
+  previous = None
+  for record in reversed(records):
+    record['content'] = decodepayload(record, previous, Path(packpath).parent)
+    previous = record['content']
+  return records[0]
+
+
+# Find record nearest to timestamp [microseconds] in a folder, looks into the packs of the hour and both neighbouring hours
+# Returns the record with decoded content or None
+def findnearestrecord(folder, timestamp:int):
+  nearest = None
+  for hour in (-1, 0, 1):
+    name = packname(timestamp + hour * 3600000000)
+    for packpath in (Path(folder, name + '.pack'), Path(folder, name[0:10].replace('_', '-'), name + '.pack')):
+      if not packpath.exists():
+        continue
+      indexpath = packpath.with_suffix('.idx')
+      if not indexpath.exists():
+        rebuildpackindex(packpath)
+      entry = findindexentry(indexpath, timestamp)
+      if entry and (nearest == None or abs(entry[1] - timestamp) < abs(nearest[2][1] - timestamp)):
+        nearest = (packpath, indexpath, entry)
+  if nearest == None:
+    return None
+  return readpackcontent(nearest[0], nearest[1], nearest[2][0])
+
+
+# Compare files, gzip files and pack files with delta records and zstd dictionaries on manifests saved with --manifests
+# into a folder, reports sizes, compression ratios, encoding and compression CPU time and reconstruction speed
+def benchmark(folder, keyframeinterval:int):
+  samples = []
+  for filepath in sorted(Path(folder).glob('*')):
+    if not filepath.is_file() or filepath.suffix in ('.pack', '.idx', '.dict'):
+      continue
+    content = filepath.read_bytes()
+    if filepath.suffix == '.gz':
+      content = gzip.decompress(content)
+    samples.append((filepath.name, content))
+  if len(samples) == 0:
+    print('No saved manifests found in ' + str(folder))
+    return
+  rawsize = sum(len(content) for filename, content in samples)
+  start = time.process_time()
+  gzipsize = sum(len(gzip.compress(content)) for filename, content in samples)
+  gziptime = time.process_time() - start
+  print('Manifests: ' + str(len(samples)) + ', files: ' + str(rawsize) + ' bytes, gzip files: ' + str(gzipsize) + ' bytes (ratio ' + '{:.1f}'.format(rawsize / gzipsize) + ')'
+        + ', gzip CPU time ' + '{:.3f}'.format(gziptime / len(samples) * 1000) + ' ms per manifest')
+  configurations = [('Delta pack', keyframeinterval, 'none'), ('Delta pack with gzip keyframes', keyframeinterval, 'gzip')]
+  if importlib.util.find_spec('zstandard') != None:
+    configurations = configurations + [('Pack with zstd dictionaries', 1, 'zstd'), ('Delta pack with zstd dictionary keyframes', keyframeinterval, 'zstd')]
+  else:
+    print('Install the zstandard package to include zstd dictionaries')
+  with tempfile.TemporaryDirectory() as temporaryfolder:
+    for number, (description, interval, codec) in enumerate(configurations):
+      packfolder = Path(temporaryfolder, str(number))
+      packfolder.mkdir()
+      packwriter = openpackwriter(packfolder, 'benchmark')
+      zstdstate = createzstdstate(min(100, len(samples)), 1000)
+      compresstime = [0.0]
+      def compress(content):
+        start = time.process_time()
+        if codec == 'gzip':
+          result = compressgzip(content)
+        else:
+          result = compresszstd(packfolder, zstdstate, content, interval == 1)
+        compresstime[0] = compresstime[0] + time.process_time() - start
+        return result
+      start = time.perf_counter()
+      for i, (filename, content) in enumerate(samples):
+        if codec == 'zstd' and interval > 1:
+          samplezstd(packfolder, zstdstate, content)
+        codecpayload = encodecontent(packwriter, content, compress if codec != 'none' else None, interval)
+        appendpackrecord(packwriter, i, filename, codecpayload[0], codecpayload[1])
+      encodetime = time.perf_counter() - start
+      closepackwriter(packwriter)
+      packpath = Path(packfolder, 'benchmark.pack')
+      indexpath = packpath.with_suffix('.idx')
+      packsize = sum(i.stat().st_size for i in packfolder.iterdir())
+      start = time.perf_counter()
+      for i, record in enumerate(iterpackcontents(packpath)):
+        if record['content'] != samples[i][1]:
+          raise ValueError('Reconstructed ' + samples[i][0] + ' differs from the original')
+      sequentialtime = time.perf_counter() - start
+      positions = [random.randrange(len(samples)) for i in range(min(1000, len(samples)))]
+      start = time.perf_counter()
+      for i in positions:
+        readpackcontent(packpath, indexpath, i)
+      randomtime = time.perf_counter() - start
+      print(description + ': ' + str(packsize) + ' bytes (ratio ' + '{:.1f}'.format(rawsize / packsize) + ')'
+            + ', encoding ' + '{:.3f}'.format(encodetime / len(samples) * 1000) + ' ms per manifest'
+            + (', compression CPU time ' + '{:.3f}'.format(compresstime[0] / len(samples) * 1000) + ' ms per manifest' if codec != 'none' else '')
+            + ', sequential reconstruction ' + '{:.1f}'.format(rawsize / sequentialtime / 1000000) + ' MB/s'
+            + ', random access ' + '{:.3f}'.format(randomtime / len(positions) * 1000) + ' ms per manifest')
+
+
+def parsetimestamp(text:str):
+  when = datetime.datetime.fromisoformat(text.replace('Z', '+00:00'))
+  if when.tzinfo == None:
+    when = when.replace(tzinfo = datetime.timezone.utc)
+  return int(when.timestamp() * 1000000)
+
+
+def formattimestamp(timestamp:int):
+  return datetime.datetime.utcfromtimestamp(timestamp / 1000000).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description = 'Read pack archives written by canarymonitor.py with --archiveformat pack or delta')
+  parser.add_argument('--folder', type = str, help = 'rendition folder with pack files, e.g. manifests/myendpoint-v1')
+  parser.add_argument('--time', type = str, help = 'UTC time of the record to extract from --folder, the nearest record is returned, e.g. 2026-10-19T02:51:15.300')
+  parser.add_argument('--output', type = str, help = 'file to write the extracted record to (default: standard output)')
+  parser.add_argument('--list', type = str, help = 'pack file to list records of')
+  parser.add_argument('--unpack', type = str, help = 'pack file to unpack into separate files in --outputfolder')
+  parser.add_argument('--outputfolder', type = str, help = 'folder for --unpack (default: current folder)')
+  parser.add_argument('--reindex', type = str, help = 'pack file to write the index file again for')
+  parser.add_argument('--benchmark', type = str, help = 'folder with manifests saved by --manifests to measure delta pack and zstd compression ratio and reconstruction speed on, e.g. manifests/myendpoint-v1')
+  parser.add_argument('--keyframeinterval', type = int, help = 'keyframe interval for --benchmark (default: 60)')
+  args = parser.parse_args()
+
+  if args.folder and args.time:
+    record = findnearestrecord(args.folder, parsetimestamp(args.time))
+    if record == None:
+      print('No records found around ' + args.time, file = sys.stderr)
+      sys.exit(1)
+    print(formattimestamp(record['timestamp']) + ' ' + record['filename'], file = sys.stderr)
+    if args.output:
+      Path(args.output).write_bytes(record['content'])
+    else:
+      sys.stdout.buffer.write(record['content'])
+  elif args.list:
+    for record in iterpackrecords(args.list):
+      print(str(record['offset']) + '\t' + formattimestamp(record['timestamp']) + '\t' + codecnames.get(record['codec'], str(record['codec'])) + '\t' + str(len(record['payload'])) + '\t' + record['filename'])
+  elif args.unpack:
+    outputfolder = Path(args.outputfolder if args.outputfolder else '.')
+    outputfolder.mkdir(parents = True, exist_ok = True)
+    for record in iterpackcontents(args.unpack):
+      Path(outputfolder, record['filename']).write_bytes(record['content'])
+  elif args.reindex:
+    print('Written ' + str(rebuildpackindex(args.reindex)))
+  elif args.benchmark:
+    benchmark(args.benchmark, args.keyframeinterval if args.keyframeinterval else 60)
+  else:
+    parser.print_help()
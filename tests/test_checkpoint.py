@@ -0,0 +1,125 @@
+# Warm restart from a checkpoint in the middle of an ad break, monitor runs against a local media playlist
+import json
+import signal
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+canarymonitor = str(Path(__file__).resolve().parent.parent / 'canarymonitor.py')
+
+
+# Media playlist of 2 second segments, tags are lists of tags before segments by media sequence
+class Playlist:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.set(0, 5, {})
+
+  def set(self, first:int, count:int, tags:dict):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:2', '#EXT-X-MEDIA-SEQUENCE:' + str(first)]
+    for n in range(first, first + count):
+      lines.extend(tags.get(n, []))
+      lines.extend(['#EXTINF:2.000,', 'segment_' + str(n) + '.ts'])
+    with self.lock:
+      self.body = ('\n'.join(lines) + '\n').encode()
+
+
+@pytest.fixture
+def origin():
+  playlist = Playlist()
+
+  class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      with playlist.lock:
+        body = playlist.body
+      self.send_response(200)
+      self.send_header('Content-Type', 'application/vnd.apple.mpegurl')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, format, *args):
+      pass
+
+  server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+  threading.Thread(target = server.serve_forever, daemon = True).start()
+  yield playlist, 'http://127.0.0.1:' + str(server.server_address[1]) + '/live.m3u8'
+  server.shutdown()
+
+
+def startmonitor(tmp_path, url):
+  return subprocess.Popen([sys.executable, canarymonitor, '--url', url, '--frequency', '0.5', '--stale', '60', '--checkpoint', '--checkpointinterval', '1', '--emf', '--logsfolder', str(tmp_path / 'logs')],
+                          cwd = tmp_path, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+
+def stopmonitor(process):
+  process.send_signal(signal.SIGINT)
+  process.wait(timeout = 30)
+
+
+# Wait until the checkpoint has a rendition state matching a condition
+def waitforcheckpoint(tmp_path, condition):
+  deadline = time.time() + 30
+  while time.time() < deadline:
+    try:
+      states = list(json.loads((tmp_path / 'logs' / 'checkpoint.json').read_text())['renditions'].values())
+      if states and condition(states[0]):
+        return states[0]
+    except (OSError, ValueError):
+      pass
+    time.sleep(0.2)
+  raise AssertionError('Checkpoint state not found')
+
+
+# Monitor until the checkpoint has an ad break of 30 seconds started at segment 5 and the last segment 6
+def checkpointinadbreak(tmp_path, playlist, url):
+  process = startmonitor(tmp_path, url)
+  try:
+    waitforcheckpoint(tmp_path, lambda state: state['proberesponse']['lastmediasequence'] == 4)
+    playlist.set(1, 5, {5: ['#EXT-X-CUE-OUT:30']})
+    waitforcheckpoint(tmp_path, lambda state: state['proberesponse']['lastmediasequence'] == 5)
+    playlist.set(2, 5, {5: ['#EXT-X-CUE-OUT:30'], 6: ['#EXT-X-CUE-OUT-CONT:ElapsedTime=2.000,Duration=30']})
+    return waitforcheckpoint(tmp_path, lambda state: state['proberesponse']['lastmediasequence'] == 6)
+  finally:
+    stopmonitor(process)
+
+
+def resume(tmp_path, url):
+  process = startmonitor(tmp_path, url)
+  try:
+    waitforcheckpoint(tmp_path, lambda state: state['proberesponse']['lastmediasequence'] == 8)
+  finally:
+    stopmonitor(process)
+  return (tmp_path / 'logs' / 'monitor.log').read_text()
+
+
+def test_resume_in_ad_break_checks_duration_at_cue_in(tmp_path, origin):
+  playlist, url = origin
+  state = checkpointinadbreak(tmp_path, playlist, url)
+  assert state['manifestinfo']['adbreak'] == True
+  assert state['manifestinfo']['advertisedadbreakduration'] == 30.0
+  assert state['manifestinfo']['actualadbreakduration'] == 4.0
+
+  # Segment 7 of the ad break and the end of the ad break at segment 8 are published during the restart
+  playlist.set(3, 6, {5: ['#EXT-X-CUE-OUT:30'], 6: ['#EXT-X-CUE-OUT-CONT:ElapsedTime=2.000,Duration=30'], 7: ['#EXT-X-CUE-OUT-CONT:ElapsedTime=4.000,Duration=30'], 8: ['#EXT-X-CUE-IN']})
+  log = resume(tmp_path, url)
+  assert 'Resuming monitoring of' in log
+  assert 'Ad break was shorter than advertised by 24.000 seconds, advertised: 30.0, actual: 6.000' in log
+  metrics = [json.loads(line) for line in (tmp_path / 'logs' / 'metrics.emf').read_text().splitlines()]
+  assert any(metric.get('addurationdelta') in (-24.0, [-24.0]) for metric in metrics)
+
+
+def test_resume_drops_ad_break_not_in_manifest(tmp_path, origin):
+  playlist, url = origin
+  checkpointinadbreak(tmp_path, playlist, url)
+
+  # The ad break left the manifest window during the restart, without markers of the ad break in the manifest
+  playlist.set(6, 3, {})
+  log = resume(tmp_path, url)
+  assert 'Resuming monitoring of' in log
+  assert 'resuming without ad break' in log
+  assert 'than advertised' not in log
@@ -0,0 +1,78 @@
+# Concurrent archive writers storing the same segment in the segment store
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import canarymonitor
+
+logger = logging.getLogger('test')
+content = b'segment' * 1000
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+  monkeypatch.setattr(canarymonitor, 'userargs', {'segmentsfolder': str(tmp_path / 'segments'), 'archivefsync': 'none'}, raising = False)
+  monkeypatch.setattr(canarymonitor, 'segmentstore', {'blobs': {}, 'totalsize': 0, 'storedbytes': 0, 'referencedbytes': 0}, raising = False)
+  monkeypatch.setattr(canarymonitor, 'segmentstorelock', threading.Lock(), raising = False)
+  monkeypatch.setattr(canarymonitor, 'createdfolders', set(), raising = False)
+  monkeypatch.setattr(canarymonitor, 'archivebatch', threading.local(), raising = False)
+  return tmp_path / 'segments'
+
+
+# Rename of the first writer is slow, so later writers find the blob before it is written
+def slowreplace(fail:bool):
+  replace = os.replace ; calls = []
+  def slow(source, destination):
+    calls.append(source)
+    time.sleep(0.3)
+    if fail and len(calls) == 1:
+      raise OSError('Disk full')
+    replace(source, destination)
+  return slow
+
+
+def storeconcurrently(folder, count:int, delay:float = 0):
+  results = [None] * count
+  def store(i):
+    results[i] = canarymonitor.storesegment(logger, folder, 'segment_' + str(i) + '.ts', content)
+  threads = []
+  for i in range(count):
+    threads.append(threading.Thread(target = store, args = (i,), name = 'archive' + str(i)))
+    threads[-1].start()
+    time.sleep(delay)
+  for thread in threads:
+    thread.join()
+  return results
+
+
+def test_concurrent_writers_of_same_segment(store, monkeypatch):
+  monkeypatch.setattr(os, 'replace', slowreplace(False))
+  folder = store / 'rendition'
+  results = storeconcurrently(folder, 8)
+  blobs = [i for i in (store / 'blobs').glob('*/*')]
+  assert len(blobs) == 1 and blobs[0].read_bytes() == content
+  assert results == [blobs[0]] * 8
+  assert len((folder / 'references.tsv').read_text().splitlines()) == 8
+  assert canarymonitor.segmentstore['storedbytes'] == len(content)
+  assert canarymonitor.segmentstore['totalsize'] == len(content)
+  assert canarymonitor.segmentstore['referencedbytes'] == 8 * len(content)
+  assert 'pending' not in canarymonitor.segmentstore['blobs'][blobs[0].name.split('.')[0]]
+
+
+def test_failed_first_writer_is_rolled_back(store, monkeypatch):
+  monkeypatch.setattr(os, 'replace', slowreplace(True))
+  folder = store / 'rendition'
+  results = storeconcurrently(folder, 2, 0.05)
+  blobs = [i for i in (store / 'blobs').glob('*/*')]
+  assert len(blobs) == 1 and blobs[0].read_bytes() == content
+  assert results == [None, blobs[0]]
+  assert len((folder / 'references.tsv').read_text().splitlines()) == 1
+  assert canarymonitor.segmentstore['storedbytes'] == len(content)
+  assert canarymonitor.segmentstore['totalsize'] == len(content)
+  assert canarymonitor.segmentstore['referencedbytes'] == len(content)